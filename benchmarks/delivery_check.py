@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+"""
+邮件投递检查
+
+用模拟的SMTP服务器（不访问网络）检查分批发送和重试：
+    - 临时拒收（4xx）的收件人重试时收到的是原始邮件
+    - 永久拒收（5xx）的收件人不重试，记录为失败
+    - 收件人只写在SMTP信封中，各批次发送同一份邮件
+
+使用方法:
+    python benchmarks/delivery_check.py
+
+检查未通过时以退出码 1 结束，可用于 CI。
+"""
+
+import contextlib
+import email
+import io
+import smtplib
+import sys
+
+from fund_universe import epr
+
+SMTP_CONFIG = {'host': 'smtp.example.com', 'port': 587, 'username': 'sender@example.com', 'password': 'x', 'use_tls': True}
+SETTINGS = {'batch_size': 2, 'max_connections': 2, 'retries': 2, 'backoff_seconds': 0, 'max_backoff_seconds': 0, 'log': None}
+
+class FakeSMTP:
+    """模拟的SMTP连接：按脚本拒收收件人，记录每次 sendmail 的信封和邮件内容"""
+
+    # 收件人 -> 依次返回的拒收响应（用完后接收），以及记录的 (信封收件人, 邮件内容)，由 run_check 设置
+    refusals = None
+    calls = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def ehlo(self, *args):
+        pass
+
+    def starttls(self, *args, **kwargs):
+        pass
+
+    def login(self, *args):
+        pass
+
+    def noop(self):
+        return 250, b'OK'
+
+    def sendmail(self, sender, recipients, message):
+        FakeSMTP.calls.append((list(recipients), message))
+        refused = {}
+        for recipient in recipients:
+            responses = FakeSMTP.refusals.get(recipient)
+            if responses:
+                refused[recipient] = responses.pop(0)
+        if len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+def html_part(message):
+    """取出邮件的HTML正文"""
+    for part in email.message_from_string(message).walk():
+        if part.get_content_type() == 'text/html':
+            return part.get_payload(decode=True).decode('utf-8')
+    return ''
+
+def run_check():
+    """运行一次投递，返回未通过的检查项列表"""
+    FakeSMTP.calls = []
+    FakeSMTP.refusals = {
+        'busy@example.com': [(451, b'4.2.1 mailbox busy')],
+        'gone@example.com': [(550, b'5.1.1 no such user')],
+    }
+    recipients = ['a@example.com', 'busy@example.com', 'gone@example.com', 'b@example.com', 'c@example.com']
+    smtplib.SMTP = smtplib.SMTP_SSL = FakeSMTP
+    epr.close_smtp_pool()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = epr.deliver_email(SMTP_CONFIG, recipients, '检查', '<p>正文</p>', '正文', settings=SETTINGS)
+    epr.close_smtp_pool()
+
+    outcomes = {result['recipient']: result for result in results}
+    failures = []
+    expected = {
+        'a@example.com': ('sent', 1),
+        'busy@example.com': ('sent', 2),
+        'gone@example.com': ('failed', 1),
+        'b@example.com': ('sent', 1),
+        'c@example.com': ('sent', 1),
+    }
+    for recipient, (status, attempts) in expected.items():
+        outcome = outcomes.get(recipient) or {}
+        if (outcome.get('status'), outcome.get('attempts')) != (status, attempts):
+            failures.append(f"{recipient}: 期望 {status}（{attempts} 次），实际 {outcome.get('status')}（{outcome.get('attempts')} 次）")
+
+    messages = {message for _, message in FakeSMTP.calls}
+    if len(messages) != 1:
+        failures.append(f"各次投递的邮件内容应相同，实际有 {len(messages)} 种（重试可能发送了错误的内容）")
+    retries = [message for envelope, message in FakeSMTP.calls if envelope == ['busy@example.com']]
+    if not retries:
+        failures.append("临时拒收的收件人没有单独重试")
+    elif retries[0] != FakeSMTP.calls[0][1] or not isinstance(retries[0], str) or '<p>' not in html_part(retries[0]):
+        failures.append(f"重试发送的不是原始邮件: {retries[0][:60]!r}")
+    if any(recipient in str(message) for recipient in recipients for _, message in FakeSMTP.calls):
+        failures.append("收件人地址出现在邮件头中（应只写在SMTP信封中）")
+    return failures
+
+def main():
+    failures = run_check()
+    if failures:
+        print("❌ 邮件投递检查未通过:")
+        for item in failures:
+            print(f"  - {item}")
+        return 1
+    print("✅ 邮件投递检查通过（临时拒收重试原始邮件、永久拒收不重试、收件人只在信封中）")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# -*- coding: UTF-8 -*-
+"""
+基准测试用的基金数据
+
+提供两种离线数据来源，通过主程序的数据提供者接口替换 akshare：
+    - 合成数据：按真实接口的列结构生成任意规模的ETF/LOF行情、开放式基金净值和基金基本信息
+    - 录制数据：用 RecordingProvider 从真实接口录制一次，之后离线回放
+"""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import etf_premium_rate as epr
+
+# 主程序用到的数据接口（录制和回放的范围）
+RECORDED_FUNCTIONS = ('fund_etf_spot_em', 'fund_lof_spot_em', 'fund_open_fund_daily_em', 'fund_name_em')
+
+PURCHASE_STATUSES = ['开放申购', '限大额', '暂停申购', '限大额(单日100万元)', '限额1000元', '场内买入', '封闭期', '']
+REDEEM_STATUSES = ['开放赎回', '暂停赎回', '封闭期', '场内卖出']
+FEES = ['0.15%', '0.12%', '1.50%', '0.00%', '']
+FUND_CATEGORIES = ['指数型-股票', '股票型', '混合型-偏股', '债券型-长债', 'QDII-普通股票', '商品（不含QDII）']
+
+def synthetic_universe(n_funds, seed=0, nav_date=None):
+    """按真实接口的列结构生成规模为 n_funds 的基金数据
+
+    n_funds 只基金在场内交易（70% ETF、30% LOF），开放式基金净值表另外包含同样数量的场外基金。
+    返回 {接口名: DataFrame}
+    """
+    rng = np.random.default_rng(seed)
+    n_etf = int(n_funds * 0.7)
+    n_lof = n_funds - n_etf
+    make_codes = lambda prefix, count, width: np.char.add(prefix, np.char.zfill(np.arange(count).astype(str), max(width, len(str(count)))))
+    etf_codes = make_codes('5', n_etf, 5)
+    lof_codes = make_codes('16', n_lof, 4)
+    other_codes = make_codes('0', n_funds, 5)
+
+    etf_price = rng.uniform(0.5, 5.0, n_etf).round(3)
+    etf_iopv = (etf_price * (1 + rng.normal(0, 0.01, n_etf))).round(4)
+    etf_iopv[::40] = np.nan  # 部分ETF没有实时估值
+    etf_volume = rng.integers(0, 10 ** 8, n_etf).astype(float)
+    etf_spot = pd.DataFrame({
+        '代码': etf_codes.astype(object),
+        '名称': np.char.add('ETF', np.arange(n_etf).astype(str)).astype(object),
+        '最新价': etf_price,
+        'IOPV实时估值': etf_iopv,
+        '基金折价率': ((etf_price - etf_iopv) / etf_iopv * 100).round(2),
+        '涨跌额': rng.normal(0, 0.02, n_etf).round(3),
+        '涨跌幅': rng.normal(0, 1.0, n_etf).round(2),
+        '成交量': etf_volume,
+        '成交额': etf_volume * etf_price,
+        '开盘价': etf_price,
+        '最高价': etf_price,
+        '最低价': etf_price,
+        '昨收': etf_price,
+        '换手率': rng.uniform(0, 5, n_etf).round(2),
+        '流通市值': rng.uniform(1e7, 1e11, n_etf).round(0),
+        '总市值': rng.uniform(1e7, 1e11, n_etf).round(0),
+    })
+    etf_spot.loc[::97, '最新价'] = np.nan  # 停牌
+
+    lof_price = rng.uniform(0.5, 5.0, n_lof).round(3)
+    lof_volume = rng.integers(0, 10 ** 6, n_lof).astype(float)
+    lof_spot = pd.DataFrame({
+        '代码': lof_codes.astype(object),
+        '名称': np.char.add('LOF', np.arange(n_lof).astype(str)).astype(object),
+        '最新价': lof_price,
+        '涨跌额': rng.normal(0, 0.02, n_lof).round(3),
+        '涨跌幅': rng.normal(0, 1.0, n_lof).round(2),
+        '成交量': lof_volume,
+        '成交额': lof_volume * lof_price,
+        '开盘价': lof_price,
+        '最高价': lof_price,
+        '最低价': lof_price,
+        '昨收': lof_price,
+        '换手率': rng.uniform(0, 5, n_lof).round(2),
+        '流通市值': rng.uniform(1e6, 1e10, n_lof).round(0),
+        '总市值': rng.uniform(1e6, 1e10, n_lof).round(0),
+    })
+
+    # 开放式基金净值：LOF的净值与场内价格接近，其余为场外基金
+    codes = np.concatenate([etf_codes, lof_codes, other_codes]).astype(object)
+    n_nav = len(codes)
+    nav = rng.uniform(0.5, 5.0, n_nav)
+    nav[n_etf:n_etf + n_lof] = lof_price * (1 + rng.normal(0, 0.02, n_lof))
+    previous_nav = nav * (1 + rng.normal(0, 0.01, n_nav))
+    as_text = lambda values: np.char.mod('%.4f', values).astype(object)
+    latest_nav = as_text(nav)
+    latest_nav[::13] = ''  # 当日净值尚未公布
+    nav_date = pd.Timestamp(nav_date or epr.nav_snapshot_date())
+    previous_date = nav_date - pd.offsets.BDay(1)
+    daily = pd.DataFrame({
+        '基金代码': codes,
+        '基金简称': np.char.add('基金', codes.astype(str)).astype(object),
+        f'{nav_date:%Y-%m-%d}-单位净值': latest_nav,
+        f'{nav_date:%Y-%m-%d}-累计净值': as_text(nav * 1.5),
+        f'{previous_date:%Y-%m-%d}-单位净值': as_text(previous_nav),
+        f'{previous_date:%Y-%m-%d}-累计净值': as_text(previous_nav * 1.5),
+        '日增长值': as_text(nav - previous_nav),
+        '日增长率': np.char.mod('%.2f', (nav / previous_nav - 1) * 100).astype(object),
+        '申购状态': np.array(PURCHASE_STATUSES, dtype=object)[rng.integers(0, len(PURCHASE_STATUSES), n_nav)],
+        '赎回状态': np.array(REDEEM_STATUSES, dtype=object)[rng.integers(0, len(REDEEM_STATUSES), n_nav)],
+        '手续费': np.array(FEES, dtype=object)[rng.integers(0, len(FEES), n_nav)],
+    })
+
+    names = pd.DataFrame({
+        '基金代码': codes,
+        '拼音缩写': 'JJ',
+        '基金简称': daily['基金简称'],
+        '基金类型': np.array(FUND_CATEGORIES, dtype=object)[rng.integers(0, len(FUND_CATEGORIES), n_nav)],
+        '拼音全称': 'JIJIN',
+    })
+    return {
+        'fund_etf_spot_em': etf_spot,
+        'fund_lof_spot_em': lof_spot,
+        'fund_open_fund_daily_em': daily,
+        'fund_name_em': names,
+    }
+
+def record_universe(fixture_dir):
+    """从真实接口录制一次数据，保存到 fixture_dir（需要网络）"""
+    recorder = epr.RecordingProvider(epr.AkshareProvider(), fixture_dir)
+    for func_name in RECORDED_FUNCTIONS:
+        print(f"正在录制 {func_name}...")
+        df = recorder.fetch(func_name)
+        print(f"已保存 {len(df)} 条数据")
+
+def load_recorded_universe(fixture_dir):
+    """读取录制的数据（每个接口取最后一次录制的结果），返回 {接口名: DataFrame}"""
+    replay = epr.ReplayProvider(fixture_dir)
+    return {func_name: replay.fetch(func_name) for func_name in RECORDED_FUNCTIONS}
+
+class UniverseProvider:
+    """离线数据提供者：每次调用返回一份副本（与真实接口一样每次得到新表），其他接口一律不可用"""
+
+    name = 'benchmark'
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def fetch(self, func_name, *args, **kwargs):
+        if func_name not in self.tables:
+            raise RuntimeError(f'离线基准测试不提供 {func_name}')
+        return self.tables[func_name].copy()
+
+def install_universe(tables):
+    """用给定数据替换主程序的数据提供者"""
+    return epr.set_provider(UniverseProvider(tables))
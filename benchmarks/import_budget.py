@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+"""
+启动时间预算检查
+
+在子进程中运行 check-config 和从报告缓存渲染（render），检查它们没有导入 pandas、numpy、pyarrow
+和 akshare，且耗时不超过导入这些依赖所需时间的一定比例（默认 50%）。
+
+使用方法:
+    python benchmarks/import_budget.py                 # 默认预算
+    python benchmarks/import_budget.py --fraction 0.3  # 更严格的预算
+    python benchmarks/import_budget.py --repeat 5      # 每项测量 5 次取中位数
+
+超出预算或导入了重依赖时以退出码 1 结束，可用于 CI。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from fund_universe import SRC_DIR, epr, install_universe, synthetic_universe
+
+# 只有获取数据和计算的子命令才需要的依赖
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'akshare')
+
+# 子进程：使用临时缓存目录运行一个子命令，结束后报告已导入的重依赖
+RUNNER = '''
+import contextlib, json, os, sys, yaml
+sys.path.insert(0, {src_dir!r})
+import etf_premium_rate as epr
+load_config = epr.load_config
+def temp_cache_config():
+    config = load_config()
+    if config is None:
+        with open(os.path.join(os.path.dirname({src_dir!r}), 'config.example.yaml'), encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+    config['cache'] = dict(config.get('cache') or {{}}, dir={cache_dir!r})
+    return config
+epr.load_config = temp_cache_config
+with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+    code = epr.main({argv!r})
+heavy = [name for name in {heavy!r} if name in sys.modules]
+sys.stderr.write(json.dumps({{'code': code, 'heavy': heavy}}))
+'''
+
+COMMANDS = {
+    'check-config': ['check-config'],
+    'render': ['render', '--format', 'html'],
+}
+
+def measure(code, repeat):
+    """运行 python -c code repeat 次，返回 (耗时中位数, 最后一次的标准错误输出)"""
+    samples = []
+    stderr = ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        samples.append(time.perf_counter() - start)
+        stderr = proc.stderr
+        if proc.returncode != 0:
+            raise RuntimeError(f"子进程运行失败: {stderr[-500:]}")
+    return statistics.median(samples), stderr
+
+def prepare_report_cache(cache_dir, n_funds):
+    """用合成数据计算一次，按当前配置的报告参数写入报告缓存"""
+    install_universe(synthetic_universe(n_funds))
+    epr.configure_cache({'cache': {'dir': cache_dir}})
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = epr.load_config()
+    if config is None:
+        # 没有 config.yaml 时与子进程一样使用示例配置
+        with open(os.path.join(os.path.dirname(SRC_DIR), 'config.example.yaml'), encoding='utf-8') as f:
+            config = yaml.safe_load(f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df = epr.get_etf_data()
+        epr.save_report_cache(config, df)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ETF/LOF溢价率启动时间预算检查')
+    parser.add_argument('--fraction', type=float, default=0.5, help='耗时不超过导入重依赖耗时的比例')
+    parser.add_argument('--repeat', type=int, default=3, help='每项测量次数，取中位数')
+    parser.add_argument('--funds', type=int, default=2000, help='报告缓存使用的合成基金数量')
+    args = parser.parse_args(argv)
+    repeat = max(1, args.repeat)
+
+    reference, _ = measure('import ' + ', '.join(HEAVY_MODULES) + ', pyarrow.dataset, pyarrow.parquet', repeat)
+    budget = reference * args.fraction
+    print(f"导入 {', '.join(HEAVY_MODULES)} 耗时 {reference:.2f}s，预算 {budget:.2f}s（{args.fraction:.0%}）")
+
+    cache_dir = tempfile.mkdtemp(prefix='etf-import-budget-')
+    violations = []
+    try:
+        prepare_report_cache(cache_dir, args.funds)
+        for name, command in COMMANDS.items():
+            code = RUNNER.format(src_dir=SRC_DIR, cache_dir=cache_dir, argv=command, heavy=HEAVY_MODULES)
+            elapsed, stderr = measure(code, repeat)
+            result = json.loads(stderr.strip().splitlines()[-1])
+            print(f"  {name}: {elapsed:.2f}s（导入耗时的 {elapsed / reference:.0%}），退出码 {result['code']}")
+            if result['code'] != 0:
+                violations.append(f"{name} 运行失败（退出码 {result['code']}）")
+            if result['heavy']:
+                violations.append(f"{name} 导入了 {', '.join(result['heavy'])}")
+            if elapsed > budget:
+                violations.append(f"{name} 耗时 {elapsed:.2f}s 超过预算 {budget:.2f}s")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if violations:
+        print("\n❌ 启动时间预算检查未通过:")
+        for item in violations:
+            print(f"  - {item}")
+        return 1
+    print("\n✅ 启动时间在预算之内")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# -*- coding: UTF-8 -*-
+"""
+离线基准测试
+
+用合成数据或录制数据替换数据提供者，测量 get_etf_data() 和报告渲染的吞吐量、
+各阶段耗时和内存峰值，并与保存的基线对比，耗时或内存明显增加时标记为退化。
+
+基线是在某台机器上测得的绝对耗时，不提交到仓库（已加入 .gitignore）：在运行对比的机器上先用
+--update-baseline 生成；基线由其他机器或其他 Python/pandas 版本生成时跳过对比。
+
+使用方法:
+    python benchmarks/run_benchmarks.py                          # 合成数据 1k/10k/100k
+    python benchmarks/run_benchmarks.py --sizes 1000 10000       # 指定规模
+    python benchmarks/run_benchmarks.py --fixtures benchmarks/fixtures   # 回放录制数据
+    python benchmarks/run_benchmarks.py --record benchmarks/fixtures     # 从真实接口录制（需要网络）
+    python benchmarks/run_benchmarks.py --update-baseline        # 在本机生成（更新）基线
+
+存在退化时以退出码 1 结束，可用于 CI。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import unicodedata
+
+from fund_universe import epr, install_universe, load_recorded_universe, record_universe, synthetic_universe
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# 计时的阶段：阶段名 -> 主程序中的函数名（嵌套阶段的耗时互相包含）
+STAGES = {
+    '数据获取': 'fetch_sources_concurrently',
+    '净值库': 'get_all_fund_nav',
+    '状态解析': 'normalize_status_columns',
+    'get_etf_data': 'get_etf_data',
+    '报告数据': 'build_report_data',
+    '渲染': 'render_report',
+}
+
+class StageTimer:
+    """替换主程序中的函数，累计每个阶段的耗时"""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.elapsed = {}
+        self._originals = {}
+
+    def _wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.elapsed[stage] = self.elapsed.get(stage, 0.0) + time.perf_counter() - start
+        return timed
+
+    def __enter__(self):
+        for stage, name in self.stages.items():
+            self._originals[name] = getattr(epr, name)
+            setattr(epr, name, self._wrap(stage, self._originals[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for name, func in self._originals.items():
+            setattr(epr, name, func)
+
+def reset_state(cache_dir):
+    """每次冷启动前清空进程内缓存，并使用空的缓存目录"""
+    epr.configure_cache({'cache': {'dir': cache_dir}})
+    epr.reset_daily_tables()
+    epr._circuit_breaker = None
+    epr._table_sources.clear()
+
+def run_once(top_n):
+    """运行一次完整流程（获取数据 + 生成报告），返回 (各阶段耗时, 结果行数)"""
+    with StageTimer(STAGES) as timer, contextlib.redirect_stdout(io.StringIO()):
+        df = epr.get_etf_data()
+        start = time.perf_counter()
+        epr.generate_reports(df, top_n=top_n)
+        timer.elapsed['generate_reports'] = time.perf_counter() - start
+        start = time.perf_counter()
+        epr.generate_email_html(df, top_n=top_n)
+        timer.elapsed['generate_email_html'] = time.perf_counter() - start
+    timer.elapsed['总计'] = timer.elapsed['get_etf_data'] + timer.elapsed['generate_reports']
+    return timer.elapsed, 0 if df is None else len(df)
+
+def benchmark_universe(label, tables, repeat, top_n):
+    """对一份基金数据分别测量冷启动（净值库需要加载）和常驻刷新（净值库已在内存）"""
+    install_universe(tables)
+    n_funds = len(tables['fund_etf_spot_em']) + len(tables['fund_lof_spot_em'])
+    results = {}
+    cache_root = tempfile.mkdtemp(prefix='etf-bench-')
+    try:
+        for scenario in ('cold', 'warm'):
+            samples = []
+            rows = 0
+            for i in range(repeat):
+                if scenario == 'cold' or i == 0:
+                    reset_state(os.path.join(cache_root, f"{scenario}-{i}"))
+                if scenario == 'warm' and i == 0:
+                    run_once(top_n)  # 预热：加载净值库
+                elapsed, rows = run_once(top_n)
+                samples.append(elapsed)
+            stages = {stage: statistics.median(sample.get(stage, 0.0) for sample in samples) for stage in samples[0]}
+            results[scenario] = {
+                'rows': rows,
+                'stages': {stage: round(seconds, 6) for stage, seconds in stages.items()},
+                'throughput': round(n_funds / stages['总计'], 1) if stages['总计'] > 0 else None,
+            }
+
+        # 内存峰值单独测量（tracemalloc 会拖慢运行，不与计时混在一起）
+        reset_state(os.path.join(cache_root, 'memory'))
+        tracemalloc.start()
+        run_once(top_n)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['cold']['peak_mb'] = round(peak / 1024 / 1024, 2)
+    finally:
+        shutil.rmtree(cache_root, ignore_errors=True)
+    return {'label': label, 'funds': n_funds, 'nav_rows': len(tables['fund_open_fund_daily_em']), **results}
+
+def _pad(text, width):
+    """按显示宽度左对齐（中文字符占两列）"""
+    display = sum(2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1 for ch in text)
+    return text + ' ' * max(0, width - display)
+
+def print_result(result):
+    """打印一个规模的测量结果"""
+    cold, warm = result['cold'], result['warm']
+    print(f"\n📊 {result['label']}：场内基金 {result['funds']} 只，净值表 {result['nav_rows']} 行，有效结果 {cold['rows']} 行")
+    print(f"  吞吐量: 冷启动 {cold['throughput']} 只/秒，常驻刷新 {warm['throughput']} 只/秒；内存峰值 {cold['peak_mb']}MB")
+    print(f"  {_pad('阶段', 22)}{_pad('冷启动(ms)', 14)}常驻刷新(ms)")
+    for stage in cold['stages']:
+        print(f"  {_pad(stage, 22)}{cold['stages'][stage] * 1000:<14.1f}{warm['stages'].get(stage, 0.0) * 1000:.1f}")
+
+def compare_with_baseline(results, baseline, tolerance, min_delta):
+    """与基线对比，返回退化项列表（耗时或内存超过基线的 1 + tolerance 倍）"""
+    regressions = []
+    previous = {item['label']: item for item in baseline.get('results', [])}
+    for result in results:
+        base = previous.get(result['label'])
+        if base is None:
+            continue
+        for scenario in ('cold', 'warm'):
+            for stage, seconds in result[scenario]['stages'].items():
+                old = base.get(scenario, {}).get('stages', {}).get(stage)
+                # 绝对差值很小的阶段只是计时噪声，不视为退化
+                if old and seconds > old * (1 + tolerance) and seconds - old > min_delta:
+                    regressions.append(f"{result['label']} {scenario} {stage}: {old * 1000:.1f}ms → {seconds * 1000:.1f}ms")
+        old_peak = base.get('cold', {}).get('peak_mb')
+        new_peak = result['cold'].get('peak_mb')
+        if old_peak and new_peak and new_peak > old_peak * (1 + tolerance):
+            regressions.append(f"{result['label']} 内存峰值: {old_peak}MB → {new_peak}MB")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ETF/LOF溢价率离线基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='合成数据的场内基金数量')
+    parser.add_argument('--fixtures', help='使用录制数据目录，而不是合成数据')
+    parser.add_argument('--record', metavar='DIR', help='从真实接口录制数据到该目录后退出（需要网络）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景重复次数，取中位数')
+    parser.add_argument('--top-n', type=int, default=100, help='报告排行榜数量')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件路径')
+    parser.add_argument('--update-baseline', '--save-baseline', dest='update_baseline', action='store_true',
+                        help='将本次结果保存为本机的基线')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='超过基线的比例达到该值时视为退化')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='小于该绝对差值（毫秒）的变化不视为退化')
+    parser.add_argument('--output', help='将结果另存为JSON文件')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_universe(args.record)
+        return 0
+
+    if args.fixtures:
+        universes = [(f"录制数据({os.path.basename(os.path.normpath(args.fixtures))})", lambda: load_recorded_universe(args.fixtures))]
+    else:
+        universes = [(f"合成数据 {size}", lambda size=size: synthetic_universe(size)) for size in args.sizes]
+
+    # 预热：首次调用时的导入、正则编译等一次性开销不计入第一个规模
+    warmup_dir = tempfile.mkdtemp(prefix='etf-bench-warmup-')
+    try:
+        install_universe(synthetic_universe(500))
+        reset_state(warmup_dir)
+        run_once(args.top_n)
+    finally:
+        shutil.rmtree(warmup_dir, ignore_errors=True)
+
+    results = []
+    for label, load in universes:
+        print(f"正在测量 {label}...")
+        result = benchmark_universe(label, load(), repeat=max(1, args.repeat), top_n=args.top_n)
+        print_result(result)
+        results.append(result)
+
+    report = {
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'pandas': epr.pd.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 已保存基线: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\n⚠️  基线文件不存在: {args.baseline}（在本机使用 --update-baseline 生成）")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    # 绝对耗时只在同一环境下可比
+    environment = ('host', 'python', 'pandas', 'machine')
+    mismatched = [f"{key} {baseline.get(key)} → {report[key]}" for key in environment if baseline.get(key) != report[key]]
+    if mismatched:
+        print(f"\n⚠️  基线不是在当前环境生成的（{', '.join(mismatched)}），跳过对比；请在本机使用 --update-baseline 重新生成")
+        return 0
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_delta_ms / 1000)
+    if regressions:
+        print(f"\n❌ 发现 {len(regressions)} 项性能退化（超过基线 {args.tolerance:.0%}）:")
+        for item in regressions:
+            print(f"  - {item}")
+        return 1
+    print(f"\n✅ 与基线相比没有性能退化（容差 {args.tolerance:.0%}）")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,21 @@ ETF/LOF溢价率报告生成器
     - 支持定时自动发送
 
 使用方法:
-    python src/etf_premium_rate.py
+    python src/etf_premium_rate.py                  # 运行一次并发送报告（等同于 run）
+    python src/etf_premium_rate.py run --alerts     # 只推送与上一次相比的变动提醒
+    python src/etf_premium_rate.py fetch            # 获取数据并保存报告缓存，不发送邮件
+    python src/etf_premium_rate.py render -o report.html   # 用缓存的报告数据渲染报告
+    python src/etf_premium_rate.py send             # 发送缓存的报告
+    python src/etf_premium_rate.py check-config     # 检查配置文件
+    python src/etf_premium_rate.py daemon           # 常驻运行，交易时段内定时刷新
+    python src/etf_premium_rate.py serve            # HTTP服务，在内存中保存最新排行供查询
+    python src/etf_premium_rate.py history 510300   # 查看溢价率历史的滚动统计
+    python src/etf_premium_rate.py batch jobs/      # 批量运行多个配置文件，只获取一次数据
+    python src/etf_premium_rate.py run --record     # 运行一次并录制所有接口返回的数据
+    python src/etf_premium_rate.py run --replay     # 回放最新录制的会话（不访问网络）
+    
+    render、send 和 check-config 不导入 pandas、pyarrow 和 akshare，启动很快
+    旧版的 --daemon、--history 代码 参数仍然可用，分别等同于 daemon、history 子命令
 
 配置文件:
     config.yaml - 邮件和报告配置（需要从 config.example.yaml 复制并填写）
@@ -21,442 +35,2170 @@ ETF/LOF溢价率报告生成器
     - 溢价率为正表示溢价，为负表示折价
 """
 
-import pandas as pd
-import akshare as ak
+import importlib
 import time
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone, timedelta, time as dt_time
 import sys
+import argparse
+import codecs
+import functools
+import gzip
+import contextlib
 import yaml
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import Header
 import os
+import re
+import json
+import shutil
+import queue
+import threading
+import tracemalloc
+import zlib
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from report_templates import REPORT_TEMPLATES, ALERT_TEMPLATES
+
+class LazyModule:
+    """延迟导入的模块：第一次访问属性时才真正导入
+    
+    pandas、pyarrow 和 akshare 导入较慢（akshare 还会引入大量依赖），检查配置、用缓存的报告数据
+    渲染等不需要它们的命令因此可以快速启动
+    """
+    
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+    
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        value = getattr(module, attr)
+        # 模块属性不会变化，缓存后之后的访问不再经过 __getattr__
+        self.__dict__[attr] = value
+        return value
+    
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<LazyModule {self.__dict__['_name']} ({state})>"
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+ak = LazyModule('akshare')
+pa = LazyModule('pyarrow')
+ds = LazyModule('pyarrow.dataset')
+pq = LazyModule('pyarrow.parquet')
+pa_fs = LazyModule('pyarrow.fs')
+pa_csv = LazyModule('pyarrow.csv')
+# 只有HTTP服务模式需要
+asyncio = LazyModule('asyncio')
+
+# 北京时间（交易日、报告时间等均按东八区计算）
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 运行指标配置（可在 config.yaml 的 metrics 部分覆盖）
+DEFAULT_METRICS_SETTINGS = {
+    'enabled': True,  # 是否导出运行指标
+    'dir': 'metrics',  # 指标输出目录，相对路径基于缓存目录
+    'jsonl': 'metrics.jsonl',  # 每个阶段一行的JSON记录（追加）
+    'prometheus': 'etf_premium_rate.prom',  # Prometheus textfile（每次运行覆盖）
+    'tracemalloc': False,  # 是否记录各阶段内的Python内存峰值（绝对值，会使运行明显变慢）
+    'deadline_seconds': 600,  # 运行时限，接近时给出警告并导出供告警使用
+}
+_metrics_settings = dict(DEFAULT_METRICS_SETTINGS)
+
+class Span:
+    """一个阶段的计时：墙钟时间、CPU时间、输入/输出行数、数据量和内存峰值
+    
+    主线程中记录进程CPU时间，工作线程中只记录该线程的CPU时间
+    """
+    
+    def __init__(self, recorder, name, parent=None, **fields):
+        self.recorder = recorder
+        self.name = name
+        self.parent = parent
+        self.fields = fields
+        self.peak_bytes = None
+        self._cpu_clock = time.process_time if threading.current_thread() is threading.main_thread() else time.thread_time
+        self.started_at = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = self._cpu_clock()
+        self.ended = False
+    
+    def set(self, **fields):
+        """补充记录字段（rows_in、rows_out、bytes、status 等）"""
+        self.fields.update(fields)
+        return self
+    
+    def end(self, **fields):
+        """结束计时并记录"""
+        if self.ended:
+            return self
+        self.ended = True
+        self.fields.update(fields)
+        self.recorder._finish(self, time.perf_counter() - self._wall, self._cpu_clock() - self._cpu)
+        return self
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.fields.setdefault('status', 'error')
+            self.fields.setdefault('error', f"{exc_type.__name__}: {exc}")
+        self.end()
+        return False
+
+class MetricsRecorder:
+    """运行指标记录器：收集各阶段的 Span，导出为JSON行和Prometheus textfile"""
+    
+    def __init__(self, trace_memory=False):
+        self.run_id = datetime.now(BEIJING_TZ).strftime('%Y%m%d-%H%M%S')
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.records = []
+        self.trace_memory = trace_memory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+    
+    def current(self):
+        """当前线程中最内层的未结束阶段"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+    
+    def span(self, name, parent=None, **fields):
+        """开始一个阶段（可作为 with 语句使用，也可以手动调用 end()）
+        
+        parent 为空时使用当前线程中最内层的阶段；在工作线程中可显式传入发起线程的阶段
+        """
+        stack = self._stack()
+        span = Span(self, name, parent=parent or (stack[-1] if stack else None), **fields)
+        if self.trace_memory and tracemalloc.is_tracing():
+            # 重置峰值前，先把当前峰值计入所有未结束的上层阶段
+            _, peak = tracemalloc.get_traced_memory()
+            for open_span in stack:
+                open_span.peak_bytes = max(open_span.peak_bytes or 0, peak)
+            tracemalloc.reset_peak()
+        stack.append(span)
+        return span
+    
+    def _finish(self, span, wall, cpu):
+        stack = self._stack()
+        if span in stack:
+            stack.remove(span)
+        if self.trace_memory and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            span.peak_bytes = max(span.peak_bytes or 0, peak)
+            if span.parent is not None:
+                span.parent.peak_bytes = max(span.parent.peak_bytes or 0, span.peak_bytes)
+        record = {
+            'run_id': self.run_id,
+            'stage': span.name,
+            'parent': span.parent.name if span.parent is not None else None,
+            'start': datetime.fromtimestamp(span.started_at, BEIJING_TZ).isoformat(timespec='milliseconds'),
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'peak_bytes': span.peak_bytes,
+            'thread': threading.current_thread().name,
+        }
+        record.update(span.fields)
+        with self._lock:
+            self.records.append(record)
+    
+    def record(self, name, wall_seconds, parent=None, **fields):
+        """直接记录一个没有经过 span() 的阶段（例如超时后仍在运行的请求）"""
+        record = {'run_id': self.run_id, 'stage': name, 'parent': parent, 'wall_seconds': round(wall_seconds, 6)}
+        record.update(fields)
+        with self._lock:
+            self.records.append(record)
+    
+    def elapsed(self):
+        return time.perf_counter() - self.started
+    
+    def stage_totals(self):
+        """按阶段名汇总：{阶段: {'count', 'wall_seconds', 'cpu_seconds', 'rows_out', 'bytes', 'peak_bytes', 'errors'}}"""
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            total = totals.setdefault(record['stage'], {
+                'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_out': 0, 'bytes': 0, 'peak_bytes': 0, 'errors': 0,
+            })
+            total['count'] += 1
+            total['wall_seconds'] += record.get('wall_seconds') or 0.0
+            total['cpu_seconds'] += record.get('cpu_seconds') or 0.0
+            total['rows_out'] += int(record.get('rows_out') or 0)
+            total['bytes'] += int(record.get('bytes') or 0)
+            total['peak_bytes'] = max(total['peak_bytes'], int(record.get('peak_bytes') or 0))
+            total['errors'] += int(record.get('status') in ('error', 'timeout'))
+        return totals
+    
+    def export_jsonl(self, path):
+        """追加写入JSON行（每个阶段一行）"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    
+    def export_prometheus(self, path, deadline_seconds=None, success=True):
+        """写入Prometheus textfile（供 node_exporter textfile collector 读取，先写临时文件再重命名）"""
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+        
+        lines = []
+        gauges = [
+            ('stage_wall_seconds', 'wall_seconds', '各阶段墙钟耗时（秒）'),
+            ('stage_cpu_seconds', 'cpu_seconds', '各阶段CPU耗时（秒）'),
+            ('stage_rows', 'rows_out', '各阶段输出行数'),
+            ('stage_bytes', 'bytes', '各阶段获取的数据量（字节）'),
+            ('stage_peak_bytes', 'peak_bytes', '各阶段内的Python内存峰值（字节，需开启tracemalloc）'),
+            ('stage_calls', 'count', '各阶段执行次数'),
+            ('stage_errors', 'errors', '各阶段出错或超时次数'),
+        ]
+        totals = self.stage_totals()
+        for metric, key, help_text in gauges:
+            lines.append(f"# HELP etf_premium_{metric} {help_text}")
+            lines.append(f"# TYPE etf_premium_{metric} gauge")
+            for stage, total in sorted(totals.items()):
+                lines.append(f'etf_premium_{metric}{{stage="{escape(stage)}"}} {total[key]:g}')
+        run_metrics = [
+            ('run_duration_seconds', self.elapsed(), '本次运行总耗时（秒）'),
+            ('run_success', 1 if success else 0, '本次运行是否成功'),
+            ('run_timestamp_seconds', self.started_at, '本次运行开始时间（Unix时间戳）'),
+        ]
+        if deadline_seconds:
+            run_metrics.append(('run_deadline_seconds', float(deadline_seconds), '运行时限（秒）'))
+        for metric, value, help_text in run_metrics:
+            lines.append(f"# HELP etf_premium_{metric} {help_text}")
+            lines.append(f"# TYPE etf_premium_{metric} gauge")
+            lines.append(f"etf_premium_{metric} {value:.6f}".rstrip('0').rstrip('.'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f"{path}.tmp", path)
+
+# 全局变量：本次运行的指标记录器
+_metrics = MetricsRecorder()
+
+def configure_metrics(config):
+    """根据配置更新运行指标设置（已记录的阶段保留）"""
+    metrics_config = (config or {}).get('metrics') or {}
+    _metrics_settings.update({k: v for k, v in metrics_config.items() if v is not None})
+    _metrics.trace_memory = bool(_metrics_settings['tracemalloc'])
+    if _metrics.trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _metrics
+
+def metric_span(name, parent=None, **fields):
+    """开始一个阶段的计时（with metric_span('render'): ...）"""
+    return _metrics.span(name, parent=parent, **fields)
+
+def frame_bytes(df):
+    """数据表占用的内存字节数（用作获取的数据量）"""
+    if isinstance(df, pd.DataFrame):
+        return int(df.memory_usage(index=True, deep=True).sum())
+    return 0
+
+def export_metrics(success=True):
+    """导出本次运行的指标，并在接近运行时限时给出警告；返回导出后新的记录器"""
+    global _metrics
+    recorder = _metrics
+    if _metrics_settings['enabled']:
+        metrics_dir = str(_metrics_settings['dir'])
+        if not os.path.isabs(metrics_dir):
+            metrics_dir = os.path.join(get_cache_dir(), metrics_dir)
+        try:
+            recorder.export_jsonl(os.path.join(metrics_dir, _metrics_settings['jsonl']))
+            recorder.export_prometheus(
+                os.path.join(metrics_dir, _metrics_settings['prometheus']),
+                deadline_seconds=_metrics_settings['deadline_seconds'],
+                success=success,
+            )
+        except Exception as e:
+            print(f"导出运行指标失败: {e}")
+    
+    totals = recorder.stage_totals()
+    if totals:
+        summary = ', '.join(f"{stage} {total['wall_seconds']:.2f}s" for stage, total in totals.items() if '.' not in stage)
+        print(f"⏱️  各阶段耗时: {summary}")
+    deadline = float(_metrics_settings['deadline_seconds'] or 0)
+    if deadline and recorder.elapsed() > deadline * 0.8:
+        print(f"⚠️  本次运行耗时 {recorder.elapsed():.0f}秒，已接近运行时限 {deadline:.0f}秒")
+    _metrics = MetricsRecorder(trace_memory=recorder.trace_memory)
+    return _metrics
+
+# akshare接口对应的上游主机（同一主机的所有请求共享一个限速器）
+AKSHARE_HOSTS = {
+    'fund_etf_spot_em': 'push2.eastmoney.com',
+    'fund_lof_spot_em': 'push2.eastmoney.com',
+    'fund_open_fund_daily_em': 'fund.eastmoney.com',
+    'fund_etf_fund_info_em': 'fund.eastmoney.com',
+    'fund_open_fund_info_em': 'fund.eastmoney.com',
+    'fund_name_em': 'fund.eastmoney.com',
+    'fund_etf_hist_sina': 'finance.sina.com.cn',
+    'fund_etf_category_sina': 'finance.sina.com.cn',
+}
+
+# 限速配置（可在 config.yaml 的 rate_limit 部分覆盖）
+DEFAULT_RATE_LIMIT = {
+    'rate': 2.0,  # 每秒请求数
+    'burst': 4,  # 突发请求数（令牌桶容量）
+}
+
+# 出现这些错误信息时视为被上游限流
+THROTTLE_MARKERS = ('429', 'too many requests', '403', 'forbidden', 'rate limit', '频繁')
+
+class TokenBucket:
+    """令牌桶限速器（线程安全）：出错时降低速率并暂停，成功后逐步恢复"""
+    
+    def __init__(self, rate, burst, min_rate=0.1, max_backoff=60.0):
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.min_rate = min(float(min_rate), self.base_rate)
+        self.max_backoff = float(max_backoff)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.consecutive_errors = 0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def acquire(self):
+        """获取一个令牌，必要时等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+    
+    def on_success(self):
+        """请求成功：速率逐步恢复到配置值"""
+        with self._lock:
+            self.consecutive_errors = 0
+            self.rate = min(self.base_rate, self.rate * 2)
+    
+    def on_error(self, throttled=False):
+        """请求失败：降低速率，并按连续失败次数指数退避"""
+        with self._lock:
+            self.consecutive_errors += 1
+            self.rate = max(self.min_rate, self.rate / (4 if throttled else 2))
+            backoff = min(self.max_backoff, 0.5 * 2 ** (self.consecutive_errors - 1))
+            if throttled:
+                backoff = min(self.max_backoff, backoff * 4)
+            self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+
+class RateLimiter:
+    """按上游主机划分的共享限速器"""
+    
+    def __init__(self, default=None, hosts=None):
+        self.default = dict(DEFAULT_RATE_LIMIT, **(default or {}))
+        self.hosts = hosts or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+    
+    def bucket(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                settings = dict(self.default, **(self.hosts.get(host) or {}))
+                self._buckets[host] = TokenBucket(settings['rate'], settings['burst'])
+            return self._buckets[host]
+    
+    def call(self, host, func, *args, **kwargs):
+        """在限速器控制下发起一次请求"""
+        bucket = self.bucket(host)
+        bucket.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            message = str(e).lower()
+            bucket.on_error(throttled=any(marker in message for marker in THROTTLE_MARKERS))
+            raise
+        bucket.on_success()
+        return result
+
+# 全局变量：所有数据获取共享的限速器
+_rate_limiter = RateLimiter()
+
+def configure_rate_limit(config):
+    """根据配置重建限速器"""
+    global _rate_limiter
+    rate_config = (config or {}).get('rate_limit') or {}
+    _rate_limiter = RateLimiter(rate_config.get('default'), rate_config.get('hosts'))
+
+class AkshareProvider:
+    """数据提供者：调用akshare接口（经过对应上游主机的限速器）"""
+    
+    name = 'akshare'
+    
+    def fetch(self, func_name, *args, **kwargs):
+        host = AKSHARE_HOSTS.get(func_name, 'default')
+        return _rate_limiter.call(host, getattr(ak, func_name), *args, **kwargs)
+
+def _call_key(func_name, args, kwargs):
+    """一次接口调用的标识（接口名和参数），用于录制和回放时对应"""
+    return json.dumps([func_name, list(args), kwargs], ensure_ascii=False, sort_keys=True, default=str)
+
+class RecordingProvider:
+    """录制数据提供者：包装另一个数据提供者，把每次返回的数据表按顺序保存到会话目录
+    
+    会话目录中每次调用保存一个 Parquet 文件，manifest.jsonl 按调用顺序记录接口名、参数、
+    耗时和出错信息，供 ReplayProvider 回放
+    """
+    
+    name = 'record'
+    MANIFEST = 'manifest.jsonl'
+    
+    def __init__(self, inner, session_dir):
+        self.inner = inner
+        self.session_dir = session_dir
+        self._seq = 0
+        self._lock = threading.Lock()
+        os.makedirs(session_dir, exist_ok=True)
+    
+    def fetch(self, func_name, *args, **kwargs):
+        start = time.time()
+        try:
+            result = self.inner.fetch(func_name, *args, **kwargs)
+        except Exception as e:
+            self._record(func_name, args, kwargs, start, None, e)
+            raise
+        # KeyboardInterrupt、SystemExit 等中断的调用不录制
+        self._record(func_name, args, kwargs, start, result, None)
+        return result
+    
+    def _record(self, func_name, args, kwargs, start, result, error):
+        """保存一次调用的返回数据，并在 manifest 中追加一行"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        entry = {
+            'seq': seq,
+            'time': datetime.fromtimestamp(start, BEIJING_TZ).isoformat(),
+            'elapsed': round(time.time() - start, 3),
+            'func': func_name,
+            'key': _call_key(func_name, args, kwargs),
+            'file': None,
+            'error': None if error is None else f"{type(error).__name__}: {error}",
+        }
+        if error is None and isinstance(result, pd.DataFrame):
+            entry['file'] = f"{seq:05d}_{func_name}.parquet"
+            _write_cached_table(os.path.join(self.session_dir, entry['file']), result)
+        elif error is None:
+            entry['error'] = f"未录制的返回类型: {type(result).__name__}"
+        with self._lock:
+            with open(os.path.join(self.session_dir, self.MANIFEST), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+class ReplayProvider:
+    """回放数据提供者：按录制顺序返回会话目录中保存的数据，不访问网络、不限速
+    
+    同一接口（相同参数）被多次调用时依次返回各次录制的结果，用完后一直返回最后一次的结果；
+    录制时出错的调用回放时抛出同样的错误，便于复现线上问题
+    """
+    
+    name = 'replay'
+    
+    def __init__(self, session_dir):
+        self.session_dir = session_dir
+        manifest = os.path.join(session_dir, RecordingProvider.MANIFEST)
+        if not os.path.exists(manifest):
+            raise FileNotFoundError(f"回放会话不存在: {manifest}")
+        self._responses = {}
+        with open(manifest, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._responses.setdefault(entry['key'], []).append(entry)
+        for entries in self._responses.values():
+            entries.sort(key=lambda entry: entry['seq'])
+        self._cursor = {}
+        self._lock = threading.Lock()
+    
+    def fetch(self, func_name, *args, **kwargs):
+        key = _call_key(func_name, args, kwargs)
+        entries = self._responses.get(key)
+        if not entries:
+            raise LookupError(f"回放会话中没有 {func_name} 的录制数据")
+        with self._lock:
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = min(index + 1, len(entries) - 1)
+        entry = entries[index]
+        if entry['file'] is None:
+            raise RuntimeError(f"[回放] {entry['error']}")
+        return _read_table_file(os.path.join(self.session_dir, entry['file']))
+
+# 数据提供者配置（可在 config.yaml 的 provider 部分覆盖）
+DEFAULT_PROVIDER_SETTINGS = {
+    'backend': 'akshare',  # akshare：真实接口；record：调用真实接口并录制；replay：回放录制的会话
+    'dir': 'recordings',  # 录制目录，相对路径基于缓存目录
+    'session': None,  # 录制时的会话名（默认当前时间）；回放的会话名（默认最新的会话）
+}
+_provider_settings = dict(DEFAULT_PROVIDER_SETTINGS)
+
+# 全局变量：当前的数据提供者
+_data_provider = AkshareProvider()
+
+def get_recordings_dir():
+    """录制目录的绝对路径"""
+    recordings_dir = str(_provider_settings['dir'])
+    if not os.path.isabs(recordings_dir):
+        recordings_dir = os.path.join(get_cache_dir(), recordings_dir)
+    return recordings_dir
+
+def configure_provider(config, backend=None, session=None):
+    """根据配置选择数据提供者，backend/session 不为空时覆盖配置
+    
+    录制和回放时缓存目录切换到会话目录下的 cache/：录制时所有数据都来自真实接口（不会因为命中
+    缓存而漏录），回放时也不会读到或写入正常运行的缓存、历史数据
+    """
+    global _data_provider, _circuit_breaker, _history_store
+    _provider_settings.update({k: v for k, v in ((config or {}).get('provider') or {}).items() if v is not None})
+    backend = backend or _provider_settings['backend']
+    session = session or _provider_settings['session']
+    recordings_dir = get_recordings_dir()
+    if backend == 'akshare':
+        _data_provider = AkshareProvider()
+        return _data_provider
+    if backend == 'record':
+        session_dir = os.path.join(recordings_dir, session or datetime.now(BEIJING_TZ).strftime('%Y%m%d-%H%M%S'))
+        _data_provider = RecordingProvider(AkshareProvider(), session_dir)
+        print(f"📼 录制数据到: {session_dir}")
+    elif backend == 'replay':
+        if not session:
+            sessions = sorted(
+                name for name in (os.listdir(recordings_dir) if os.path.isdir(recordings_dir) else [])
+                if os.path.isdir(os.path.join(recordings_dir, name))
+            )
+            if not sessions:
+                raise FileNotFoundError(f"没有可回放的录制会话: {recordings_dir}")
+            session = sessions[-1]
+        session_dir = session if os.path.isabs(session) else os.path.join(recordings_dir, session)
+        _data_provider = ReplayProvider(session_dir)
+        shutil.rmtree(os.path.join(session_dir, 'cache'), ignore_errors=True)
+        print(f"📼 回放录制的会话: {session_dir}")
+    else:
+        raise ValueError(f"未知的数据提供者: {backend}（可选 akshare、record、replay）")
+    
+    # 使用会话自己的缓存目录，并丢弃已加载的缓存数据
+    _cache_settings['dir'] = os.path.join(session_dir, 'cache')
+    reset_daily_tables()
+    _circuit_breaker = None
+    _history_store = None
+    return _data_provider
+
+def set_provider(provider):
+    """直接替换数据提供者（任何具有 fetch(func_name, *args, **kwargs) 方法的对象）"""
+    global _data_provider
+    _data_provider = provider
+    return provider
+
+def call_akshare(func_name, *args, **kwargs):
+    """通过当前数据提供者调用akshare接口（记录每个上游接口的耗时和数据量）"""
+    with metric_span(f"source.{func_name}", provider=_data_provider.name) as span:
+        data = _data_provider.fetch(func_name, *args, **kwargs)
+        span.set(status='ok', rows_out=len(data) if isinstance(data, pd.DataFrame) else None, bytes=frame_bytes(data))
+        return data
+
+# 数据源容错配置（可在 config.yaml 的 failover 部分覆盖）
+DEFAULT_FAILOVER_SETTINGS = {
+    'hedge_after_seconds': 5,  # 主数据源超过该时间未返回时，同时请求备用数据源
+    'failure_threshold': 3,  # 连续失败次数达到该值后熔断
+    'cooldown_minutes': 30,  # 熔断后跳过该数据源的时间
+}
+_failover_settings = dict(DEFAULT_FAILOVER_SETTINGS)
+
+def configure_failover(config):
+    """根据配置更新数据源容错设置"""
+    global _circuit_breaker
+    failover_config = (config or {}).get('failover') or {}
+    _failover_settings.update({k: v for k, v in failover_config.items() if v is not None})
+    _circuit_breaker = None
+
+class CircuitBreaker:
+    """数据源熔断器：连续失败达到阈值后，在冷却期内跳过该数据源
+    
+    状态保存在缓存目录中，因此对之后的运行同样生效；常驻进程中直接使用内存状态
+    """
+    
+    def __init__(self, path=None, failure_threshold=3, cooldown_seconds=1800):
+        self.path = path
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown_seconds = float(cooldown_seconds)
+        self._lock = threading.Lock()
+        self._state = self._load()
+        # 半开状态：冷却期过后正在试探的数据源 -> 开始试探的时间（只保存在内存中）
+        self._probing = {}
+    
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取熔断器状态失败: {e}")
+            return {}
+    
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"保存熔断器状态失败: {e}")
+    
+    def allow(self, source):
+        """数据源是否可用：未熔断，或熔断冷却期已过（半开，只放行一个试探请求）
+        
+        试探结果通过 record_success / record_failure 报告；试探超过冷却时间仍未返回时允许再次试探
+        """
+        with self._lock:
+            state = self._state.get(source)
+            if not state or state.get('failures', 0) < self.failure_threshold:
+                return True
+            now = time.time()
+            if now - state.get('opened_at', 0) < self.cooldown_seconds:
+                return False
+            probe_started = self._probing.get(source)
+            if probe_started is not None and now - probe_started < self.cooldown_seconds:
+                return False
+            self._probing[source] = now
+            return True
+    
+    def release(self, source):
+        """放弃 allow() 放行后没有实际发出的试探请求"""
+        with self._lock:
+            self._probing.pop(source, None)
+    
+    def record_success(self, source):
+        with self._lock:
+            self._probing.pop(source, None)
+            if self._state.pop(source, None) is not None:
+                self._save()
+    
+    def record_failure(self, source):
+        with self._lock:
+            self._probing.pop(source, None)
+            state = self._state.setdefault(source, {'failures': 0})
+            state['failures'] = state.get('failures', 0) + 1
+            if state['failures'] >= self.failure_threshold:
+                state['opened_at'] = time.time()
+                print(f"🚫 数据源 {source} 连续失败 {state['failures']} 次，熔断 {self.cooldown_seconds / 60:.0f} 分钟")
+            self._save()
+
+# 全局变量：数据源熔断器和各数据表的实际来源
+_circuit_breaker = None
+_table_sources = {}
+
+def get_circuit_breaker():
+    """获取熔断器（状态保存在缓存目录）"""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(
+            os.path.join(get_cache_dir(), 'circuit_breaker.json'),
+            failure_threshold=_failover_settings['failure_threshold'],
+            cooldown_seconds=float(_failover_settings['cooldown_minutes']) * 60,
+        )
+    return _circuit_breaker
+
+def get_table_sources():
+    """各数据表本次由哪个数据源提供"""
+    return dict(_table_sources)
+
+def hedged_fetch(table, candidates, hedge_after=None, validate=None):
+    """按优先级获取数据表：主数据源超时未返回时同时请求备用数据源，采用最先返回的有效结果
+    
+    candidates: [(数据源名称, 无参数的获取函数)]，按优先级排列
+    validate: 数据表 -> 不可用的原因（可用时返回None）；结构不符的结果按失败处理，继续等待其他数据源
+    已熔断的数据源会被跳过；全部熔断时仍按顺序尝试
+    """
+    if hedge_after is None:
+        hedge_after = float(_failover_settings['hedge_after_seconds'])
+    breaker = get_circuit_breaker()
+    pending = [(name, func) for name, func in candidates if breaker.allow(name)]
+    skipped = [name for name, _ in candidates if name not in dict(pending)]
+    if skipped:
+        print(f"🚫 {table} 跳过已熔断的数据源: {', '.join(skipped)}")
+    if not pending:
+        pending = list(candidates)
+    
+    done = queue.Queue()
+    
+    def run(name, func):
+        try:
+            data, error = func(), None
+        except Exception as e:
+            data, error = None, e
+        if error is None and (data is None or getattr(data, 'empty', False)):
+            error = '返回数据为空'
+        if error is None and validate is not None:
+            error = validate(data)
+        if error is None:
+            breaker.record_success(name)
+        else:
+            breaker.record_failure(name)
+        done.put((name, data, error))
+    
+    def launch():
+        name, func = pending.pop(0)
+        threading.Thread(target=run, args=(name, func), name=f'hedge-{table}-{name}', daemon=True).start()
+    
+    launch()
+    running = 1
+    try:
+        while running:
+            try:
+                name, data, error = done.get(timeout=hedge_after if pending else None)
+            except queue.Empty:
+                print(f"⏱️  {table} 主数据源 {hedge_after:g} 秒内未返回，同时请求备用数据源 {pending[0][0]}")
+                launch()
+                running += 1
+                continue
+            running -= 1
+            if error is None:
+                _table_sources[table] = name
+                print(f"✅ {table} 数据来源: {name}")
+                return data
+            print(f"{table} 数据源 {name} 获取失败: {error}")
+            if pending:
+                launch()
+                running += 1
+        _table_sources[table] = None
+        return None
+    finally:
+        # 没有用到的备用数据源不占用半开状态的试探机会
+        for name, _ in pending:
+            breaker.release(name)
 
 def get_etf_list():
     """获取ETF基金列表"""
     print("正在获取ETF基金列表...")
     try:
         # 获取ETF基金列表
-        etf_list = ak.fund_etf_hist_sina()
+        etf_list = call_akshare('fund_etf_hist_sina')
         return etf_list
     except Exception as e:
         print(f"获取ETF列表失败: {e}")
         # 备用方案：使用基金基本信息
         try:
-            etf_list = ak.fund_etf_category_sina(symbol="ETF基金")
+            etf_list = call_akshare('fund_etf_category_sina', symbol="ETF基金")
             return etf_list
         except Exception as e2:
             print(f"备用方案也失败: {e2}")
             return None
 
+def schema_validator(schema, required):
+    """hedged_fetch 的结果检查：数据表缺少必需字段时返回原因
+    
+    备用接口返回的表结构可能不同（例如只有单只基金的历史行情），不能作为同一张表使用
+    """
+    def validate(df):
+        resolution = resolve_schema(df, schema, 'validate', required)
+        if not resolution.ok:
+            return f"缺少必需字段 {', '.join(resolution.missing_required)}（列: {', '.join(map(str, df.columns[:8]))}）"
+        return None
+    return validate
+
 def get_etf_realtime_data():
     """获取ETF实时行情数据（场内价格）"""
     print("正在获取ETF实时行情数据...")
-    try:
-        # 方法1: 获取ETF实时行情
-        df = ak.fund_etf_spot_em()
-        if df is not None and not df.empty:
-            return df
-    except Exception as e:
-        print(f"方法1获取实时行情失败: {e}")
-    
-    try:
+    return hedged_fetch('etf_spot', [
+        # 方法1: 东方财富ETF实时行情
+        ('fund_etf_spot_em', lambda: call_akshare('fund_etf_spot_em')),
         # 方法2: 备用方案 - 使用新浪接口
-        df = ak.fund_etf_hist_sina()
-        if df is not None and not df.empty:
-            return df
-    except Exception as e:
-        print(f"方法2获取实时行情失败: {e}")
-    
-    return None
+        ('fund_etf_hist_sina', lambda: call_akshare('fund_etf_hist_sina')),
+    ], validate=schema_validator(SPOT_SCHEMA, SPOT_REQUIRED_FIELDS))
 
 def get_lof_realtime_data():
     """获取LOF基金实时行情数据（场内价格）"""
     print("正在获取LOF基金实时行情数据...")
-    try:
-        df = ak.fund_lof_spot_em()
-        if df is not None and not df.empty:
-            return df
-    except Exception as e:
-        print(f"获取LOF基金实时行情失败: {e}")
-        return None
-    return None
+    return hedged_fetch('lof_spot', [
+        ('fund_lof_spot_em', lambda: call_akshare('fund_lof_spot_em')),
+    ], validate=schema_validator(SPOT_SCHEMA, SPOT_REQUIRED_FIELDS))
 
 def get_etf_nav_data():
     """获取ETF净值数据（场外价格）"""
     print("正在获取ETF净值数据...")
-    try:
+    return hedged_fetch('etf_nav', [
         # 方法1: 获取ETF基金净值
-        df = ak.fund_etf_fund_info_em()
-        if df is not None and not df.empty:
-            return df
-    except Exception as e:
-        print(f"方法1获取净值数据失败: {e}")
-    
-    try:
+        ('fund_etf_fund_info_em', lambda: call_akshare('fund_etf_fund_info_em')),
         # 方法2: 备用方案
-        df = ak.fund_open_fund_info_em(fund="159919", indicator="单位净值走势")
-        if df is not None and not df.empty:
-            return df
-    except Exception as e:
-        print(f"方法2获取净值数据失败: {e}")
-    
-    return None
+        ('fund_open_fund_info_em', lambda: call_akshare('fund_open_fund_info_em', fund="159919", indicator="单位净值走势")),
+    ], validate=schema_validator(ETF_NAV_SCHEMA, ETF_NAV_REQUIRED_FIELDS))
 
 def calculate_premium_rate(spot_price, nav_price):
-    """计算溢价率"""
+    """计算溢价率（支持单个值或整列Series）"""
+    if isinstance(nav_price, pd.Series):
+        # 整列计算：场外价格为0时结果为空
+        valid_nav = nav_price.where(nav_price != 0)
+        return ((spot_price - valid_nav) / valid_nav * 100).round(4)
     if pd.isna(spot_price) or pd.isna(nav_price) or nav_price == 0:
         return None
     premium_rate = (spot_price - nav_price) / nav_price * 100
     return round(premium_rate, 4)
 
-# 全局变量：缓存所有基金的净值数据
-_all_fund_nav_cache = None
+# 缓存配置（可在 config.yaml 的 cache 部分覆盖）
+DEFAULT_CACHE_SETTINGS = {
+    'dir': '.cache',  # 缓存目录，相对路径基于项目根目录
+    'fund_meta_ttl_hours': 24,  # 基金基本信息缓存有效期（小时）
+    'snapshot_format': 'parquet',  # 数据快照格式：parquet 或 feather
+    'snapshot_keep': 5,  # 每个数据源保留的快照数量
+    'nav_publish_hour': 21,  # 北京时间该时刻之后认为当日净值已公布
+}
+_cache_settings = dict(DEFAULT_CACHE_SETTINGS)
 
-def get_all_fund_nav():
-    """获取所有基金的净值数据（缓存）"""
-    global _all_fund_nav_cache
-    if _all_fund_nav_cache is None:
-        try:
-            print("正在获取所有基金的净值数据...")
-            _all_fund_nav_cache = ak.fund_open_fund_daily_em()
-            if _all_fund_nav_cache is not None and not _all_fund_nav_cache.empty:
-                print(f"成功获取 {len(_all_fund_nav_cache)} 条基金净值数据")
-        except Exception as e:
-            print(f"获取基金净值数据失败: {e}")
-            _all_fund_nav_cache = pd.DataFrame()
-    return _all_fund_nav_cache
 
-def get_fund_nav_by_code(code):
-    """根据基金代码获取净值（场外价格）- 用于LOF基金"""
+def configure_cache(config):
+    """根据配置更新缓存设置"""
+    cache_config = (config or {}).get('cache') or {}
+    _cache_settings.update({k: v for k, v in cache_config.items() if v is not None})
+
+def get_cache_dir():
+    """获取缓存目录的绝对路径"""
+    cache_dir = str(_cache_settings['dir'])
+    if not os.path.isabs(cache_dir):
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        cache_dir = os.path.join(project_root, cache_dir)
+    return cache_dir
+
+def _read_table_file(path):
+    """按扩展名读取列式数据文件（Parquet/Feather）"""
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    return pd.read_parquet(path)
+
+def _read_cached_table(path, ttl_hours=None):
+    """读取磁盘缓存的数据表，缓存不存在或超过有效期时返回None"""
     try:
-        # 获取所有基金净值数据
-        all_nav_data = get_all_fund_nav()
-        if all_nav_data is None or all_nav_data.empty:
+        if not os.path.exists(path):
             return None
-        
-        # 在净值数据中查找对应代码的基金
-        if '基金代码' in all_nav_data.columns:
-            fund_nav = all_nav_data[all_nav_data['基金代码'] == code]
-            if len(fund_nav) > 0:
-                # 获取基金记录
-                fund_record = fund_nav.iloc[0]
-                
-                # 查找最新的单位净值列（格式为：日期-单位净值）
-                nav_cols = [col for col in fund_record.index if '单位净值' in col and not col.startswith('日')]
-                if nav_cols:
-                    # 按日期排序，获取最新的有效值
-                    nav_cols_sorted = sorted(nav_cols, reverse=True)
-                    for nav_col in nav_cols_sorted:
-                        nav = fund_record[nav_col]
-                        # 处理空字符串和NaN
-                        if pd.isna(nav) or nav == '' or nav == ' ':
-                            continue
-                        try:
-                            nav_float = float(nav)
-                            if nav_float > 0:
-                                return nav_float
-                        except (ValueError, TypeError):
-                            continue
-                
-                # 如果没有找到单位净值，尝试累计净值
-                nav_cols = [col for col in fund_record.index if '累计净值' in col and not col.startswith('日')]
-                if nav_cols:
-                    nav_cols_sorted = sorted(nav_cols, reverse=True)
-                    for nav_col in nav_cols_sorted:
-                        nav = fund_record[nav_col]
-                        if pd.isna(nav) or nav == '' or nav == ' ':
-                            continue
-                        try:
-                            nav_float = float(nav)
-                            if nav_float > 0:
-                                return nav_float
-                        except (ValueError, TypeError):
-                            continue
+        if ttl_hours is not None:
+            age_hours = (time.time() - os.path.getmtime(path)) / 3600
+            if age_hours > ttl_hours:
+                return None
+        return _read_table_file(path)
+    except Exception as e:
+        print(f"读取缓存失败 {path}: {e}")
+        return None
+
+def _write_cached_table(path, df):
+    """写入磁盘缓存（先写临时文件再重命名，避免留下不完整的缓存）"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        table = df.reset_index(drop=True)
+        # 列名统一为字符串，混合类型的列按字符串保存
+        table.columns = [str(col) for col in table.columns]
+        for col in table.columns:
+            if table[col].dtype == object and pd.api.types.infer_dtype(table[col], skipna=True) not in ('string', 'empty'):
+                table[col] = table[col].astype(str).where(table[col].notna())
+        if path.endswith('.feather'):
+            table.to_feather(tmp_path)
+        else:
+            table.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
     except Exception as e:
+        print(f"写入缓存失败 {path}: {e}")
+
+def latest_trading_day(now=None):
+    """返回 now（北京时间）当天或之前最近的交易日（只排除周末）"""
+    now = now or datetime.now(BEIJING_TZ)
+    day = now.date()
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+def nav_snapshot_date(now=None):
+    """当前应使用的净值快照对应的交易日
+    
+    官方净值每个交易日晚间公布一次：公布之前（例如10:00、14:00的运行）使用上一交易日的快照，
+    公布之后使用当日快照
+    """
+    now = now or datetime.now(BEIJING_TZ)
+    day = latest_trading_day(now)
+    if day == now.date() and now.hour < int(_cache_settings['nav_publish_hour']):
+        day = latest_trading_day(datetime.combine(day - timedelta(days=1), now.timetz()))
+    return day
+
+class SnapshotCache:
+    """数据源快照缓存：按数据源名称和交易日保存为 Parquet/Feather 文件"""
+    
+    def __init__(self, cache_dir=None, fmt=None, keep=None):
+        self.root = os.path.join(cache_dir or get_cache_dir(), 'snapshots')
+        self.fmt = fmt or _cache_settings['snapshot_format']
+        self.keep = int(keep if keep is not None else _cache_settings['snapshot_keep'])
+    
+    def path(self, source, key):
+        return os.path.join(self.root, source, f"{key}.{self.fmt}")
+    
+    def load(self, source, key):
+        """读取指定交易日的快照，不存在时返回None"""
+        return _read_cached_table(self.path(source, key))
+    
+    def save(self, source, key, df):
+        """保存快照并淘汰旧快照"""
+        _write_cached_table(self.path(source, key), df)
+        self.evict(source)
+    
+    def keys(self, source):
+        """已缓存的快照键（从旧到新）"""
+        source_dir = os.path.join(self.root, source)
+        if not os.path.isdir(source_dir):
+            return []
+        suffix = f".{self.fmt}"
+        return sorted(name[:-len(suffix)] for name in os.listdir(source_dir) if name.endswith(suffix))
+    
+    def evict(self, source):
+        """只保留最近的 keep 个快照"""
+        if self.keep <= 0:
+            return
+        for key in self.keys(source)[:-self.keep]:
+            try:
+                os.remove(self.path(source, key))
+            except OSError as e:
+                print(f"删除旧快照失败 {source}/{key}: {e}")
+
+def frame_memory_mb(df):
+    """数据表占用的内存（MB，包含字符串等对象的实际大小）"""
+    if df is None:
+        return 0.0
+    return df.memory_usage(deep=True).sum() / 1024 / 1024
+
+def process_memory_mb():
+    """进程当前内存和峰值内存（MB），无法获取时为None"""
+    current = peak = None
+    try:
+        import resource
+        # Linux 下 ru_maxrss 单位为KB，macOS 下为字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    except (ImportError, OSError):
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError, AttributeError):
         pass
-    return None
+    return current, peak
 
-def get_etf_data():
-    """获取并合并ETF和LOF基金数据"""
-    print("=" * 60)
-    print("开始获取ETF和LOF基金数据...")
-    print("=" * 60)
+def downcast_float(series, decimals=4):
+    """精度允许时（按指定小数位往返不变）将价格列转为float32"""
+    values = series.to_numpy(dtype='float64', na_value=np.nan)
+    downcast = values.astype('float32')
+    if np.array_equal(np.round(downcast.astype('float64'), decimals), np.round(values, decimals), equal_nan=True):
+        return pd.Series(downcast, index=series.index, name=series.name)
+    return series.astype('float64')
+
+class FundNavStore:
+    """开放式基金净值库：按基金代码建立哈希索引，O(1)查询净值、申购赎回状态和手续费"""
     
-    # 获取ETF实时行情（场内价格）
-    etf_df = get_etf_realtime_data()
-    if etf_df is None or etf_df.empty:
-        etf_df = pd.DataFrame()
-        print("无法获取ETF实时行情数据")
-    else:
-        print(f"获取到 {len(etf_df)} 条ETF实时行情数据")
-        etf_df['基金类型'] = 'ETF'
-    
-    # 获取LOF基金实时行情（场内价格）
-    lof_df = get_lof_realtime_data()
-    if lof_df is None or lof_df.empty:
-        lof_df = pd.DataFrame()
-        print("无法获取LOF基金实时行情数据")
-    else:
-        print(f"获取到 {len(lof_df)} 条LOF基金实时行情数据")
-        lof_df['基金类型'] = 'LOF'
+    STATUS_COLUMNS = ['申购状态', '赎回状态', '手续费']
     
-    # 合并ETF和LOF数据
-    if etf_df.empty and lof_df.empty:
-        print("无法获取任何基金数据")
-        return None
+    def __init__(self, nav_df):
+        if nav_df is None or nav_df.empty or '基金代码' not in nav_df.columns:
+            nav_df = pd.DataFrame(columns=['基金代码'])
+        codes = nav_df['基金代码'].astype(str).str.strip()
+        # 同一代码只保留第一条记录
+        unique = ~codes.duplicated()
+        self.frame = nav_df[unique.values].copy()
+        self.frame.index = pd.Index(codes[unique].tolist(), name='代码')
+        self._positions = {code: pos for pos, code in enumerate(self.frame.index)}
+        
+        # 日期列的排序每张表只解析一次（列名格式为：日期-单位净值 / 日期-累计净值）
+        unit_cols = self._dated_columns('单位净值')
+        cumulative_cols = self._dated_columns('累计净值')
+        self.nav_dates = sorted({date for date, _ in unit_cols + cumulative_cols}, reverse=True)
+        self.latest_date = self.nav_dates[0] if self.nav_dates else None
+        
+        # 一次性计算所有基金的最新有效净值及其日期
+        unit_nav, unit_date = self._latest_dated_values(unit_cols)
+        cumulative_nav, cumulative_date = self._latest_dated_values(cumulative_cols)
+        self.frame['最新单位净值'] = unit_nav
+        self.frame['单位净值日期'] = unit_date
+        self.frame['最新累计净值'] = cumulative_nav
+        self.frame['累计净值日期'] = cumulative_date
+        # 没有单位净值时使用累计净值
+        use_unit = unit_nav.notna()
+        self.frame['最新净值'] = unit_nav.where(use_unit, cumulative_nav)
+        self.frame['净值日期'] = unit_date.where(use_unit, cumulative_date)
+        self.frame['净值过期'] = self.frame['净值日期'].notna() & (self.frame['净值日期'] != self.latest_date)
+        
+        # 解析完成后只保留用到的列：原始日期列（文本）不再需要
+        self.raw_memory_mb = frame_memory_mb(self.frame)
+        self.frame = self._compact(self.frame)
+        self.memory_mb = frame_memory_mb(self.frame)
     
-    if not etf_df.empty and not lof_df.empty:
-        spot_df = pd.concat([etf_df, lof_df], ignore_index=True)
-    elif not etf_df.empty:
-        spot_df = etf_df
-    else:
-        spot_df = lof_df
+    COMPACT_FLOAT_COLUMNS = ['最新单位净值', '最新累计净值', '最新净值']
+    COMPACT_CATEGORY_COLUMNS = ['单位净值日期', '累计净值日期', '净值日期'] + STATUS_COLUMNS
     
-    print(f"总共获取到 {len(spot_df)} 条基金实时行情数据")
-    print(f"数据列: {list(spot_df.columns)}")
+    def _compact(self, frame):
+        """压缩内存：净值转为float32，日期和状态转为分类"""
+        compact = pd.DataFrame(index=frame.index)
+        for col in self.COMPACT_FLOAT_COLUMNS:
+            compact[col] = downcast_float(frame[col])
+        for col in self.COMPACT_CATEGORY_COLUMNS:
+            if col in frame.columns:
+                compact[col] = frame[col].astype('category')
+        compact['净值过期'] = frame['净值过期'].astype(bool)
+        return compact
     
-    # 检查实时行情数据中是否已有IOPV实时估值（场外价格）
-    has_iopv = 'IOPV实时估值' in spot_df.columns
-    if has_iopv:
-        print("实时行情数据中包含IOPV实时估值，直接使用作为场外价格")
-        nav_df = None  # 不需要单独获取净值数据
-    else:
-        # 获取净值数据（场外价格）
-        nav_df = get_etf_nav_data()
-        if nav_df is None or nav_df.empty:
-            print("无法获取净值数据，将尝试逐个获取基金净值...")
-            nav_df = None
-        else:
-            print(f"获取到 {len(nav_df)} 条净值数据")
+    def _dated_columns(self, keyword):
+        """返回 [(日期, 列名)]，按日期从新到旧排序"""
+        suffix = f'-{keyword}'
+        dated = [
+            (col[:-len(suffix)], col) for col in self.frame.columns
+            if isinstance(col, str) and col.endswith(suffix) and not col.startswith('日')
+        ]
+        return sorted(dated, reverse=True)
     
-    # 数据清洗和合并
-    result_list = []
+    def _latest_dated_values(self, dated_columns):
+        """整表计算每只基金最新的有效正值净值，并记录该净值对应的日期"""
+        if not dated_columns:
+            empty = pd.Series(None, index=self.frame.index, dtype='object')
+            return empty.astype('float64'), empty
+        columns = [col for _, col in dated_columns]
+        values = self.frame[columns].apply(pd.to_numeric, errors='coerce')
+        values = values.where(values > 0)
+        latest = values.bfill(axis=1).iloc[:, 0].astype('float64')
+        valid = values.notna()
+        column_dates = dict((col, date) for date, col in dated_columns)
+        dates = valid.idxmax(axis=1).map(column_dates).where(valid.any(axis=1))
+        return latest, dates.astype('object')
     
-    # 预先获取净值数据缓存（包含申购赎回状态和手续费信息）
-    print("正在获取基金净值及申购赎回信息...")
-    get_all_fund_nav()  # 预加载净值数据
+    def __len__(self):
+        return len(self._positions)
     
-    # 处理实时行情数据
-    for idx, row in spot_df.iterrows():
-        try:
-            # 获取代码和名称
-            code = None
-            name = None
-            
-            # 尝试不同的列名
-            for col in ['代码', '基金代码', 'code', 'symbol']:
-                if col in row.index:
-                    code = str(row[col]).strip()
-                    break
-            
-            for col in ['名称', '基金名称', 'name', '基金简称']:
-                if col in row.index:
-                    name = str(row[col]).strip()
-                    break
-            
-            if not code or not name:
-                continue
-            
-            # 获取场内价格
-            spot_price = None
-            for col in ['最新价', '现价', '当前价', 'price', '最新净值']:
-                if col in row.index:
-                    spot_price = row[col]
-                    if not pd.isna(spot_price):
-                        break
-            
-            if pd.isna(spot_price) or spot_price is None or spot_price == 0:
-                continue
-            
-            # 获取交易量（成交量）
-            volume = None
-            for col in ['成交量', '成交额', '成交金额', '量', 'volume', '总手', '成交手数', '成交数量']:
-                if col in row.index:
-                    volume_value = row[col]
-                    if not pd.isna(volume_value) and volume_value is not None:
-                        try:
-                            volume = float(volume_value)
-                            if volume > 0:
-                                break
-                        except (ValueError, TypeError):
-                            continue
-            
-            # 查找对应的净值（场外价格）
-            nav_price = None
-            
-            # 方法1: 优先从实时行情中获取IOPV实时估值（这是场外价格/净值）
-            for col in ['IOPV实时估值', 'IOPV', '参考净值', '净值', '单位净值']:
-                if col in row.index:
-                    nav_price = row[col]
-                    if not pd.isna(nav_price) and nav_price != 0:
-                        break
-            
-            # 方法2: 如果实时行情中没有，从净值数据中查找
-            if (pd.isna(nav_price) or nav_price is None or nav_price == 0) and nav_df is not None and '代码' in nav_df.columns:
-                nav_row = nav_df[nav_df['代码'] == code]
-                if not nav_row.empty:
-                    for nav_col in ['净值', '单位净值', '累计净值', 'nav']:
-                        if nav_col in nav_row.columns:
-                            nav_price = nav_row.iloc[0][nav_col]
-                            if not pd.isna(nav_price) and nav_price != 0:
-                                break
-            
-            # 方法3: 如果前两种方法都没有找到，且是LOF基金，尝试通过API获取单个基金的净值
-            if (pd.isna(nav_price) or nav_price is None or nav_price == 0):
-                fund_type = row.get('基金类型', 'ETF')
-                if fund_type == 'LOF':
-                    nav_price = get_fund_nav_by_code(code)
-                    if nav_price is not None and nav_price > 0:
-                        time.sleep(0.1)  # 避免API调用过快
-            
-            if pd.isna(nav_price) or nav_price is None or nav_price == 0:
-                continue
-            
-            # 计算溢价率
-            premium_rate = calculate_premium_rate(spot_price, nav_price)
-            if premium_rate is None:
-                continue
-            
-            # 获取基金类型
-            fund_type = row.get('基金类型', 'ETF')
-            
-            # 获取申购状态、赎回状态和手续费
-            purchase_status = ''
-            redeem_status = ''
-            fee_rate = ''
-            purchase_limit = ''
-            
-            # 从净值数据中获取这些信息
-            all_nav_data = get_all_fund_nav()
-            if all_nav_data is not None and not all_nav_data.empty and '基金代码' in all_nav_data.columns:
-                fund_nav_info = all_nav_data[all_nav_data['基金代码'] == code]
-                if len(fund_nav_info) > 0:
-                    fund_info = fund_nav_info.iloc[0]
-                    if '申购状态' in fund_info.index:
-                        purchase_status = str(fund_info['申购状态']).strip()
-                    if '赎回状态' in fund_info.index:
-                        redeem_status = str(fund_info['赎回状态']).strip()
-                    if '手续费' in fund_info.index:
-                        fee_rate = str(fund_info['手续费']).strip()
-            
-            # 尝试从其他API获取限购金额（如果申购状态是"限大额"但没有具体金额）
-            purchase_limit_amount = ''
-            if purchase_status and ('限大额' in purchase_status or '限额' in purchase_status):
-                try:
-                    # 尝试从基金详细信息中获取限购金额
-                    fund_list = ak.fund_name_em()
-                    fund_name_info = fund_list[fund_list['基金代码'] == code]
-                    if len(fund_name_info) > 0:
-                        fund_name = fund_name_info.iloc[0]['基金简称']
-                        # 尝试获取基金申购赎回详细信息
-                        try:
-                            # 注意：这里可能需要根据akshare的实际API调整
-                            # 某些API可能包含限购金额信息
-                            pass
-                        except:
-                            pass
-                except:
-                    pass
-            
-            # 处理申购限额（从申购状态中提取，并尝试获取限购金额）
-            purchase_limit_amount = ''
-            if fund_type == 'ETF':
-                # ETF主要在场内交易，申购赎回信息可能不完整
-                if purchase_status and purchase_status != '' and purchase_status != 'nan':
-                    if '限大额' in purchase_status or '限额' in purchase_status:
-                        purchase_limit = '限大额'
-                        # 尝试从申购状态中提取金额（如果有的话）
-                        import re
-                        amount_match = re.search(r'(\d+(?:\.\d+)?)\s*[万千]?元', purchase_status)
-                        if amount_match:
-                            purchase_limit_amount = amount_match.group(1)
-                    elif '暂停申购' in purchase_status:
-                        purchase_limit = '暂停'
-                    elif '开放申购' in purchase_status:
-                        purchase_limit = '开放'
-                    else:
-                        purchase_limit = purchase_status
-                else:
-                    purchase_limit = '场内交易'
-                
-                if not redeem_status or redeem_status == '' or redeem_status == 'nan':
-                    redeem_status = '场内交易'
-            else:
-                # LOF基金
-                if '限大额' in purchase_status or '限额' in purchase_status:
-                    purchase_limit = '限大额'
-                    # 尝试从申购状态中提取金额
-                    import re
-                    # 匹配各种金额格式：1000元、100万元、1000万等
-                    amount_match = re.search(r'(\d+(?:\.\d+)?)\s*([万千]?)元?', purchase_status)
-                    if amount_match:
-                        amount = float(amount_match.group(1))
-                        unit = amount_match.group(2)
-                        if unit == '万':
-                            purchase_limit_amount = f"{amount:.0f}万"
-                        elif unit == '千':
-                            purchase_limit_amount = f"{amount:.0f}千"
-                        else:
-                            purchase_limit_amount = f"{amount:.0f}元"
-                elif '暂停申购' in purchase_status:
-                    purchase_limit = '暂停'
-                elif '开放申购' in purchase_status or purchase_status == '':
-                    purchase_limit = '开放'
-                else:
-                    purchase_limit = purchase_status if purchase_status else '未知'
-                
-                if not redeem_status or redeem_status == '' or redeem_status == 'nan':
-                    redeem_status = '未知'
-            
-            # 如果有限购金额，合并到申购状态中
-            if purchase_limit_amount:
-                purchase_limit = f"{purchase_limit}({purchase_limit_amount})"
-            elif purchase_limit == '限大额':
-                # 如果显示"限大额"但没有具体金额，保持原样
-                # 注：由于数据源限制，可能无法获取具体限购金额
-                purchase_limit = '限大额'
-            
-            result_list.append({
-                '基金名称': name,
-                '代码': code,
-                '基金类型': fund_type,
-                '场内价格': round(float(spot_price), 4),
-                '场外价格': round(float(nav_price), 4),
-                '溢价率': premium_rate,
-                '交易量': volume if volume is not None and volume > 0 else 0,
-                '申购状态': purchase_limit,
-                '赎回状态': redeem_status if redeem_status else '未知',
-                '手续费': fee_rate if fee_rate else '未知'
-            })
-            
-        except Exception as e:
-            # 静默跳过错误数据
-            continue
+    def __contains__(self, code):
+        return code in self._positions
     
-    if not result_list:
-        print("未能获取到有效数据")
-        return None
+    @property
+    def empty(self):
+        return not self._positions
     
-    result_df = pd.DataFrame(result_list)
-    print(f"成功处理 {len(result_df)} 条有效ETF数据")
-    return result_df
-
-def load_config():
-    """加载配置文件
-    优先从环境变量（Repository secrets）读取，其次从 config.yaml 读取
-    """
-    config = {}
+    def record(self, code):
+        """获取基金的完整净值记录，不存在时返回None"""
+        pos = self._positions.get(code)
+        if pos is None:
+            return None
+        return self.frame.iloc[pos]
     
-    # 优先从环境变量读取配置（GitHub Actions Repository secrets）
-    print("正在从环境变量读取配置...")
-    email_config = {}
-    smtp_config = {}
+    def _value(self, code, column):
+        pos = self._positions.get(code)
+        if pos is None:
+            return None
+        value = self.frame[column].iat[pos]
+        if pd.isna(value):
+            return None
+        # float32 存储的净值还原为4位小数
+        return round(float(value), 4) if column in self.COMPACT_FLOAT_COLUMNS else value
     
-    # 读取所有环境变量
-    recipients_env = os.getenv('EMAIL_RECIPIENTS', '')
-    email_subject_env = os.getenv('EMAIL_SUBJECT', '')
+    def latest_nav(self, code):
+        """最新单位净值"""
+        return self._value(code, '最新单位净值')
+    
+    def cumulative_nav(self, code):
+        """最新累计净值"""
+        return self._value(code, '最新累计净值')
+    
+    def nav(self, code):
+        """场外价格：最新单位净值，没有时使用累计净值"""
+        return self._value(code, '最新净值')
+    
+    def nav_date(self, code):
+        """场外价格（最新净值）对应的日期"""
+        return self._value(code, '净值日期')
+    
+    def is_stale(self, code):
+        """净值是否早于净值表中的最新日期"""
+        return bool(self._value(code, '净值过期'))
+    
+    def nav_series(self):
+        """按代码索引的最新净值（单位净值优先，其次累计净值）"""
+        # float32 存储的净值还原为4位小数的float64，保证溢价率计算精度
+        return self.frame['最新净值'].astype('float64').round(4)
+    
+    def _status_value(self, code, column):
+        if column not in self.frame.columns:
+            return ''
+        pos = self._positions.get(code)
+        if pos is None:
+            return ''
+        value = self.frame[column].iat[pos]
+        return '' if pd.isna(value) else str(value).strip()
+    
+    def purchase_status(self, code):
+        """申购状态"""
+        return self._status_value(code, '申购状态')
+    
+    def redeem_status(self, code):
+        """赎回状态"""
+        return self._status_value(code, '赎回状态')
+    
+    def fee(self, code):
+        """手续费"""
+        return self._status_value(code, '手续费')
+    
+    def status_frame(self):
+        """按代码索引的申购状态、赎回状态、手续费（用于整列关联）"""
+        status = pd.DataFrame(index=self.frame.index)
+        for col in self.STATUS_COLUMNS:
+            if col in self.frame.columns:
+                status[col] = self.frame[col]
+        return status
+
+# 全局变量：缓存所有基金的净值库（按代码索引）
+_nav_store = None
+
+def get_all_fund_nav():
+    """获取所有基金的净值数据（缓存），返回按基金代码索引的净值库"""
+    global _nav_store
+    if _nav_store is None:
+        # 净值每个交易日只更新一次：当日快照已缓存时直接读取，不再重复下载
+        snapshot_cache = SnapshotCache()
+        snapshot_key = nav_snapshot_date().isoformat()
+        nav_df = snapshot_cache.load('fund_open_fund_daily_em', snapshot_key)
+        if nav_df is not None and not nav_df.empty:
+            print(f"使用缓存的基金净值数据（{snapshot_key}，{len(nav_df)} 条）")
+            _table_sources['fund_nav'] = f'snapshot:{snapshot_key}'
+        else:
+            print("正在获取所有基金的净值数据...")
+            nav_df = hedged_fetch('fund_nav', [
+                ('fund_open_fund_daily_em', lambda: call_akshare('fund_open_fund_daily_em')),
+            ])
+            if nav_df is not None and not nav_df.empty:
+                print(f"成功获取 {len(nav_df)} 条基金净值数据")
+                snapshot_cache.save('fund_open_fund_daily_em', snapshot_key, nav_df)
+        _nav_store = FundNavStore(nav_df)
+        if len(_nav_store):
+            print(f"净值数据内存: {_nav_store.raw_memory_mb:.1f}MB → 压缩后 {_nav_store.memory_mb:.1f}MB")
+    return _nav_store
+
+def get_fund_nav_by_code(code):
+    """根据基金代码获取净值（场外价格）- 用于LOF基金"""
+    try:
+        return get_all_fund_nav().nav(code)
+    except Exception:
+        return None
+
+class FundMetadata:
+    """基金基本信息（ak.fund_name_em）：按基金代码索引"""
+    
+    def __init__(self, table):
+        if table is None or table.empty or '基金代码' not in table.columns:
+            table = pd.DataFrame(columns=['基金代码'])
+        codes = table['基金代码'].astype(str).str.strip()
+        unique = ~codes.duplicated()
+        # 只保留用到的列（拼音等字段不需要）
+        columns = [col for col in self.COLUMNS if col in table.columns]
+        self.frame = table.loc[unique.values, columns].copy()
+        if '基金类型' in self.frame.columns:
+            self.frame['基金类型'] = self.frame['基金类型'].astype('category')
+        self.frame.index = pd.Index(codes[unique].tolist(), name='代码')
+        self._positions = {code: pos for pos, code in enumerate(self.frame.index)}
+    
+    COLUMNS = ['基金简称', '基金类型']
+    
+    def __len__(self):
+        return len(self._positions)
+    
+    def __contains__(self, code):
+        return code in self._positions
+    
+    def get(self, code):
+        """获取基金基本信息（基金简称、基金类型等），不存在时返回None"""
+        pos = self._positions.get(code)
+        if pos is None:
+            return None
+        return self.frame.iloc[pos].to_dict()
+    
+    def name_series(self):
+        """按代码索引的基金简称"""
+        if '基金简称' not in self.frame.columns:
+            return pd.Series(dtype='object')
+        return self.frame['基金简称']
+
+# 全局变量：缓存基金基本信息（每次运行最多下载一次）
+_fund_metadata = None
+
+def get_fund_metadata():
+    """获取基金基本信息，优先使用未过期的磁盘缓存"""
+    global _fund_metadata
+    if _fund_metadata is None:
+        cache_path = os.path.join(get_cache_dir(), f"fund_name_em.{_cache_settings['snapshot_format']}")
+        table = _read_cached_table(cache_path, float(_cache_settings['fund_meta_ttl_hours']))
+        if table is not None:
+            print(f"使用缓存的基金基本信息（{len(table)} 条）")
+        else:
+            try:
+                print("正在获取基金基本信息...")
+                table = call_akshare('fund_name_em')
+                if table is not None and not table.empty:
+                    print(f"成功获取 {len(table)} 条基金基本信息")
+                    _write_cached_table(cache_path, table)
+            except Exception as e:
+                print(f"获取基金基本信息失败: {e}")
+                table = None
+        _fund_metadata = FundMetadata(table)
+    return _fund_metadata
+
+# 数据获取配置（可在 config.yaml 的 fetch 部分覆盖）
+DEFAULT_FETCH_TIMEOUTS = {
+    'etf_spot': 30,  # ETF实时行情
+    'lof_spot': 30,  # LOF实时行情
+    'fund_nav': 60,  # 开放式基金净值（数据量最大）
+    'etf_nav': 30,  # ETF净值（行情中没有IOPV时才获取）
+}
+DEFAULT_FETCH_TIMEOUT = 60
+_fetch_timeouts = dict(DEFAULT_FETCH_TIMEOUTS)
+
+def configure_fetch(config):
+    """根据配置更新各数据源的超时时间（秒）"""
+    timeouts = ((config or {}).get('fetch') or {}).get('timeouts') or {}
+    for name, timeout in timeouts.items():
+        try:
+            _fetch_timeouts[name] = float(timeout)
+        except (ValueError, TypeError):
+            print(f"⚠️  忽略无效的超时配置: {name}={timeout}")
+
+class FetchResult:
+    """单个数据源的获取结果"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.data = None
+        self.error = None
+        self.elapsed = None
+        self.timed_out = False
+    
+    @property
+    def ok(self):
+        return self.error is None and not self.timed_out
+    
+    def __repr__(self):
+        if self.timed_out:
+            state = 'timeout'
+        elif self.error is not None:
+            state = f'error={self.error!r}'
+        else:
+            state = 'ok'
+        return f"FetchResult({self.name}, {state}, elapsed={self.elapsed})"
+
+def fetch_sources_concurrently(sources, timeouts=None):
+    """同时启动多个数据源的获取，按各自的超时时间收集结果
+    
+    sources: {数据源名称: 无参数的获取函数}
+    返回: {数据源名称: FetchResult}，超时或出错的数据源 data 为 None
+    """
+    timeouts = dict(_fetch_timeouts, **(timeouts or {}))
+    results = {name: FetchResult(name) for name in sources}
+    threads = {}
+    parent_span = _metrics.current()
+    
+    def run(result, func):
+        start = time.perf_counter()
+        span = metric_span(f"fetch.{result.name}", parent=parent_span)
+        try:
+            result.data = func()
+            span.set(status='ok' if result.data is not None else 'empty')
+            if result.data is not None:
+                span.set(rows_out=len(result.data))
+        except Exception as e:
+            result.error = e
+            span.set(status='error', error=f"{type(e).__name__}: {e}")
+        result.elapsed = time.perf_counter() - start
+        # 已超时的请求不再记录（主线程已按超时记录过）
+        if not result.timed_out:
+            span.end()
+    
+    start = time.perf_counter()
+    for name, func in sources.items():
+        # 使用守护线程：超时的请求不会阻塞程序退出
+        thread = threading.Thread(target=run, args=(results[name], func), name=f'fetch-{name}', daemon=True)
+        thread.start()
+        threads[name] = thread
+    
+    for name, thread in threads.items():
+        timeout = timeouts.get(name, DEFAULT_FETCH_TIMEOUT)
+        thread.join(max(0.0, start + timeout - time.perf_counter()))
+        result = results[name]
+        if thread.is_alive():
+            result.timed_out = True
+            result.elapsed = time.perf_counter() - start
+            _metrics.record(f"fetch.{name}", result.elapsed, status='timeout', timeout_seconds=timeout,
+                            parent=parent_span.name if parent_span is not None else None)
+            print(f"⚠️  数据源 {name} 超时（{timeout:.0f}秒），本次运行跳过")
+        elif result.error is not None:
+            print(f"⚠️  数据源 {name} 获取失败: {result.error}")
+    
+    summary = ', '.join(f"{name} {results[name].elapsed:.2f}s" for name in sources)
+    print(f"数据源获取完成，总耗时 {time.perf_counter() - start:.2f}s（{summary}）")
+    return results
+
+# 基金类型
+FUND_TYPES = ['ETF', 'LOF']
+
+# 实时行情数据的标准字段：字段 -> (标准列名, 数据源中可能的列名（按优先级）)
+SPOT_SCHEMA = {
+    'code': ('代码', ['代码', '基金代码', 'code', 'symbol']),
+    'name': ('基金名称', ['名称', '基金名称', 'name', '基金简称']),
+    'type': ('基金类型', ['基金类型']),
+    'spot': ('场内价格', ['最新价', '现价', '当前价', 'price', '最新净值']),
+    'iopv': ('场外价格', ['IOPV实时估值', 'IOPV', '参考净值', '净值', '单位净值']),
+    'volume': ('交易量', ['成交量', '成交额', '成交金额', '量', 'volume', '总手', '成交手数', '成交数量']),
+}
+SPOT_REQUIRED_FIELDS = ('code', 'spot')
+
+# ETF净值数据的标准字段
+ETF_NAV_SCHEMA = {
+    'code': ('代码', ['代码', '基金代码']),
+    'nav': ('净值数据', ['净值', '单位净值', '累计净值', 'nav']),
+}
+ETF_NAV_REQUIRED_FIELDS = ('code', 'nav')
+
+# 文本字段，其余字段按数值解析
+TEXT_FIELDS = {'code', 'name', 'type'}
+
+class SchemaResolution:
+    """数据源列名解析结果：每个标准字段对应数据源中的唯一一列"""
+    
+    def __init__(self, source, schema, mapping, required):
+        self.source = source
+        self.schema = schema
+        self.mapping = mapping
+        self.missing = [field for field in schema if field not in mapping]
+        self.missing_required = [field for field in required if field not in mapping]
+    
+    @property
+    def ok(self):
+        return not self.missing_required
+    
+    def report(self):
+        """列名映射报告，列出未解析的字段"""
+        resolved = ', '.join(f"{field}={col}" for field, col in self.mapping.items())
+        lines = [f"{self.source} 列名映射: {resolved}"]
+        if self.missing_required:
+            lines.append(f"❌ {self.source} 缺少必需字段: {', '.join(self.missing_required)}")
+        optional_missing = [field for field in self.missing if field not in self.missing_required]
+        if optional_missing:
+            lines.append(f"ℹ️  {self.source} 未解析的可选字段: {', '.join(optional_missing)}")
+        return '\n'.join(lines)
+    
+    def apply(self, df, defaults=None):
+        """按解析结果将数据源转换为标准列名的数据表"""
+        defaults = defaults or {}
+        columns = {}
+        for field, (canonical, _) in self.schema.items():
+            source_col = self.mapping.get(field)
+            if source_col is None:
+                default = defaults.get(field, '' if field in TEXT_FIELDS else float('nan'))
+                columns[canonical] = pd.Series(default, index=df.index)
+            elif field in TEXT_FIELDS:
+                columns[canonical] = df[source_col].fillna('').astype(str).str.strip()
+            else:
+                columns[canonical] = pd.to_numeric(df[source_col], errors='coerce').astype('float64')
+        return pd.DataFrame(columns, index=df.index)
+
+def resolve_schema(df, schema, source, required=()):
+    """获取数据后一次性解析列名：每个字段取候选列名中第一个存在的列"""
+    mapping = {}
+    for field, (_, candidates) in schema.items():
+        for col in candidates:
+            if col in df.columns:
+                mapping[field] = col
+                break
+    return SchemaResolution(source, schema, mapping, required)
+
+def _clean_spot_frame(spot):
+    """清洗标准列名的实时行情数据"""
+    spot['基金名称'] = spot['基金名称'].replace(['nan', 'None'], '')
+    spot['基金类型'] = spot['基金类型'].replace('', 'ETF')
+    spot['交易量'] = spot['交易量'].where(spot['交易量'] > 0)
+    spot['场外价格'] = spot['场外价格'].where(spot['场外价格'] != 0)
+    # 场内价格为空或为0的数据无法计算溢价率
+    valid = (spot['代码'] != '') & (spot['场内价格'] != 0)
+    return spot[valid]
+
+# 申购状态解析（预编译，整列匹配）
+LIMITED_PATTERN = re.compile(r'限大额|限额')
+PAUSED_PATTERN = re.compile(r'暂停申购')
+OPEN_PATTERN = re.compile(r'开放申购')
+# 限购金额：1000元、100万元、1000万、1.5亿等
+LIMIT_AMOUNT_PATTERN = re.compile(r'(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>[千万亿]?)元?')
+LIMIT_UNIT_MULTIPLIERS = {'': 1, '千': 1e3, '万': 1e4, '亿': 1e8}
+# 手续费率：0.15%
+FEE_RATE_PATTERN = re.compile(r'(?P<rate>\d+(?:\.\d+)?)\s*%?')
+
+# 状态分类的排序（未列出的原始状态排在后面）
+PURCHASE_STATUS_ORDER = ['开放', '限大额', '暂停', '场内交易', '未知']
+REDEEM_STATUS_ORDER = ['开放赎回', '暂停赎回', '场内交易', '未知']
+
+def _ordered_categorical(values, order):
+    """按给定顺序生成分类列，其余取值排在后面"""
+    extra = sorted(set(values) - set(order))
+    return pd.Categorical(values, categories=order + extra)
+
+def normalize_status_columns(status, fund_type):
+    """整列解析申购状态、赎回状态和手续费
+    
+    status: 包含 申购状态、赎回状态、手续费 原始文本的数据表
+    fund_type: 对应的基金类型列（ETF缺少状态时显示场内交易）
+    返回: 申购状态/赎回状态（分类）、限购金额（元）、手续费（文本）、手续费率（%）
+    """
+    purchase = status['申购状态'].fillna('').astype(str).str.strip().replace('nan', '')
+    redeem = status['赎回状态'].fillna('').astype(str).str.strip().replace('nan', '')
+    fee = status['手续费'].fillna('').astype(str).str.strip().replace('nan', '')
+    is_etf = (fund_type == 'ETF').to_numpy()
+    
+    limited = purchase.str.contains(LIMITED_PATTERN).to_numpy()
+    paused = purchase.str.contains(PAUSED_PATTERN).to_numpy()
+    opened = purchase.str.contains(OPEN_PATTERN).to_numpy()
+    empty = (purchase == '').to_numpy()
+    # ETF主要在场内交易，缺少申购状态时显示场内交易；LOF缺少时视为开放
+    purchase_status = np.select(
+        [limited, paused, opened, empty & is_etf, empty],
+        ['限大额', '暂停', '开放', '场内交易', '开放'],
+        default=purchase.to_numpy(dtype=object),
+    )
+    
+    # 从申购状态中提取限购金额，统一换算为元
+    amount = purchase.str.extract(LIMIT_AMOUNT_PATTERN)
+    multiplier = amount['unit'].fillna('').map(LIMIT_UNIT_MULTIPLIERS)
+    limit_amount = (pd.to_numeric(amount['amount'], errors='coerce') * multiplier).where(limited)
+    
+    redeem_status = np.where((redeem == '').to_numpy(), np.where(is_etf, '场内交易', '未知'), redeem.to_numpy(dtype=object))
+    fee_rate = pd.to_numeric(fee.str.extract(FEE_RATE_PATTERN)['rate'], errors='coerce')
+    
+    return pd.DataFrame({
+        '申购状态': _ordered_categorical(purchase_status, PURCHASE_STATUS_ORDER),
+        '赎回状态': _ordered_categorical(redeem_status, REDEEM_STATUS_ORDER),
+        '限购金额': limit_amount.astype('float64').to_numpy(),
+        '手续费': fee.replace('', '未知').to_numpy(dtype=object),
+        '手续费率': fee_rate.astype('float64').to_numpy(),
+    }, index=status.index)
+
+def format_limit_amount(amount):
+    """限购金额显示文本：1000元、100万、1.5亿"""
+    amount = pd.Series(amount, dtype='float64')
+    text = pd.Series('', index=amount.index, dtype=object)
+    yi = amount >= 1e8
+    wan = (amount >= 1e4) & ~yi
+    yuan = amount.notna() & ~yi & ~wan
+    text[yi] = (amount[yi] / 1e8).map('{:g}亿'.format)
+    text[wan] = (amount[wan] / 1e4).map('{:g}万'.format)
+    text[yuan] = amount[yuan].map('{:g}元'.format)
+    return text
+
+def purchase_status_display(df):
+    """申购状态显示文本：有限购金额时合并显示，例如 限大额(100万)"""
+    status = df['申购状态'].astype(str)
+    if '限购金额' not in df.columns:
+        return status
+    amount = format_limit_amount(df['限购金额'])
+    return status.where(amount == '', status + '(' + amount + ')')
+
+def get_etf_data():
+    """获取并合并ETF和LOF基金数据"""
+    print("=" * 60)
+    print("开始获取ETF和LOF基金数据...")
+    print("=" * 60)
+    
+    # 并发获取各数据源（总耗时取决于最慢的数据源，而不是各数据源耗时之和）
+    fetched = fetch_sources_concurrently({
+        'etf_spot': get_etf_realtime_data,
+        'lof_spot': get_lof_realtime_data,
+        'fund_nav': get_all_fund_nav,
+    })
+    
+    merge_span = metric_span('merge')
+    
+    # 各数据源获取后立即解析一次列名，之后统一使用标准列名
+    spot_frames = []
+    etf_has_iopv = False
+    for source, label, fund_type in [('etf_spot', 'ETF', 'ETF'), ('lof_spot', 'LOF基金', 'LOF')]:
+        raw_df = fetched[source].data
+        if raw_df is None or raw_df.empty:
+            print(f"无法获取{label}实时行情数据")
+            continue
+        print(f"获取到 {len(raw_df)} 条{label}实时行情数据")
+        schema = resolve_schema(raw_df, SPOT_SCHEMA, source, SPOT_REQUIRED_FIELDS)
+        print(schema.report())
+        if not schema.ok:
+            continue
+        spot_frames.append(schema.apply(raw_df, defaults={'type': fund_type}))
+        if fund_type == 'ETF':
+            etf_has_iopv = 'iopv' in schema.mapping
+    
+    # 合并ETF和LOF数据
+    if not spot_frames:
+        print("无法获取任何基金数据")
+        merge_span.end(status='empty', rows_out=0)
+        return None
+    spot = _clean_spot_frame(pd.concat(spot_frames, ignore_index=True))
+    print(f"总共获取到 {len(spot)} 条基金实时行情数据")
+    merge_span.set(rows_in=len(spot))
+    
+    # 检查ETF实时行情数据中是否已有IOPV实时估值（场外价格）
+    nav_lookup = None
+    if etf_has_iopv:
+        print("实时行情数据中包含IOPV实时估值，直接使用作为场外价格")
+    elif (spot['基金类型'] == 'ETF').any():
+        # 获取净值数据（场外价格）：只有行情中没有IOPV时才需要
+        nav_df = fetch_sources_concurrently({'etf_nav': get_etf_nav_data})['etf_nav'].data
+        if nav_df is None or nav_df.empty:
+            print("无法获取净值数据，将尝试逐个获取基金净值...")
+        else:
+            print(f"获取到 {len(nav_df)} 条净值数据")
+            nav_schema = resolve_schema(nav_df, ETF_NAV_SCHEMA, 'etf_nav', ETF_NAV_REQUIRED_FIELDS)
+            print(nav_schema.report())
+            if nav_schema.ok:
+                nav_lookup = nav_schema.apply(nav_df)
+                nav_lookup = nav_lookup[nav_lookup['净值数据'] != 0].dropna().drop_duplicates('代码')
+    
+    # 基金净值库（包含申购赎回状态和手续费信息），获取失败或超时时使用空表
+    nav_store = fetched['fund_nav'].data
+    if nav_store is None:
+        nav_store = FundNavStore(None)
+    
+    # 实时行情中缺少名称的基金，从基金基本信息中补全（基本信息整表只获取一次）
+    missing_name = spot['基金名称'] == ''
+    if missing_name.any():
+        names = spot.loc[missing_name, '代码'].map(get_fund_metadata().name_series())
+        spot.loc[missing_name, '基金名称'] = names.fillna('').astype(str).str.strip()
+        spot = spot[spot['基金名称'] != '']
+    
+    # 方法2: 实时行情中没有IOPV时，从净值数据中按代码关联
+    if nav_lookup is not None:
+        spot = spot.merge(nav_lookup, on='代码', how='left')
+        spot['场外价格'] = spot['场外价格'].fillna(spot.pop('净值数据'))
+    
+    # 方法3: 仍缺少场外价格的LOF基金，从开放式基金净值中查找
+    missing_nav = spot['场外价格'].isna() & (spot['基金类型'] == 'LOF')
+    if missing_nav.any():
+        lof_codes = spot.loc[missing_nav, '代码']
+        spot.loc[missing_nav, '场外价格'] = lof_codes.map(nav_store.nav_series())
+        stale_count = int(lof_codes.map(nav_store.frame['净值过期']).fillna(False).astype(bool).sum())
+        if stale_count:
+            print(f"⚠️  {stale_count} 只LOF基金使用的净值早于最新净值日期 {nav_store.latest_date}")
+    
+    # 过滤无效数据并计算溢价率
+    spot = spot.dropna(subset=['场内价格', '场外价格'])
+    spot['溢价率'] = calculate_premium_rate(spot['场内价格'], spot['场外价格'])
+    spot = spot.dropna(subset=['溢价率'])
+    
+    # 关联申购状态、赎回状态和手续费，并整列解析
+    spot = spot.join(nav_store.status_frame(), on='代码')
+    for col in FundNavStore.STATUS_COLUMNS:
+        if col not in spot.columns:
+            spot[col] = ''
+    
+    if spot.empty:
+        print("未能获取到有效数据")
+        merge_span.end(status='empty', rows_out=0)
+        return None
+    
+    status = normalize_status_columns(spot[FundNavStore.STATUS_COLUMNS], spot['基金类型'])
+    # 直接由列数组构建结果表：价格在精度允许时使用float32，类型和状态使用分类
+    result_df = pd.DataFrame({
+        '基金名称': spot['基金名称'].to_numpy(dtype=object),
+        '代码': spot['代码'].to_numpy(dtype=object),
+        '基金类型': pd.Categorical(spot['基金类型'].to_numpy(dtype=object), categories=FUND_TYPES),
+        '场内价格': downcast_float(spot['场内价格'].astype('float64').round(4)).to_numpy(),
+        '场外价格': downcast_float(spot['场外价格'].astype('float64').round(4)).to_numpy(),
+        '溢价率': spot['溢价率'].to_numpy(dtype='float64'),
+        '交易量': spot['交易量'].fillna(0).to_numpy(dtype='float64'),
+        '申购状态': status['申购状态'].array,
+        '赎回状态': status['赎回状态'].array,
+        '手续费': status['手续费'].to_numpy(dtype=object),
+        '限购金额': status['限购金额'].to_numpy(),
+        '手续费率': status['手续费率'].to_numpy(),
+    })
+    sources = ', '.join(f"{table}={source or '无'}" for table, source in get_table_sources().items())
+    print(f"数据来源: {sources}")
+    current_mb, peak_mb = process_memory_mb()
+    memory = f"结果数据 {frame_memory_mb(result_df):.2f}MB"
+    if current_mb is not None:
+        memory += f"，进程当前 {current_mb:.0f}MB"
+    if peak_mb is not None:
+        memory += f"，峰值 {peak_mb:.0f}MB"
+    print(f"内存占用: {memory}")
+    print(f"成功处理 {len(result_df)} 条有效ETF数据")
+    merge_span.end(rows_out=len(result_df), bytes=frame_bytes(result_df))
+    return result_df
+
+# 变动提醒配置（可在 config.yaml 的 alerts 部分覆盖）
+DEFAULT_ALERT_SETTINGS = {
+    'enabled': True,  # 是否在常驻模式下每次刷新后推送变动提醒
+    'premium_threshold': 3.0,  # 溢价率突破该值（%）时提醒
+    'discount_threshold': -3.0,  # 溢价率跌破该值（%）时提醒
+    'top_n': 10,  # 新进入溢价/折价榜前 N 名时提醒
+    'subject': '🔔 ETF/LOF溢价率变动提醒 - {time}',
+}
+_alert_settings = dict(DEFAULT_ALERT_SETTINGS)
+
+# 快照中保留的列：代码 -> 溢价率、价格和状态
+PREMIUM_SNAPSHOT_COLUMNS = ['基金名称', '溢价率', '场内价格', '场外价格', '申购状态', '赎回状态']
+
+def configure_alerts(config):
+    """根据配置更新变动提醒设置"""
+    alert_config = (config or {}).get('alerts') or {}
+    _alert_settings.update({k: v for k, v in alert_config.items() if v is not None})
+
+def premium_snapshot_path():
+    """上一次溢价率快照的缓存路径"""
+    return os.path.join(get_cache_dir(), f"premium_snapshot.{_cache_settings['snapshot_format']}")
+
+def build_premium_snapshot(df, top_n=None):
+    """从计算结果提取溢价率快照（以代码为索引），并标记溢价/折价榜前 N 名"""
+    top_n = int(top_n if top_n is not None else _alert_settings['top_n'])
+    snapshot = df.set_index('代码')[PREMIUM_SNAPSHOT_COLUMNS].copy()
+    snapshot.index = pd.Index(snapshot.index.astype(str).tolist(), name='代码')
+    snapshot = snapshot[~snapshot.index.duplicated()]
+    for col in ('申购状态', '赎回状态'):
+        snapshot[col] = snapshot[col].astype(object).where(snapshot[col].notna(), None)
+    snapshot['溢价率'] = snapshot['溢价率'].astype('float64')
+    snapshot['溢价榜'] = snapshot.index.isin(snapshot['溢价率'].nlargest(top_n).index)
+    snapshot['折价榜'] = snapshot.index.isin(snapshot['溢价率'].nsmallest(top_n).index)
+    return snapshot
+
+def load_premium_snapshot():
+    """读取上一次保存的溢价率快照，不存在时返回None"""
+    snapshot = _read_cached_table(premium_snapshot_path())
+    if snapshot is None or '代码' not in snapshot.columns:
+        return None
+    return snapshot.set_index('代码')
+
+def save_premium_snapshot(snapshot):
+    """保存溢价率快照，供下一次运行对比"""
+    _write_cached_table(premium_snapshot_path(), snapshot.reset_index())
+
+def diff_premium_snapshots(previous, current, settings=None):
+    """对比前后两次快照，只返回发生变化的基金
+    
+    变化包括：溢价率穿越溢价/折价阈值、新进入溢价/折价榜前 N 名、申购/赎回状态变化。
+    返回列：代码、基金名称、变动、变动前、变动后、溢价率；没有上一次快照时返回空表
+    """
+    settings = dict(_alert_settings, **(settings or {}))
+    columns = ['代码', '基金名称', '变动', '变动前', '变动后', '溢价率']
+    if previous is None or previous.empty or current is None or current.empty:
+        return pd.DataFrame(columns=columns)
+    
+    # 按代码对齐：新上市的基金在上一次快照中没有记录，对应值为空
+    before = previous.reindex(current.index)
+    listed = current.index.isin(previous.index)
+    now_premium = current['溢价率']
+    old_premium = before['溢价率'].astype('float64')
+    premium_high = float(settings['premium_threshold'])
+    discount_low = float(settings['discount_threshold'])
+    was_high = (old_premium >= premium_high).to_numpy()
+    is_high = (now_premium >= premium_high).to_numpy()
+    was_low = (old_premium <= discount_low).to_numpy()
+    is_low = (now_premium <= discount_low).to_numpy()
+    valid = now_premium.notna().to_numpy() & old_premium.notna().to_numpy()
+    was_top = before['溢价榜'].fillna(False).astype(bool).to_numpy()
+    was_bottom = before['折价榜'].fillna(False).astype(bool).to_numpy()
+    
+    premium_text = lambda values: values.map(lambda v: '-' if pd.isna(v) else f"{v:.2f}%")
+    rank_text = lambda flags, label: np.where(flags, label, '榜外')
+    status_changed = {
+        col: listed & before[col].notna().to_numpy() & current[col].notna().to_numpy()
+        & (before[col].astype(str).to_numpy() != current[col].astype(str).to_numpy())
+        for col in ('申购状态', '赎回状态')
+    }
+    # (事件, 命中的基金, 变动前, 变动后)
+    events = [
+        (f"突破溢价 {premium_high:g}%", is_high & ~was_high & listed, premium_text(old_premium), premium_text(now_premium)),
+        (f"回落至溢价 {premium_high:g}% 以下", was_high & ~is_high & valid, premium_text(old_premium), premium_text(now_premium)),
+        (f"跌破折价 {discount_low:g}%", is_low & ~was_low & listed, premium_text(old_premium), premium_text(now_premium)),
+        (f"回升至折价 {discount_low:g}% 以上", was_low & ~is_low & valid, premium_text(old_premium), premium_text(now_premium)),
+        (f"新进溢价榜 Top {settings['top_n']}", current['溢价榜'].to_numpy() & ~was_top,
+         rank_text(was_top, '榜内'), rank_text(current['溢价榜'].to_numpy(), '榜内')),
+        (f"新进折价榜 Top {settings['top_n']}", current['折价榜'].to_numpy() & ~was_bottom,
+         rank_text(was_bottom, '榜内'), rank_text(current['折价榜'].to_numpy(), '榜内')),
+        ("申购状态变化", status_changed['申购状态'], before['申购状态'], current['申购状态']),
+        ("赎回状态变化", status_changed['赎回状态'], before['赎回状态'], current['赎回状态']),
+    ]
+    
+    frames = []
+    for event, mask, old_values, new_values in events:
+        if not mask.any():
+            continue
+        frames.append(pd.DataFrame({
+            '代码': current.index[mask],
+            '基金名称': current['基金名称'].to_numpy(dtype=object)[mask],
+            '变动': event,
+            '变动前': np.asarray(old_values, dtype=object)[mask],
+            '变动后': np.asarray(new_values, dtype=object)[mask],
+            '溢价率': now_premium.to_numpy(dtype='float64')[mask],
+        }))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+# 溢价率历史配置（可在 config.yaml 的 history 部分覆盖）
+DEFAULT_HISTORY_SETTINGS = {
+    'enabled': True,  # 是否保存每次运行的计算结果
+    'dir': 'history',  # 历史数据目录，相对路径基于缓存目录
+    'keep_days': 400,  # 保留的天数，0 表示不清理
+    'window_days': 30,  # 滚动统计默认窗口（天）
+}
+_history_settings = dict(DEFAULT_HISTORY_SETTINGS)
+
+def configure_history(config):
+    """根据配置更新溢价率历史设置"""
+    history_config = (config or {}).get('history') or {}
+    _history_settings.update({k: v for k, v in history_config.items() if v is not None})
+
+class PremiumHistoryStore:
+    """溢价率历史：每次运行的计算结果按日期分区追加为 Parquet 文件
+    
+    当日的快照写入 <root>/date=YYYY-MM-DD/<HHMMSS>.parquet；已结束的交易日合并为该日分区的
+    data.parquet，已结束的月份再合并进 <root>/month=YYYY-MM/data.parquet（按代码、时间排序，小行组）。
+    每个文件只在所属的日或月结束后写入一次，当日的追加不会重写已有的数据，一年的历史只有十几个文件。
+    查询时按分区裁剪文件、按代码和时间下推过滤，通过内存映射只读取需要的列和行组
+    """
+    
+    _schema = None
+    
+    @classmethod
+    def schema(cls):
+        """历史数据的列结构（第一次使用时创建，避免导入时加载 pyarrow）"""
+        if cls._schema is None:
+            cls._schema = pa.schema([
+                ('时间', pa.timestamp('s')),
+                ('代码', pa.string()),
+                ('基金类型', pa.string()),
+                ('溢价率', pa.float64()),
+                ('场内价格', pa.float32()),
+                ('场外价格', pa.float32()),
+                ('交易量', pa.float64()),
+            ])
+        return cls._schema
+    MONTH_FILE = 'data.parquet'
+    DAY_FILE = 'data.parquet'
+    ROW_GROUP_SIZE = 4096
+    
+    def __init__(self, root=None, keep_days=None):
+        if root is None:
+            root = str(_history_settings['dir'])
+            if not os.path.isabs(root):
+                root = os.path.join(get_cache_dir(), root)
+        self.root = root
+        self.keep_days = int(keep_days if keep_days is not None else _history_settings['keep_days'])
+        self.filesystem = pa_fs.LocalFileSystem(use_mmap=True)
+    
+    def partitions(self, prefix):
+        """某一级分区（'date' 或 'month'）的已有分区（从旧到新），返回 [(分区值, 目录)]"""
+        if not os.path.isdir(self.root):
+            return []
+        marker = f"{prefix}="
+        return [
+            (name[len(marker):], os.path.join(self.root, name))
+            for name in sorted(os.listdir(self.root)) if name.startswith(marker)
+        ]
+    
+    @staticmethod
+    def _parquet_files(directory):
+        return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.parquet')]
+    
+    @staticmethod
+    def _write_table(path, table, **kwargs):
+        """先写临时文件再重命名，避免留下不完整的文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, f"{path}.tmp", **kwargs)
+        os.replace(f"{path}.tmp", path)
+    
+    def append(self, df, when=None):
+        """追加一次运行的计算结果，返回写入的文件路径"""
+        when = (when or datetime.now(BEIJING_TZ)).astimezone(BEIJING_TZ).replace(tzinfo=None, microsecond=0)
+        frame = pd.DataFrame({
+            '时间': pd.Series(when, index=df.index, dtype='datetime64[s]'),
+            '代码': df['代码'].astype(str).to_numpy(dtype=object),
+            '基金类型': df['基金类型'].astype(object).where(df['基金类型'].notna(), None).to_numpy(dtype=object)
+            if '基金类型' in df.columns else None,
+            '溢价率': df['溢价率'].to_numpy(dtype='float64'),
+            '场内价格': df['场内价格'].to_numpy(dtype='float32'),
+            '场外价格': df['场外价格'].to_numpy(dtype='float32'),
+            '交易量': df['交易量'].to_numpy(dtype='float64') if '交易量' in df.columns else np.nan,
+        })
+        table = pa.Table.from_pandas(frame, schema=self.schema(), preserve_index=False)
+        path = os.path.join(self.root, f"date={when:%Y-%m-%d}", f"{when:%H%M%S}.parquet")
+        self._write_table(path, table)
+        self.compact(today=f"{when:%Y-%m-%d}")
+        self.evict(today=when.date())
+        return path
+    
+    def _merge(self, files, path):
+        """将多个快照文件合并为一个按代码、时间排序的文件"""
+        table = pa.concat_tables(pq.read_table(file, schema=self.schema()) for file in files)
+        table = table.sort_by([('代码', 'ascending'), ('时间', 'ascending')])
+        self._write_table(path, table, row_group_size=self.ROW_GROUP_SIZE)
+    
+    def compact(self, today):
+        """合并已结束的分区：today 之前各日的快照合并为日文件，today 所在月份之前各月的日文件合并为月文件
+        
+        当日和当月的分区不合并，追加的开销不随历史增长
+        """
+        pending = {}
+        for day, day_dir in self.partitions('date'):
+            if day >= today:
+                continue
+            files = self._parquet_files(day_dir)
+            day_path = os.path.join(day_dir, self.DAY_FILE)
+            try:
+                if files and files != [day_path]:
+                    self._merge(files, day_path)
+                    for path in files:
+                        if path != day_path:
+                            os.remove(path)
+            except Exception as e:
+                print(f"合并溢价率历史失败 {day}: {e}")
+                continue
+            if day[:7] < today[:7]:
+                pending.setdefault(day[:7], []).append(day_dir)
+        
+        for month, day_dirs in pending.items():
+            try:
+                month_dir = os.path.join(self.root, f"month={month}")
+                month_path = os.path.join(month_dir, self.MONTH_FILE)
+                # 月份结束后补写的日期（例如导入旧数据）另存为一个新文件，不重写、不覆盖已有的文件
+                if os.path.exists(month_path):
+                    first_day = os.path.basename(day_dirs[0])[len('date='):]
+                    part = 1
+                    while os.path.exists(os.path.join(month_dir, f"data-{first_day}-{part}.parquet")):
+                        part += 1
+                    month_path = os.path.join(month_dir, f"data-{first_day}-{part}.parquet")
+                self._merge([path for day_dir in day_dirs for path in self._parquet_files(day_dir)], month_path)
+                for day_dir in day_dirs:
+                    for path in self._parquet_files(day_dir):
+                        os.remove(path)
+                    os.rmdir(day_dir)
+            except Exception as e:
+                print(f"合并溢价率历史失败 {month}: {e}")
+    
+    def evict(self, today=None):
+        """删除超过保留天数的月份分区（整月都早于保留期限时才删除）"""
+        if self.keep_days <= 0:
+            return
+        cutoff = f"{(today or datetime.now(BEIJING_TZ).date()) - timedelta(days=self.keep_days):%Y-%m}"
+        for month, month_dir in self.partitions('month'):
+            if month >= cutoff:
+                break
+            for path in self._parquet_files(month_dir):
+                os.remove(path)
+            os.rmdir(month_dir)
+    
+    def query(self, codes=None, start=None, end=None, columns=('溢价率',)):
+        """按代码和日期范围读取历史数据，返回按时间排序的长表（时间、代码及所选列）
+        
+        start/end 为日期（含），只扫描范围内的分区；代码和时间条件下推为行组过滤
+        """
+        start = str(start)[:10] if start is not None else None
+        end = str(end)[:10] if end is not None else None
+        files = []
+        for month, month_dir in self.partitions('month'):
+            if (start and month < start[:7]) or (end and month > end[:7]):
+                continue
+            files.extend(self._parquet_files(month_dir))
+        for day, day_dir in self.partitions('date'):
+            if (start and day < start) or (end and day > end):
+                continue
+            files.extend(self._parquet_files(day_dir))
+        
+        selected = ['时间', '代码'] + [col for col in columns if col not in ('时间', '代码')]
+        if not files:
+            return self.schema().empty_table().select(selected).to_pandas()
+        condition = None
+        if codes is not None:
+            codes = [codes] if isinstance(codes, str) else [str(code) for code in codes]
+            condition = ds.field('代码').isin(codes)
+        for bound, op in ((start, '__ge__'), (end, '__lt__')):
+            if bound:
+                value = pd.Timestamp(bound) + (pd.Timedelta(days=1) if op == '__lt__' else pd.Timedelta(0))
+                clause = getattr(ds.field('时间'), op)(pa.scalar(value.to_pydatetime(), pa.timestamp('s')))
+                condition = clause if condition is None else condition & clause
+        dataset = ds.dataset(files, schema=self.schema(), format='parquet', filesystem=self.filesystem)
+        table = dataset.to_table(columns=selected, filter=condition)
+        return table.sort_by([('时间', 'ascending'), ('代码', 'ascending')]).to_pandas()
+    
+    def series(self, code, start=None, end=None, column='溢价率'):
+        """单只基金的历史序列（以时间为索引）"""
+        history = self.query(codes=[code], start=start, end=end, columns=(column,))
+        return history.set_index('时间')[column].rename(str(code))
+    
+    def rolling_stats(self, code, window_days=None, end=None):
+        """单只基金溢价率的滚动统计：均值、标准差、Z值和分位（当前值在窗口内的百分位）"""
+        window_days = int(window_days or _history_settings['window_days'])
+        end_day = pd.Timestamp(end or datetime.now(BEIJING_TZ).date())
+        # 多读一个窗口，使范围内第一天的滚动统计也是完整窗口
+        start_day = end_day - pd.Timedelta(days=2 * window_days)
+        series = self.series(code, start=start_day.date(), end=end_day.date())
+        rolling = series.rolling(f"{window_days}D")
+        mean = rolling.mean()
+        std = rolling.std()
+        stats = pd.DataFrame({
+            '溢价率': series,
+            '均值': mean,
+            '标准差': std,
+            'Z值': (series - mean) / std.replace(0, np.nan),
+            '分位': rolling.rank(pct=True) * 100,
+        })
+        return stats[stats.index >= end_day - pd.Timedelta(days=window_days)]
+    
+    def summary(self, codes=None, window_days=None, end=None):
+        """各基金最近窗口内的溢价率统计：最新值、均值、标准差、分位、Z值、样本数（以代码为索引）"""
+        window_days = int(window_days or _history_settings['window_days'])
+        end_day = pd.Timestamp(end or datetime.now(BEIJING_TZ).date())
+        history = self.query(codes=codes, start=(end_day - pd.Timedelta(days=window_days)).date(), end=end_day.date())
+        history = history.dropna(subset=['溢价率'])
+        if history.empty:
+            return pd.DataFrame(columns=['最新', '均值', '标准差', '分位', 'Z值', '样本数'])
+        # 代码编码为整数后分组，避免对字符串反复哈希
+        codes, uniques = pd.factorize(history['代码'].to_numpy(dtype=object), sort=True)
+        values = history['溢价率'].to_numpy(dtype='float64')
+        grouped = pd.Series(values).groupby(codes)
+        latest = grouped.last().to_numpy()
+        mean = grouped.mean().to_numpy()
+        std = grouped.std().to_numpy()
+        # 最新值在窗口内的百分位：不大于最新值的样本占比
+        below = pd.Series(values <= latest[codes]).groupby(codes).mean().to_numpy() * 100
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscore = np.where(std > 0, (latest - mean) / std, np.nan)
+        stats = pd.DataFrame({
+            '最新': latest,
+            '均值': mean,
+            '标准差': std,
+            '分位': below,
+            'Z值': zscore,
+            '样本数': grouped.size().to_numpy(),
+        }, index=pd.Index(uniques, name='代码'))
+        return stats[['最新', '均值', '标准差', '分位', 'Z值', '样本数']]
+
+_history_store = None
+
+def get_history_store():
+    """获取溢价率历史存储"""
+    global _history_store
+    if _history_store is None:
+        _history_store = PremiumHistoryStore()
+    return _history_store
+
+def record_history(df):
+    """将本次计算结果追加到溢价率历史"""
+    if not _history_settings['enabled'] or df is None or df.empty:
+        return None
+    span = metric_span('history', rows_in=len(df))
+    try:
+        path = get_history_store().append(df)
+        span.end(status='ok', bytes=os.path.getsize(path))
+        print(f"已保存溢价率历史: {os.path.relpath(path, get_cache_dir())}")
+        return path
+    except Exception as e:
+        span.end(status='error', error=f"{type(e).__name__}: {e}")
+        print(f"保存溢价率历史失败: {e}")
+        return None
+
+# 导出配置（可在 config.yaml 的 export 部分覆盖）：每次运行将完整排行写入文件，供其他工具读取
+DEFAULT_EXPORT_SETTINGS = {
+    'enabled': False,
+    'dir': 'exports',  # 导出目录，相对路径基于缓存目录
+    'formats': ['csv', 'parquet', 'ndjson'],
+    'parquet_compression': 'zstd',  # snappy / gzip / zstd / none
+    'keep': 20,  # 每种格式保留的带时间戳文件数量，0 表示全部保留
+    'latest': True,  # 同时更新 premium_rate_latest.<扩展名>，供下游用固定路径读取
+}
+_export_settings = dict(DEFAULT_EXPORT_SETTINGS)
+
+EXPORT_PREFIX = 'premium_rate_'
+
+def configure_export(config):
+    """根据配置更新导出设置"""
+    export_config = (config or {}).get('export') or {}
+    _export_settings.update({k: v for k, v in export_config.items() if v is not None})
+
+def get_export_dir():
+    """导出目录的绝对路径"""
+    export_dir = str(_export_settings['dir'])
+    if not os.path.isabs(export_dir):
+        export_dir = os.path.join(get_cache_dir(), export_dir)
+    return export_dir
+
+def build_export_frame(df, when=None):
+    """完整排行：按溢价率从高到低排序并加上排名和时间
+    
+    float32 价格列按4位小数转回float64，避免文本格式中出现 1.6734999418 这样的值
+    """
+    when = when or datetime.now(BEIJING_TZ)
+    ranked = df.sort_values('溢价率', ascending=False, kind='stable').reset_index(drop=True)
+    for col in ranked.columns:
+        if ranked[col].dtype == 'float32':
+            ranked[col] = ranked[col].astype('float64').round(4)
+    ranked.insert(0, '排名', np.arange(1, len(ranked) + 1))
+    ranked.insert(0, '时间', pd.Timestamp(when).floor('s'))
+    return ranked
+
+def _iso_time_columns(df):
+    """带时区的时间列转为ISO 8601文本（保留+08:00），用于文本格式
+    
+    时间列只有很少几个不同的值，每个值只格式化一次
+    """
+    columns = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.DatetimeTZDtype):
+            codes, uniques = pd.factorize(df[col])
+            columns[col] = pd.Categorical.from_codes(codes, [ts.isoformat() for ts in uniques])
+    return df.assign(**columns) if columns else df
+
+def _export_csv(df, path):
+    # pyarrow 的CSV写入在C++中完成且不占用GIL，比 DataFrame.to_csv 快一个数量级；带BOM，Excel可直接打开
+    table = pa.Table.from_pandas(_iso_time_columns(df), preserve_index=False)
+    with open(path, 'wb') as f:
+        f.write(codecs.BOM_UTF8)
+        pa_csv.write_csv(table, f)
+
+def _export_parquet(df, path):
+    compression = _export_settings['parquet_compression']
+    compression = None if str(compression).lower() in ('', 'none') else compression
+    df.to_parquet(path, index=False, compression=compression)
+
+def _export_ndjson(df, path):
+    _iso_time_columns(df).to_json(path, orient='records', lines=True, force_ascii=False)
+
+# 导出格式：格式名 -> (扩展名, 写入函数)
+EXPORT_FORMATS = {
+    'csv': ('csv', _export_csv),
+    'parquet': ('parquet', _export_parquet),
+    'ndjson': ('ndjson', _export_ndjson),
+}
+
+def _evict_exports(export_dir, extension, keep):
+    """每种格式只保留最近的 keep 个带时间戳的文件"""
+    if keep <= 0:
+        return
+    latest = f"{EXPORT_PREFIX}latest.{extension}"
+    names = sorted(
+        name for name in os.listdir(export_dir)
+        if name.startswith(EXPORT_PREFIX) and name.endswith(f".{extension}") and name != latest
+    )
+    for name in names[:-keep]:
+        try:
+            os.remove(os.path.join(export_dir, name))
+        except OSError as e:
+            print(f"删除旧导出文件失败 {name}: {e}")
+
+def export_results(df, when=None):
+    """将完整排行写入各导出格式，返回 ({格式: 路径}, {格式: 错误})
+    
+    每个文件先写入临时文件再重命名，读取方不会看到写了一半的文件
+    """
+    when = when or datetime.now(BEIJING_TZ)
+    export_dir = get_export_dir()
+    os.makedirs(export_dir, exist_ok=True)
+    ranked = build_export_frame(df, when)
+    paths, errors = {}, {}
+    for fmt in _export_settings['formats']:
+        if fmt not in EXPORT_FORMATS:
+            errors[fmt] = f"不支持的导出格式: {fmt}"
+            continue
+        extension, write = EXPORT_FORMATS[fmt]
+        path = os.path.join(export_dir, f"{EXPORT_PREFIX}{when:%Y%m%d_%H%M%S}.{extension}")
+        tmp_path = f"{path}.tmp"
+        try:
+            write(ranked, tmp_path)
+            os.replace(tmp_path, path)
+            if _export_settings['latest']:
+                latest = os.path.join(export_dir, f"{EXPORT_PREFIX}latest.{extension}")
+                shutil.copyfile(path, f"{latest}.tmp")
+                os.replace(f"{latest}.tmp", latest)
+            _evict_exports(export_dir, extension, int(_export_settings['keep']))
+            paths[fmt] = path
+        except Exception as e:
+            errors[fmt] = f"{type(e).__name__}: {e}"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return paths, errors
+
+class ExportTask:
+    """后台导出任务：在邮件渲染和发送的同时写入导出文件"""
+    
+    def __init__(self, df, when=None):
+        self.paths = {}
+        self.errors = {}
+        self._thread = threading.Thread(target=self._run, args=(df, when, _metrics.current()), name='export')
+    
+    def _run(self, df, when, parent_span):
+        with metric_span('export', parent=parent_span, rows_in=len(df)) as span:
+            try:
+                self.paths, self.errors = export_results(df, when)
+            except Exception as e:
+                self.errors = {'*': f"{type(e).__name__}: {e}"}
+            span.set(status='error' if self.errors else 'ok',
+                     bytes=sum(os.path.getsize(path) for path in self.paths.values() if os.path.exists(path)))
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def wait(self):
+        """等待导出完成并打印结果，全部成功时返回True"""
+        self._thread.join()
+        if self.paths:
+            print(f"📤 已导出完整排行: {', '.join(os.path.relpath(path, get_cache_dir()) for path in self.paths.values())}")
+        for fmt, error in self.errors.items():
+            print(f"❌ 导出 {fmt} 失败: {error}")
+        return not self.errors
+
+def start_export(df):
+    """启用导出时在后台线程中开始导出，返回 ExportTask（未启用或没有数据时为None）"""
+    if not _export_settings['enabled'] or df is None or df.empty:
+        return None
+    return ExportTask(df).start()
+
+def wait_export(task):
+    """等待后台导出完成（task 为None时直接返回）"""
+    return task.wait() if task is not None else True
+
+def load_config():
+    """加载配置文件
+    优先从环境变量（Repository secrets）读取，其次从 config.yaml 读取
+    """
+    config = {}
+    
+    # 优先从环境变量读取配置（GitHub Actions Repository secrets）
+    print("正在从环境变量读取配置...")
+    email_config = {}
+    smtp_config = {}
+    
+    # 读取所有环境变量
+    recipients_env = os.getenv('EMAIL_RECIPIENTS', '')
+    email_subject_env = os.getenv('EMAIL_SUBJECT', '')
     
     # 读取 SMTP 配置
     if os.getenv('EMAIL_SMTP_HOST'):
@@ -601,336 +2343,564 @@ def load_config():
     
     return config
 
+def format_volume(volume):
+    """交易量显示文本（整列）：亿、万或原值，无交易量显示 -"""
+    volume = pd.Series(volume, dtype='float64').fillna(0)
+    text = pd.Series('-', index=volume.index, dtype=object)
+    yi = volume >= 100000000
+    wan = (volume >= 10000) & ~yi
+    small = (volume > 0) & ~yi & ~wan
+    text[yi] = (volume[yi] / 100000000).map('{:.2f}亿'.format)
+    text[wan] = (volume[wan] / 10000).map('{:.2f}万'.format)
+    text[small] = volume[small].map('{:.0f}'.format)
+    return text
+
+def format_premium(premium):
+    """溢价率显示文本和样式（整列）：🔺 表示溢价，🔻 表示折价"""
+    premium = pd.Series(premium, dtype='float64')
+    text = premium.map('{:.2f}%'.format)
+    arrow = np.select([premium > 0, premium < 0], ['🔺 ', '🔻 '], default='')
+    css_class = np.where(premium > 0, 'premium-positive', 'premium-negative')
+    return arrow + text.to_numpy(dtype=object), css_class
+
+def _format_section_columns(rows_df):
+    """整列格式化排行榜中的各字段，返回 {字段: 文本列表}，供各种输出格式共用"""
+    def text_column(column, default):
+        if column in rows_df.columns:
+            return rows_df[column].astype(str).tolist()
+        return [default] * len(rows_df)
+    
+    names = text_column('基金名称', '') if '基金名称' in rows_df.columns else text_column('ETF名称', '')
+    premium_text, premium_class = format_premium(rows_df['溢价率'])
+    volume = rows_df['交易量'] if '交易量' in rows_df.columns else pd.Series(0, index=rows_df.index)
+    purchase = purchase_status_display(rows_df).tolist() if '申购状态' in rows_df.columns else ['未知'] * len(rows_df)
+    return {
+        'rank': list(range(1, len(rows_df) + 1)),
+        'name': names,
+        'code': rows_df['代码'].astype(str).tolist(),
+        'fund_type': text_column('基金类型', 'ETF'),
+        'spot': rows_df['场内价格'].astype('float64').map('{:.4f}'.format).tolist(),
+        'nav': rows_df['场外价格'].astype('float64').map('{:.4f}'.format).tolist(),
+        'css_class': premium_class.tolist(),
+        'premium': premium_text.tolist(),
+        'volume': format_volume(volume).tolist(),
+        'purchase_status': purchase,
+        'redeem_status': text_column('赎回状态', '未知'),
+        'fee': text_column('手续费', '未知'),
+    }
+
+def build_report_data(df, top_n=100, only_premium=False):
+    """选出排行榜并一次性完成统计和格式化，返回各种输出格式模板共用的报告数据"""
+    if df is None or df.empty:
+        return None
+    
+    # 部分选择：只取溢价率最高/最低的 top_n 条，不对全表排序（top_n 为空或不大于0时显示全部）
+    limit = len(df) if not top_n or top_n <= 0 else int(top_n)
+    sections = [{
+        'title': f"🔺 溢价率最高 Top {top_n}",
+        'columns': _format_section_columns(df.nlargest(limit, '溢价率')),
+    }]
+    # 如果不只显示溢价，也显示折价最高的
+    if not only_premium:
+        sections.append({
+            'title': f"🔻 溢价率最低 Top {top_n} (折价最高)",
+            'columns': _format_section_columns(df.nsmallest(limit, '溢价率')),
+        })
+    
+    # 计算统计数据，使用东八区时间（北京时间）
+    premium = df['溢价率']
+    fund_types = df['基金类型'] if '基金类型' in df.columns else None
+    summary = {
+        'timestamp': datetime.now(BEIJING_TZ).strftime("%Y-%m-%d %H:%M:%S"),
+        'total_count': len(df),
+        'etf_count': int((fund_types == 'ETF').sum()) if fund_types is not None else 0,
+        'lof_count': int((fund_types == 'LOF').sum()) if fund_types is not None else 0,
+        'avg_premium': f"{premium.mean():.2f}",
+        'max_premium': f"{premium.max():.2f}",
+        'min_premium': f"{premium.min():.2f}",
+        'premium_count': int((premium > 0).sum()),
+        'discount_count': int((premium < 0).sum()),
+    }
+    return {'summary': summary, 'sections': sections}
+
+def render_report(report, fmt='html'):
+    """用已编译的模板渲染报告（html / text / markdown）"""
+    return REPORT_TEMPLATES[fmt].render(report)
+
+def generate_reports(df, top_n=100, only_premium=False, formats=('html', 'text', 'markdown')):
+    """一次计算，渲染多种输出格式，返回 {格式: 内容}"""
+    report = build_report_data(df, top_n=top_n, only_premium=only_premium)
+    return {fmt: render_report(report, fmt) for fmt in formats}
+
 def generate_email_html(df, top_n=100, only_premium=False):
     """生成HTML格式的邮件内容（针对邮箱优化）"""
-    if df is None or df.empty:
-        return "<html><body><p>未能获取到数据</p></body></html>"
-    
-    # 按溢价率排序
-    df_sorted = df.sort_values('溢价率', ascending=False)
-    # 使用东八区时间（北京时间）
-    beijing_tz = timezone(timedelta(hours=8))
-    timestamp = datetime.now(beijing_tz).strftime("%Y-%m-%d %H:%M:%S")
-    
-    # 计算统计数据
-    total_count = len(df)
-    etf_count = len(df[df['基金类型'] == 'ETF']) if '基金类型' in df.columns else 0
-    lof_count = len(df[df['基金类型'] == 'LOF']) if '基金类型' in df.columns else 0
-    avg_premium = df['溢价率'].mean()
-    max_premium = df['溢价率'].max()
-    min_premium = df['溢价率'].min()
-    premium_count = len(df[df['溢价率'] > 0])
-    discount_count = len(df[df['溢价率'] < 0])
-    
-    # 生成HTML邮件
-    html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
-            line-height: 1.6;
-            color: #333;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }}
-        .container {{
-            background-color: #ffffff;
-            border-radius: 8px;
-            padding: 30px;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-        }}
-        h1 {{
-            color: #2c3e50;
-            text-align: center;
-            border-bottom: 3px solid #3498db;
-            padding-bottom: 10px;
-            margin-bottom: 30px;
-        }}
-        .stats {{
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 20px;
-            border-radius: 8px;
-            margin: 20px 0;
-        }}
-        .stats-grid {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 15px;
-            margin-top: 15px;
-        }}
-        .stat-item {{
-            background: rgba(255,255,255,0.2);
-            padding: 10px;
-            border-radius: 5px;
-            text-align: center;
-        }}
-        .stat-label {{
-            font-size: 12px;
-            opacity: 0.9;
-        }}
-        .stat-value {{
-            font-size: 24px;
-            font-weight: bold;
-            margin-top: 5px;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin: 20px 0;
-            font-size: 14px;
-        }}
-        th {{
-            background-color: #3498db;
-            color: white;
-            padding: 12px;
-            text-align: left;
-            font-weight: 600;
-        }}
-        td {{
-            padding: 10px;
-            border-bottom: 1px solid #ddd;
-        }}
-        tr:nth-child(even) {{
-            background-color: #f9f9f9;
-        }}
-        tr:hover {{
-            background-color: #f0f7ff;
-        }}
-        .premium-positive {{
-            color: #e74c3c;
-            font-weight: bold;
-        }}
-        .premium-negative {{
-            color: #27ae60;
-            font-weight: bold;
-        }}
-        .footer {{
-            text-align: center;
-            margin-top: 30px;
-            padding-top: 20px;
-            border-top: 1px solid #ddd;
-            color: #7f8c8d;
-            font-size: 12px;
-        }}
-        .section-title {{
-            background-color: #34495e;
-            color: white;
-            padding: 10px 15px;
-            border-radius: 5px;
-            margin: 30px 0 15px 0;
-            font-size: 18px;
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>📊 ETF/LOF溢价率排行榜</h1>
-        
-        <div style="text-align: center; color: #7f8c8d; margin-bottom: 20px;">
-            <p>📅 更新时间: <strong>{timestamp}</strong></p>
-            <p>📊 数据来源: akshare</p>
-        </div>
-        
-        <div class="stats">
-            <h2 style="margin-top: 0; text-align: center;">📈 统计概览</h2>
-            <div class="stats-grid">
-                <div class="stat-item">
-                    <div class="stat-label">总基金数量</div>
-                    <div class="stat-value">{total_count}</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">ETF数量</div>
-                    <div class="stat-value">{etf_count}</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">LOF数量</div>
-                    <div class="stat-value">{lof_count}</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">平均溢价率</div>
-                    <div class="stat-value">{avg_premium:.2f}%</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">最高溢价率</div>
-                    <div class="stat-value">{max_premium:.2f}%</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">最低溢价率</div>
-                    <div class="stat-value">{min_premium:.2f}%</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">溢价基金数量</div>
-                    <div class="stat-value">{premium_count}</div>
-                </div>
-                <div class="stat-item">
-                    <div class="stat-label">折价基金数量</div>
-                    <div class="stat-value">{discount_count}</div>
-                </div>
-            </div>
-        </div>
-        
-        <div class="section-title">🔺 溢价率最高 Top {top_n}</div>
-        <table>
-            <thead>
-                <tr>
-                    <th>排名</th>
-                    <th>基金名称</th>
-                    <th>代码</th>
-                    <th>类型</th>
-                    <th>场内价</th>
-                    <th>场外价</th>
-                    <th>溢价率</th>
-                    <th>交易量</th>
-                    <th>申购状态</th>
-                    <th>赎回状态</th>
-                    <th>手续费</th>
-                </tr>
-            </thead>
-            <tbody>
-"""
+    return render_report(build_report_data(df, top_n=top_n, only_premium=only_premium), 'html')
+
+# 报告方案：不同收件人组收到不同视图的报告（config.yaml 的 report.profiles），所有方案共用同一份计算结果
+REPORT_PROFILE_FIELDS = ('top_n', 'only_premium', 'fund_types', 'min_premium', 'max_premium', 'purchase_status')
+DEFAULT_REPORT_PROFILE = 'default'
+
+def _as_list(value):
+    if value is None or value == []:
+        return None
+    return sorted(str(item) for item in (value if isinstance(value, (list, tuple)) else [value]))
+
+def report_params(config, profile=None):
+    """报告的视图参数：方案中没有设置的字段使用 report 部分的全局设置"""
+    report_config = (config or {}).get('report') or {}
+    profile = profile or {}
+    pick = lambda field, default=None: profile.get(field, report_config.get(field, default))
+    as_float = lambda value: None if value is None else float(value)
+    return {
+        'top_n': pick('top_n', 100),
+        'only_premium': bool(pick('only_premium', False)),
+        'fund_types': _as_list(pick('fund_types')),  # 只包含这些基金类型（ETF/LOF）
+        'min_premium': as_float(pick('min_premium')),  # 溢价率下限（%）
+        'max_premium': as_float(pick('max_premium')),  # 溢价率上限（%）
+        'purchase_status': _as_list(pick('purchase_status')),  # 只包含这些申购状态（开放/限大额/暂停/场内交易/未知）
+    }
+
+def report_params_key(params):
+    """视图参数的缓存键（参数相同的方案共用一次渲染）"""
+    return json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+def report_profiles(config):
+    """报告方案列表，每项为 {'name', 'params', 'recipients', 'subject'}
     
-    # 生成溢价率最高的表格
-    top_high = df_sorted.head(top_n)
-    for idx, (_, row) in enumerate(top_high.iterrows(), 1):
-        fund_name = row.get('基金名称', row.get('ETF名称', ''))
-        fund_type = row.get('基金类型', 'ETF')
-        purchase_status = row.get('申购状态', '未知')
-        redeem_status = row.get('赎回状态', '未知')
-        fee_rate = row.get('手续费', '未知')
-        
-        premium_rate = row['溢价率']
-        premium_class = 'premium-positive' if premium_rate > 0 else 'premium-negative'
-        premium_str = f"{premium_rate:.2f}%"
-        if premium_rate > 0:
-            premium_str = f"🔺 {premium_str}"
-        elif premium_rate < 0:
-            premium_str = f"🔻 {premium_str}"
-        
-        # 格式化交易量显示
-        volume_value = row.get('交易量', 0)
-        if volume_value and volume_value > 0:
-            if volume_value >= 100000000:
-                volume_str = f"{volume_value/100000000:.2f}亿"
-            elif volume_value >= 10000:
-                volume_str = f"{volume_value/10000:.2f}万"
+    email.recipients 收到 report 部分的默认视图；report.profiles 中的每个方案发送给各自的收件人
+    """
+    email_config = (config or {}).get('email') or {}
+    subject = email_config.get('subject', '📊 ETF/LOF溢价率排行榜 - {date}')
+    configured = ((config or {}).get('report') or {}).get('profiles') or {}
+    profiles = []
+    # 配置了报告方案但没有默认收件人时，不发送默认视图
+    if email_config.get('recipients') or not configured:
+        profiles.append({
+            'name': DEFAULT_REPORT_PROFILE,
+            'params': report_params(config),
+            'recipients': email_config.get('recipients'),
+            'subject': subject,
+        })
+    for name, profile in configured.items():
+        profile = profile or {}
+        profiles.append({
+            'name': str(name),
+            'params': report_params(config, profile),
+            'recipients': profile.get('recipients') or [],
+            'subject': profile.get('subject', subject),
+        })
+    return profiles
+
+def alert_recipients(config):
+    """变动提醒的收件人：email.recipients，没有默认收件人时为所有报告方案收件人的并集"""
+    recipients = ((config or {}).get('email') or {}).get('recipients') or []
+    if recipients:
+        return list(recipients)
+    for profile in report_profiles(config):
+        for recipient in profile['recipients'] or []:
+            if recipient not in recipients:
+                recipients.append(recipient)
+    return recipients
+
+def filter_report_frame(df, params):
+    """按视图参数筛选计算结果（整列比较，不复制不需要筛选的数据）"""
+    mask = np.ones(len(df), dtype=bool)
+    if params.get('fund_types') and '基金类型' in df.columns:
+        mask &= df['基金类型'].isin(params['fund_types']).to_numpy()
+    if params.get('min_premium') is not None:
+        mask &= (df['溢价率'] >= params['min_premium']).to_numpy()
+    if params.get('max_premium') is not None:
+        mask &= (df['溢价率'] <= params['max_premium']).to_numpy()
+    if params.get('purchase_status') and '申购状态' in df.columns:
+        mask &= df['申购状态'].isin(params['purchase_status']).to_numpy()
+    return df if mask.all() else df[mask]
+
+class ReportRenderCache:
+    """同一份计算结果的报告渲染缓存：按视图参数缓存报告数据和渲染结果
+    
+    N 个报告方案只需一次数据获取和计算，参数相同的方案只渲染一次（批量运行时多个作业同时使用）。
+    也可以用缓存的报告数据创建（reports），需要其他视图时再通过 load_frame 读取计算结果
+    """
+    
+    def __init__(self, df=None, reports=None, load_frame=None):
+        self.df = df
+        self.load_frame = load_frame
+        self._data = dict(reports or {})
+        self._rendered = {}
+        self._lock = threading.RLock()
+        self.builds = 0
+        self.hits = 0
+    
+    def report(self, params):
+        """视图对应的报告数据，筛选后没有基金时为None"""
+        key = report_params_key(params)
+        with self._lock:
+            return self._report(key, params)
+    
+    def _report(self, key, params):
+        if key not in self._data:
+            if self.df is None and self.load_frame is not None:
+                print(f"缓存中没有该视图的报告数据（{params}），从缓存的计算结果重新生成...")
+                self.df = self.load_frame()
+                self.load_frame = None
+            if self.df is None:
+                return None
+            self._data[key] = build_report_data(filter_report_frame(self.df, params),
+                                                top_n=params['top_n'], only_premium=params['only_premium'])
+            self.builds += 1
+        return self._data[key]
+    
+    def render(self, params, fmt='html'):
+        """渲染视图，筛选后没有基金时为None"""
+        key = (report_params_key(params), fmt)
+        with self._lock:
+            if key in self._rendered:
+                self.hits += 1
             else:
-                volume_str = f"{volume_value:.0f}"
+                report = self.report(params)
+                self._rendered[key] = None if report is None else render_report(report, fmt)
+            return self._rendered[key]
+    
+    def render_all(self, params, formats=('html', 'text', 'markdown')):
+        """渲染多种输出格式，返回 {格式: 内容}，筛选后没有基金时为None"""
+        if self.report(params) is None:
+            return None
+        return {fmt: self.render(params, fmt) for fmt in formats}
+
+def build_alert_data(alerts):
+    """整列格式化变动提醒，返回各种输出格式模板共用的数据"""
+    premium_text, premium_class = format_premium(alerts['溢价率'])
+    return {
+        'timestamp': datetime.now(BEIJING_TZ).strftime("%Y-%m-%d %H:%M:%S"),
+        'count': len(alerts),
+        'columns': {
+            'event': alerts['变动'].astype(str).tolist(),
+            'name': alerts['基金名称'].fillna('').astype(str).tolist(),
+            'code': alerts['代码'].astype(str).tolist(),
+            'before': alerts['变动前'].fillna('-').astype(str).tolist(),
+            'after': alerts['变动后'].fillna('-').astype(str).tolist(),
+            'premium': premium_text.tolist(),
+            'css_class': premium_class.tolist(),
+        },
+    }
+
+def generate_alert_reports(alerts, formats=('html', 'text', 'markdown')):
+    """渲染变动提醒，返回 {格式: 内容}"""
+    data = build_alert_data(alerts)
+    return {fmt: ALERT_TEMPLATES[fmt].render(data) for fmt in formats}
+
+# 邮件投递配置（可在 config.yaml 的 delivery 部分覆盖）
+DEFAULT_DELIVERY_SETTINGS = {
+    'batch_size': 50,  # 每封邮件的收件人数量
+    'max_connections': 4,  # 最多同时使用的SMTP连接数（并行发送的批次数）
+    'retries': 3,  # 临时错误的重试次数
+    'backoff_seconds': 2,  # 首次重试前的等待时间（秒），之后每次加倍
+    'max_backoff_seconds': 30,  # 重试等待时间上限（秒）
+    'timeout_seconds': 30,  # SMTP连接超时（秒）
+    'log': 'delivery.jsonl',  # 每个收件人的投递结果（相对路径基于缓存目录），留空则不记录
+}
+_delivery_settings = dict(DEFAULT_DELIVERY_SETTINGS)
+
+def configure_delivery(config):
+    """根据配置更新邮件投递设置"""
+    delivery_config = (config or {}).get('delivery') or {}
+    _delivery_settings.update({k: v for k, v in delivery_config.items() if k == 'log' or v is not None})
+
+class SMTPConnectionPool:
+    """SMTP连接池：登录后的连接在同一次运行的多封邮件、多个批次之间复用，常驻模式下一直保持
+    
+    同时使用的连接数不超过 size；空闲一段时间的连接取出前先用 NOOP 确认仍然可用
+    """
+    
+    NOOP_AFTER_SECONDS = 30
+    
+    def __init__(self, smtp_config, size=4, timeout=30):
+        self.smtp_config = dict(smtp_config)
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self.opened = 0  # 新建的连接数
+        self._idle = []  # [(连接, 放回时间)]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+    
+    @staticmethod
+    def key(smtp_config):
+        """连接参数相同的配置共用一个连接池"""
+        return tuple(smtp_config.get(field) for field in ('host', 'port', 'use_tls', 'username', 'password'))
+    
+    def _connect(self):
+        smtp_config = self.smtp_config
+        if smtp_config.get('use_tls', True):
+            server = smtplib.SMTP(smtp_config['host'], smtp_config['port'], timeout=self.timeout)
+            server.starttls()
         else:
-            volume_str = "-"
-        
-        html += f"""                <tr>
-                    <td>{idx}</td>
-                    <td>{fund_name}</td>
-                    <td>{row['代码']}</td>
-                    <td>{fund_type}</td>
-                    <td>{row['场内价格']:.4f}</td>
-                    <td>{row['场外价格']:.4f}</td>
-                    <td class="{premium_class}">{premium_str}</td>
-                    <td>{volume_str}</td>
-                    <td>{purchase_status}</td>
-                    <td>{redeem_status}</td>
-                    <td>{fee_rate}</td>
-                </tr>
-"""
+            server = smtplib.SMTP_SSL(smtp_config['host'], smtp_config['port'], timeout=self.timeout)
+        try:
+            server.login(smtp_config['username'], smtp_config['password'])
+        except Exception:
+            self._close(server)
+            raise
+        with self._lock:
+            self.opened += 1
+        return server
     
-    html += """            </tbody>
-        </table>
-"""
+    @staticmethod
+    def _alive(server):
+        try:
+            return server.noop()[0] == 250
+        except Exception:
+            return False
     
-    # 如果不只显示溢价，也显示折价最高的
-    if not only_premium:
-        html += f"""        
-        <div class="section-title">🔻 溢价率最低 Top {top_n} (折价最高)</div>
-        <table>
-            <thead>
-                <tr>
-                    <th>排名</th>
-                    <th>基金名称</th>
-                    <th>代码</th>
-                    <th>类型</th>
-                    <th>场内价</th>
-                    <th>场外价</th>
-                    <th>溢价率</th>
-                    <th>交易量</th>
-                    <th>申购状态</th>
-                    <th>赎回状态</th>
-                    <th>手续费</th>
-                </tr>
-            </thead>
-            <tbody>
-"""
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+    
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, released = self._idle.pop()
+            if time.monotonic() - released < self.NOOP_AFTER_SECONDS or self._alive(server):
+                return server
+            self._close(server)
+        return self._connect()
+    
+    @contextlib.contextmanager
+    def connection(self):
+        """取出一个可用连接，用完后放回；出错的连接状态未知，直接关闭"""
+        self._slots.acquire()
+        server = None
+        try:
+            server = self._checkout()
+            yield server
+        except Exception:
+            if server is not None:
+                self._close(server)
+                server = None
+            raise
+        finally:
+            if server is not None:
+                with self._lock:
+                    self._idle.append((server, time.monotonic()))
+            self._slots.release()
+    
+    def keepalive(self):
+        """对空闲连接发送 NOOP，保持连接并丢弃已被服务器断开的连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        alive = []
+        for server, _ in idle:
+            if self._alive(server):
+                alive.append((server, time.monotonic()))
+            else:
+                self._close(server)
+        with self._lock:
+            self._idle.extend(alive)
+        return len(alive)
+    
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server)
+
+# 全局变量：每个SMTP账号一个连接池（批量运行时多个作业可能使用不同的账号）
+_smtp_pools = {}
+_smtp_pools_lock = threading.Lock()
+
+def get_smtp_pool(smtp_config, settings=None):
+    """获取与SMTP配置对应的连接池"""
+    settings = settings or _delivery_settings
+    key = SMTPConnectionPool.key(smtp_config)
+    with _smtp_pools_lock:
+        if key not in _smtp_pools:
+            _smtp_pools[key] = SMTPConnectionPool(smtp_config, size=settings['max_connections'],
+                                                  timeout=settings['timeout_seconds'])
+        return _smtp_pools[key]
+
+def keepalive_smtp_pools():
+    """对所有连接池的空闲连接发送 NOOP（常驻模式每个刷新周期调用）"""
+    with _smtp_pools_lock:
+        pools = list(_smtp_pools.values())
+    for pool in pools:
+        pool.keepalive()
+
+def close_smtp_pool():
+    """关闭所有连接池中的连接（运行结束或常驻模式退出时调用）"""
+    with _smtp_pools_lock:
+        pools = list(_smtp_pools.values())
+        _smtp_pools.clear()
+    for pool in pools:
+        pool.close()
+
+def is_transient_smtp_error(error):
+    """是否为可以重试的临时错误：4xx响应、连接断开、超时等网络错误"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+def _smtp_error_text(code, message):
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', errors='replace')
+    return f"{code} {message}"
+
+def build_email_message(sender, subject, html_content, text_content=None):
+    """生成邮件（可附带纯文本版本，供不显示HTML的邮件客户端使用）
+    
+    收件人只出现在SMTP信封中（相当于密送），To 为发件人：分批发送时每个收件人看到的邮件相同，
+    也不会暴露其他收件人的地址
+    """
+    msg = MIMEMultipart('alternative')
+    msg['From'] = sender
+    msg['To'] = sender
+    msg['Subject'] = Header(subject, 'utf-8')
+    
+    # 添加纯文本内容（alternative 中最后一部分优先显示，因此放在HTML之前）
+    if text_content:
+        msg.attach(MIMEText(text_content, 'plain', 'utf-8'))
+    
+    # 添加HTML内容
+    msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+    return msg.as_string()
+
+def deliver_batch(pool, sender, recipients, message, settings=None):
+    """通过连接池发送一批收件人，临时错误按指数退避重试
+    
+    message 为 build_email_message 生成的邮件内容；重试时只发送给尚未成功的收件人
+    返回 {收件人: {'status': 'sent'/'failed', 'attempts': 尝试次数, 'error': 错误}}
+    """
+    settings = dict(_delivery_settings, **(settings or {}))
+    outcomes = {}
+    pending = list(recipients)
+    attempt = 0
+    while pending:
+        attempt += 1
+        refused, error = {}, None
+        try:
+            with pool.connection() as server:
+                refused = server.sendmail(sender, pending, message)
+        except smtplib.SMTPRecipientsRefused as e:
+            refused = e.recipients
+        except Exception as e:
+            error = e
         
-        top_low = df_sorted.tail(top_n).sort_values('溢价率', ascending=True)
-        for idx, (_, row) in enumerate(top_low.iterrows(), 1):
-            fund_name = row.get('基金名称', row.get('ETF名称', ''))
-            fund_type = row.get('基金类型', 'ETF')
-            purchase_status = row.get('申购状态', '未知')
-            redeem_status = row.get('赎回状态', '未知')
-            fee_rate = row.get('手续费', '未知')
-            
-            premium_rate = row['溢价率']
-            premium_class = 'premium-positive' if premium_rate > 0 else 'premium-negative'
-            premium_str = f"{premium_rate:.2f}%"
-            if premium_rate > 0:
-                premium_str = f"🔺 {premium_str}"
-            elif premium_rate < 0:
-                premium_str = f"🔻 {premium_str}"
-            
-            # 格式化交易量显示
-            volume_value = row.get('交易量', 0)
-            if volume_value and volume_value > 0:
-                if volume_value >= 100000000:
-                    volume_str = f"{volume_value/100000000:.2f}亿"
-                elif volume_value >= 10000:
-                    volume_str = f"{volume_value/10000:.2f}万"
+        # 拒收的收件人按各自的响应码区分临时和永久错误
+        retry = {}
+        for recipient in pending:
+            if error is not None:
+                if is_transient_smtp_error(error):
+                    retry[recipient] = f"{type(error).__name__}: {error}"
                 else:
-                    volume_str = f"{volume_value:.0f}"
+                    outcomes[recipient] = {'status': 'failed', 'attempts': attempt, 'error': f"{type(error).__name__}: {error}"}
+            elif recipient in refused:
+                code, reply = refused[recipient]
+                if 400 <= code < 500:
+                    retry[recipient] = _smtp_error_text(code, reply)
+                else:
+                    outcomes[recipient] = {'status': 'failed', 'attempts': attempt, 'error': _smtp_error_text(code, reply)}
             else:
-                volume_str = "-"
-            
-            html += f"""                <tr>
-                    <td>{idx}</td>
-                    <td>{fund_name}</td>
-                    <td>{row['代码']}</td>
-                    <td>{fund_type}</td>
-                    <td>{row['场内价格']:.4f}</td>
-                    <td>{row['场外价格']:.4f}</td>
-                    <td class="{premium_class}">{premium_str}</td>
-                    <td>{volume_str}</td>
-                    <td>{purchase_status}</td>
-                    <td>{redeem_status}</td>
-                    <td>{fee_rate}</td>
-                </tr>
-"""
+                outcomes[recipient] = {'status': 'sent', 'attempts': attempt, 'error': None}
         
-        html += """            </tbody>
-        </table>
-"""
+        if retry and attempt <= int(settings['retries']):
+            delay = min(float(settings['backoff_seconds']) * 2 ** (attempt - 1), float(settings['max_backoff_seconds']))
+            print(f"⚠️  {len(retry)} 个收件人发送失败（{next(iter(retry.values()))}），{delay:.1f}秒后第 {attempt} 次重试")
+            time.sleep(delay)
+        else:
+            for recipient, error_text in retry.items():
+                outcomes[recipient] = {'status': 'failed', 'attempts': attempt, 'error': error_text}
+            retry = {}
+        pending = list(retry)
+    return outcomes
+
+def deliver_email(smtp_config, recipients, subject, html_content, text_content=None, settings=None):
+    """将收件人分批，通过连接池并行发送，返回每个收件人的投递结果（按收件人顺序）"""
+    settings = dict(_delivery_settings, **(settings or {}))
+    sender = smtp_config['username']
+    recipients = list(dict.fromkeys(recipients))
+    batch_size = max(1, int(settings['batch_size']))
+    batches = [recipients[i:i + batch_size] for i in range(0, len(recipients), batch_size)]
+    pool = get_smtp_pool(smtp_config, settings)
+    # 收件人不写入邮件头，所有批次共用同一份邮件内容
+    message = build_email_message(sender, subject, html_content, text_content)
+    
+    outcomes = {}
+    work = queue.Queue()
+    for index, batch in enumerate(batches):
+        work.put((index, batch))
+    parent_span = _metrics.current()
+    
+    def worker():
+        while True:
+            try:
+                index, batch = work.get_nowait()
+            except queue.Empty:
+                return
+            with metric_span('smtp.batch', parent=parent_span, batch=index, recipients=len(batch)) as span:
+                try:
+                    result = deliver_batch(pool, sender, batch, message, settings)
+                except Exception as e:
+                    result = {recipient: {'status': 'failed', 'attempts': 0, 'error': f"{type(e).__name__}: {e}"} for recipient in batch}
+                failed = sum(outcome['status'] != 'sent' for outcome in result.values())
+                span.set(status='ok' if not failed else 'failed', failed=failed,
+                         attempts=max((outcome['attempts'] for outcome in result.values()), default=0))
+            for recipient, outcome in result.items():
+                outcomes[recipient] = dict(outcome, batch=index)
     
-    html += """        
-        <div class="footer">
-            <p><strong>📝 说明</strong></p>
-            <p>• 溢价率 = (场内价格 - 场外价格) / 场外价格 × 100%</p>
-            <p>• 溢价率为正表示溢价，为负表示折价</p>
-            <p>• 🔺 表示溢价，🔻 表示折价</p>
-            <p>• 数据仅供参考，投资有风险，入市需谨慎</p>
-        </div>
-    </div>
-</body>
-</html>"""
-    
-    return html
-
-def send_email(config, html_content, subject):
-    """发送邮件"""
+    # 同时发送的批次数不超过连接池大小
+    threads = [threading.Thread(target=worker, name=f'smtp-{i}', daemon=True) for i in range(min(pool.size, len(batches)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    results = [dict(outcomes[recipient], recipient=recipient) for recipient in recipients]
+    record_delivery(subject, results, settings.get('log'))
+    return results
+
+# 多个线程可能同时追加投递日志
+_delivery_log_lock = threading.Lock()
+
+def record_delivery(subject, results, log_path=None):
+    """将每个收件人的投递结果追加到投递日志（JSON Lines）"""
+    if not log_path:
+        return
+    log_path = str(log_path)
+    if not os.path.isabs(log_path):
+        log_path = os.path.join(get_cache_dir(), log_path)
+    timestamp = datetime.now(BEIJING_TZ).isoformat(timespec='seconds')
+    try:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        lines = ''.join(json.dumps(dict(result, time=timestamp, subject=subject), ensure_ascii=False) + '\n' for result in results)
+        with _delivery_log_lock, open(log_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+    except OSError as e:
+        print(f"写入投递日志失败: {e}")
+
+def send_email(config, html_content, subject, text_content=None, recipients=None):
+    """发送邮件（可附带纯文本版本，供不显示HTML的邮件客户端使用）
+    
+    recipients 为空时发送给配置中的 email.recipients
+    """
+    # 回放录制的会话只用于复现和调优，不向收件人发送邮件
+    if isinstance(_data_provider, ReplayProvider):
+        print(f"📼 回放模式不发送邮件: {subject}（HTML {len(html_content)} 字符）")
+        return False
     try:
         smtp_config = config.get('email', {}).get('smtp', {})
-        recipients = config.get('email', {}).get('recipients', [])
+        if recipients is None:
+            recipients = config.get('email', {}).get('recipients', [])
         
         # 调试信息：打印原始 recipients
         print(f"📧 调试信息: 原始收件人列表: {recipients}")
@@ -963,31 +2933,21 @@ def send_email(config, html_content, subject):
             print(f"❌ 错误: SMTP 配置缺少必需字段: {', '.join(missing_fields)}")
             return False
         
-        # 创建邮件
-        msg = MIMEMultipart('alternative')
-        msg['From'] = smtp_config['username']
-        msg['To'] = ', '.join(recipients)
-        msg['Subject'] = Header(subject, 'utf-8')
-        
-        # 添加HTML内容
-        html_part = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(html_part)
-        
-        # 连接SMTP服务器并发送
-        if smtp_config.get('use_tls', True):
-            server = smtplib.SMTP(smtp_config['host'], smtp_config['port'])
-            server.starttls()
-        else:
-            server = smtplib.SMTP_SSL(smtp_config['host'], smtp_config['port'])
-        
-        server.login(smtp_config['username'], smtp_config['password'])
-        server.sendmail(smtp_config['username'], recipients, msg.as_string())
-        server.quit()
-        
-        print(f"✅ 邮件已成功发送到 {len(recipients)} 个收件人")
-        for recipient in recipients:
-            print(f"   - {recipient}")
-        return True
+        # 分批并行发送，临时错误自动重试
+        # 配置中的 delivery 部分（批量运行时为各作业自己的设置）覆盖全局设置
+        settings = {k: v for k, v in (config.get('delivery') or {}).items() if k == 'log' or v is not None}
+        results = deliver_email(smtp_config, recipients, subject, html_content, text_content, settings=settings)
+        sent = [result['recipient'] for result in results if result['status'] == 'sent']
+        failed = [result for result in results if result['status'] != 'sent']
+        if sent:
+            print(f"✅ 邮件已成功发送到 {len(sent)} 个收件人")
+            for recipient in sent:
+                print(f"   - {recipient}")
+        if failed:
+            print(f"❌ {len(failed)} 个收件人发送失败")
+            for result in failed:
+                print(f"   - {result['recipient']}: {result['error']}（尝试 {result['attempts']} 次）")
+        return not failed
         
     except Exception as e:
         print(f"❌ 发送邮件失败: {e}")
@@ -995,54 +2955,1019 @@ def send_email(config, html_content, subject):
         traceback.print_exc()
         return False
 
-def main():
-    """主函数"""
+def configure_runtime(config, provider=None, session=None):
+    """根据配置更新缓存、数据获取、限速、容错和数据提供者等设置"""
+    configure_cache(config)
+    configure_fetch(config)
+    configure_rate_limit(config)
+    configure_failover(config)
+    configure_alerts(config)
+    configure_history(config)
+    configure_metrics(config)
+    configure_delivery(config)
+    configure_export(config)
+    configure_provider(config, backend=provider, session=session)
+
+def send_report(config, df):
+    """根据计算结果生成各报告方案的报告并发送邮件"""
+    sent = send_profile_reports(config, ReportRenderCache(df))
+    
+    # 以本次报告的数据作为之后变动提醒的对比基准
+    save_premium_snapshot(build_premium_snapshot(df))
+    return sent
+
+def send_profile_reports(config, cache, step_summary=True):
+    """按报告方案渲染并发送（HTML、纯文本和Markdown共用同一份计算结果），全部发送成功时返回True"""
+    all_sent = True
+    for index, profile in enumerate(report_profiles(config)):
+        params = profile['params']
+        print(f"\n正在生成邮件内容（{profile['name']}: Top {params['top_n']}）...")
+        with metric_span('render', profile=profile['name']) as span:
+            reports = cache.render_all(params)
+            span.set(bytes=sum(len(content.encode('utf-8')) for content in (reports or {}).values()))
+        if reports is None:
+            print(f"⚠️  报告方案 {profile['name']} 没有符合条件的基金，跳过发送")
+            continue
+        # 只有第一个方案写入运行摘要
+        sent = deliver_report(config, reports, profile=profile, step_summary=step_summary and index == 0)
+        all_sent = all_sent and sent
+    return all_sent
+
+def deliver_report(config, reports, profile=None, step_summary=True):
+    """发送已渲染的报告（{格式: 内容}）给报告方案的收件人，并写入 GitHub Actions 运行摘要"""
+    # 在 GitHub Actions 中运行时，将Markdown摘要写入运行摘要页面
+    step_summary = os.getenv('GITHUB_STEP_SUMMARY') if step_summary else None
+    if step_summary:
+        try:
+            with open(step_summary, 'a', encoding='utf-8') as f:
+                f.write(reports['markdown'])
+        except OSError as e:
+            print(f"写入运行摘要失败: {e}")
+    
+    # 生成邮件主题（使用东八区时间）
+    profile = profile or report_profiles(config)[0]
+    date_str = datetime.now(BEIJING_TZ).strftime("%Y-%m-%d")
+    subject = str(profile['subject']).format(date=date_str, profile=profile['name'])
+    
+    # 发送邮件
+    print("\n正在发送邮件...")
+    with metric_span('smtp', profile=profile['name']) as span:
+        sent = send_email(config, reports['html'], subject, text_content=reports['text'], recipients=profile['recipients'])
+        span.set(status='ok' if sent else 'failed')
+    return sent
+
+def push_alerts(config, df, previous=None):
+    """对比上一次的溢价率快照，只推送发生变化的基金，返回本次快照
+    
+    previous 为空时从缓存目录读取上一次保存的快照
+    """
+    with metric_span('alerts', rows_in=len(df)) as span:
+        current = build_premium_snapshot(df)
+        if previous is None:
+            previous = load_premium_snapshot()
+        alerts = diff_premium_snapshots(previous, current)
+        save_premium_snapshot(current)
+        span.set(rows_out=len(alerts))
+    
+    if previous is None:
+        print("首次运行，已保存溢价率快照作为之后对比的基准")
+        return current
+    if alerts.empty:
+        print("与上一次快照相比没有需要提醒的变动")
+        return current
+    
+    print(f"🔔 发现 {len(alerts)} 条变动: " + ', '.join(f"{event} {count} 条" for event, count in alerts['变动'].value_counts(sort=False).items()))
+    recipients = alert_recipients(config)
+    if not recipients:
+        print("⚠️  没有配置 email.recipients 或报告方案收件人，跳过变动提醒")
+        return current
+    reports = generate_alert_reports(alerts)
+    time_str = datetime.now(BEIJING_TZ).strftime("%Y-%m-%d %H:%M")
+    subject = str(_alert_settings['subject']).format(time=time_str, date=time_str[:10])
+    with metric_span('smtp') as span:
+        sent = send_email(config, reports['html'], subject, text_content=reports['text'], recipients=recipients)
+        span.set(status='ok' if sent else 'failed')
+    return current
+
+# 报告缓存：fetch 子命令保存计算结果和各报告方案格式化好的报告数据，render/send 子命令直接读取，
+# 报告方案的视图参数不变时不需要导入 pandas
+REPORT_CACHE_DIR = 'report'
+REPORT_DATA_FILE = 'report.json'
+
+def report_cache_dir():
+    """报告缓存目录"""
+    return os.path.join(get_cache_dir(), REPORT_CACHE_DIR)
+
+def _report_cache_file(name):
+    if name == REPORT_DATA_FILE:
+        return os.path.join(report_cache_dir(), name)
+    return os.path.join(report_cache_dir(), f"{name}.{_cache_settings['snapshot_format']}")
+
+def save_report_cache(config, df):
+    """保存计算结果、各报告方案格式化好的报告数据，以及发送后用作变动提醒基准的溢价率快照"""
+    cache = ReportRenderCache(df)
+    with metric_span('render', rows_in=len(df)) as span:
+        reports = {}
+        for profile in report_profiles(config):
+            reports[report_params_key(profile['params'])] = {'params': profile['params'], 'report': cache.report(profile['params'])}
+        _write_cached_table(_report_cache_file('result'), df)
+        _write_cached_table(_report_cache_file('premium_snapshot'), build_premium_snapshot(df).reset_index())
+        path = _report_cache_file(REPORT_DATA_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'reports': list(reports.values())}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        span.set(bytes=os.path.getsize(path))
+    print(f"✅ 已保存报告缓存（{len(reports)} 个视图）: {report_cache_dir()}")
+    return cache
+
+def load_report_cache():
+    """读取缓存的报告数据，返回 ReportRenderCache，没有缓存时返回None
+    
+    缓存中有的视图直接使用格式化好的数据，其他视图从缓存的计算结果重新生成
+    """
+    path = _report_cache_file(REPORT_DATA_FILE)
     try:
-        # 加载配置
-        config = load_config()
-        if config is None:
+        with open(path, encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ 没有可用的报告缓存（{e}），请先运行 fetch 子命令")
+        return None
+    
+    def load_frame():
+        df = _read_cached_table(_report_cache_file('result'))
+        if df is None:
+            print("❌ 缓存的计算结果不存在，请重新运行 fetch 子命令")
+        return df
+    
+    reports = {report_params_key(item['params']): item['report'] for item in cached.get('reports', [])}
+    return ReportRenderCache(reports=reports, load_frame=load_frame)
+
+def promote_report_snapshot():
+    """缓存的报告发送后，将其溢价率快照作为之后变动提醒的对比基准（直接重命名文件）"""
+    pending = _report_cache_file('premium_snapshot')
+    if os.path.exists(pending):
+        os.replace(pending, premium_snapshot_path())
+
+# 常驻模式配置（可在 config.yaml 的 daemon 部分覆盖），时间均为北京时间
+DEFAULT_DAEMON_SETTINGS = {
+    'refresh_minutes': 5,  # 交易时段内刷新行情的间隔（分钟）
+    'report_times': ['10:00', '14:00'],  # 交易日发送报告的时间
+    'trading_sessions': ['09:30-11:30', '13:00-15:00'],  # 交易时段
+}
+
+def _parse_clock(text):
+    """解析 HH:MM 格式的时间"""
+    hour, minute = str(text).strip().split(':')
+    return dt_time(int(hour), int(minute))
+
+def is_trading_time(now, sessions):
+    """是否处于交易时段（只排除周末）"""
+    if now.weekday() >= 5:
+        return False
+    current = now.time().replace(tzinfo=None)
+    return any(start <= current <= end for start, end in sessions)
+
+def reset_daily_tables():
+    """丢弃按交易日更新的数据（净值库、基金基本信息），下次使用时重新加载"""
+    global _nav_store, _fund_metadata
+    _nav_store = None
+    _fund_metadata = None
+
+def run_daemon(config):
+    """常驻运行：交易时段内定时刷新行情并重新计算，按计划发送报告
+    
+    净值库和基金基本信息在同一交易日内只加载一次，每次刷新只需重新获取实时行情
+    """
+    settings = dict(DEFAULT_DAEMON_SETTINGS, **(config.get('daemon') or {}))
+    refresh_seconds = float(settings['refresh_minutes']) * 60
+    report_times = sorted(_parse_clock(t) for t in settings['report_times'])
+    sessions = [tuple(_parse_clock(part) for part in session.split('-')) for session in settings['trading_sessions']]
+    
+    print("=" * 60)
+    print(f"常驻模式已启动：交易时段内每 {settings['refresh_minutes']} 分钟刷新行情，"
+          f"报告发送时间 {', '.join(t.strftime('%H:%M') for t in report_times)}")
+    print("=" * 60)
+    
+    df = None
+    snapshot = None
+    export = None
+    last_refresh = None
+    now = datetime.now(BEIJING_TZ)
+    nav_day = nav_snapshot_date(now)
+    # 启动前已经过去的报告时间不再补发
+    sent = {(now.date(), t) for t in report_times if now.time().replace(tzinfo=None) >= t}
+    
+    while True:
+        try:
+            now = datetime.now(BEIJING_TZ)
+            
+            # 交易日切换：重新加载净值库和基金基本信息
+            if nav_snapshot_date(now) != nav_day:
+                print(f"📅 交易日切换（{nav_day} → {nav_snapshot_date(now)}），重新加载净值数据")
+                reset_daily_tables()
+                nav_day = nav_snapshot_date(now)
+                df = None
+            
+            clock = now.time().replace(tzinfo=None)
+            due_reports = [
+                t for t in report_times
+                if now.weekday() < 5 and clock >= t and (now.date(), t) not in sent
+            ]
+            stale = last_refresh is None or time.monotonic() - last_refresh >= refresh_seconds
+            
+            # 交易时段内定时刷新；发送报告前确保数据不过期
+            worked = False
+            if stale and (is_trading_time(now, sessions) or due_reports):
+                worked = True
+                with metric_span('get_etf_data') as span:
+                    refreshed = get_etf_data()
+                    span.set(rows_out=0 if refreshed is None else len(refreshed))
+                if refreshed is not None and not refreshed.empty:
+                    df = refreshed
+                    last_refresh = time.monotonic()
+                    print(f"🔄 {now.strftime('%H:%M:%S')} 已刷新 {len(df)} 条基金数据")
+                    record_history(df)
+                    export = start_export(df)
+                    # 每次刷新只推送变动，完整报告按计划时间发送
+                    if _alert_settings['enabled']:
+                        snapshot = push_alerts(config, df, snapshot)
+            
+            if due_reports and df is not None:
+                worked = True
+                send_report(config, df)
+                sent.update((now.date(), t) for t in due_reports)
+            wait_export(export)
+            export = None
+            
+            # 每个刷新周期导出一次运行指标，并保持SMTP连接
+            if worked:
+                export_metrics(success=df is not None)
+                keepalive_smtp_pools()
+            
+            # 等待下一次检查
+            time.sleep(min(30.0, refresh_seconds))
+        except KeyboardInterrupt:
+            print("\n常驻模式已退出")
             return
-        
-        print("=" * 60)
-        print("开始获取ETF/LOF溢价率数据...")
-        print("=" * 60)
-        
-        # 获取数据
-        df = get_etf_data()
-        
+        except Exception as e:
+            print(f"❌ 常驻模式运行出错: {e}")
+            import traceback
+            traceback.print_exc()
+            time.sleep(min(60.0, refresh_seconds))
+
+# HTTP服务配置（可在 config.yaml 的 server 部分覆盖），交易时段使用 daemon 部分的设置
+DEFAULT_SERVER_SETTINGS = {
+    'host': '127.0.0.1',
+    'port': 8080,
+    'refresh_minutes': 5,  # 交易时段内刷新数据的间隔（分钟）
+    'idle_refresh_minutes': 60,  # 非交易时段刷新数据的间隔（分钟），用于获取晚间公布的净值
+    'default_limit': 20,  # 未指定数量时返回的条数
+    'max_limit': 1000,  # 单次请求最多返回的条数
+    'gzip_min_bytes': 1024,  # 响应超过该大小且客户端支持时使用gzip压缩
+    'keepalive_seconds': 15,  # 长连接的空闲超时（秒）
+}
+
+# 查询参数 -> 筛选的列（同时支持英文和中文参数名，多个取值用逗号分隔）
+SERVER_FILTERS = {
+    'type': '基金类型',
+    '基金类型': '基金类型',
+    'purchase_status': '申购状态',
+    '申购状态': '申购状态',
+    'redeem_status': '赎回状态',
+    '赎回状态': '赎回状态',
+}
+
+class PremiumSnapshot:
+    """一次计算结果的只读快照：按溢价率从高到低排列的记录和按代码的索引
+    
+    快照创建后不再修改，刷新时整体替换，正在处理的请求继续使用原来的快照
+    """
+    
+    def __init__(self, df, when=None):
+        when = when or datetime.now(BEIJING_TZ)
+        frame = _iso_time_columns(build_export_frame(df, when))
+        self.records = json.loads(frame.to_json(orient='records', force_ascii=False))
+        self.by_code = {str(record['代码']): record for record in self.records}
+        self.updated_at = when.isoformat(timespec='seconds')
+        # 快照版本：用于生成ETag（同一秒内的两次刷新也不会重复）
+        self.version = f"{time.time_ns():x}"
+    
+    def select(self, filters, min_premium=None, max_premium=None):
+        """按列取值和溢价率区间筛选，保持溢价率从高到低的顺序"""
+        records = self.records
+        for column, values in filters.items():
+            records = [record for record in records if record.get(column) in values]
+        if min_premium is not None:
+            records = [record for record in records if record['溢价率'] >= min_premium]
+        if max_premium is not None:
+            records = [record for record in records if record['溢价率'] <= max_premium]
+        return records
+
+class HTTPError(Exception):
+    """返回给客户端的错误响应"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _query_int(params, name, default, maximum=None):
+    value = params.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise HTTPError(400, f"参数 {name} 应为整数: {value}") from None
+    if value < 0:
+        raise HTTPError(400, f"参数 {name} 不能为负数: {value}")
+    return min(value, maximum) if maximum is not None else value
+
+def _query_float(params, name):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise HTTPError(400, f"参数 {name} 应为数字: {value}") from None
+
+def query_snapshot(snapshot, path, params, settings=None):
+    """处理一次查询，返回响应数据（dict），参数错误或找不到时抛出 HTTPError
+    
+    GET /top、/bottom    溢价率最高/最低的 n 条（n 默认 default_limit）
+    GET /funds           按条件筛选（limit、offset、order=asc/desc）
+    GET /funds/{代码}    单只基金
+    筛选参数：type/基金类型、purchase_status/申购状态、redeem_status/赎回状态、min_premium、max_premium
+    """
+    settings = dict(DEFAULT_SERVER_SETTINGS, **(settings or {}))
+    default_limit, max_limit = int(settings['default_limit']), int(settings['max_limit'])
+    if path.startswith('/funds/'):
+        code = path[len('/funds/'):]
+        record = snapshot.by_code.get(code)
+        if record is None:
+            raise HTTPError(404, f"没有找到基金: {code}")
+        return {'updated_at': snapshot.updated_at, 'item': record}
+    if path not in ('/top', '/bottom', '/funds'):
+        raise HTTPError(404, f"未知的路径: {path}")
+    
+    filters = {}
+    for name, column in SERVER_FILTERS.items():
+        if params.get(name):
+            values = {value.strip() for value in params[name].split(',') if value.strip()}
+            filters[column] = filters[column] & values if column in filters else values
+    records = snapshot.select(filters, _query_float(params, 'min_premium'), _query_float(params, 'max_premium'))
+    
+    if path == '/funds':
+        limit = _query_int(params, 'limit', default_limit, max_limit)
+        offset = _query_int(params, 'offset', 0)
+        order = params.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            raise HTTPError(400, f"参数 order 只支持 asc 或 desc: {order}")
+        ordered = records if order == 'desc' else records[::-1]
+        items = ordered[offset:offset + limit]
+    else:
+        n = _query_int(params, 'n', default_limit, max_limit)
+        items = records[:n] if path == '/top' else records[::-1][:n]
+    return {'updated_at': snapshot.updated_at, 'total': len(records), 'count': len(items), 'items': items}
+
+def _accepts_gzip(accept_encoding):
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '').lower() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+HTTP_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+class PremiumServer:
+    """异步HTTP服务：在内存中保存最新的计算结果快照，后台定时刷新
+    
+    刷新在线程池中完成，完成后替换快照引用，读取方不会被阻塞；
+    响应按快照版本和查询缓存（包括gzip压缩后的内容），并支持 ETag / If-None-Match
+    """
+    
+    RESPONSE_CACHE_SIZE = 256
+    
+    def __init__(self, settings, sessions):
+        self.settings = settings
+        self.sessions = sessions
+        self.snapshot = None
+        self._responses = OrderedDict()
+        self._nav_day = None
+    
+    def swap(self, snapshot):
+        """替换快照（只在事件循环线程中调用），旧快照的缓存响应随之丢弃"""
+        self.snapshot = snapshot
+        self._responses.clear()
+    
+    def _refresh(self):
+        """获取并计算一次数据（在线程池中运行），返回新快照，未获取到数据时返回None"""
+        now = datetime.now(BEIJING_TZ)
+        if self._nav_day is not None and nav_snapshot_date(now) != self._nav_day:
+            print(f"📅 交易日切换（{self._nav_day} → {nav_snapshot_date(now)}），重新加载净值数据")
+            reset_daily_tables()
+        self._nav_day = nav_snapshot_date(now)
+        with metric_span('get_etf_data') as span:
+            df = get_etf_data()
+            span.set(rows_out=0 if df is None else len(df))
         if df is None or df.empty:
-            print("❌ 未能获取到ETF数据，请检查网络连接或稍后重试")
-            return
-        
-        print(f"✅ 成功获取 {len(df)} 条基金数据（包含ETF和LOF）")
+            export_metrics(success=False)
+            return None
+        record_history(df)
+        export = start_export(df)
+        with metric_span('snapshot', rows_in=len(df)):
+            snapshot = PremiumSnapshot(df, now)
+        wait_export(export)
+        export_metrics(success=True)
+        return snapshot
+    
+    async def refresh_forever(self):
+        """启动时立即刷新，之后交易时段内每 refresh_minutes 分钟、其他时间每 idle_refresh_minutes 分钟刷新一次"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                snapshot = await loop.run_in_executor(None, self._refresh)
+                if snapshot is not None:
+                    self.swap(snapshot)
+                    print(f"🔄 {snapshot.updated_at} 已更新快照：{len(snapshot.records)} 条基金数据")
+            except Exception as e:
+                print(f"❌ 刷新数据出错: {e}")
+                import traceback
+                traceback.print_exc()
+            trading = is_trading_time(datetime.now(BEIJING_TZ), self.sessions)
+            minutes = self.settings['refresh_minutes'] if trading else self.settings['idle_refresh_minutes']
+            await asyncio.sleep(float(minutes) * 60)
+    
+    async def respond(self, method, target, headers):
+        """处理一个请求，返回 (状态码, 响应头, 响应体)"""
+        # 整个请求只读取一次快照引用，刷新替换快照不会影响正在处理的请求
+        snapshot = self.snapshot
+        if method not in ('GET', 'HEAD'):
+            return self._error(405, f"不支持的请求方法: {method}", {'Allow': 'GET, HEAD'})
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip('/') or '/'
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
         
-        # 从配置中获取参数
-        top_n = config.get('report', {}).get('top_n', 100)
-        only_premium = config.get('report', {}).get('only_premium', False)
+        if path == '/health':
+            payload = {'status': 'ok' if snapshot is not None else 'starting',
+                       'updated_at': snapshot.updated_at if snapshot else None,
+                       'count': len(snapshot.records) if snapshot else 0}
+            return self._json(200 if snapshot is not None else 503, payload, {})
+        if snapshot is None:
+            return self._error(503, '数据尚未就绪，请稍后重试', {'Retry-After': '5'})
         
-        # 生成HTML邮件内容
-        print(f"\n正在生成邮件内容（Top {top_n}）...")
-        html_content = generate_email_html(df, top_n=top_n, only_premium=only_premium)
+        # 同一快照、同一查询的响应内容相同：ETag 由快照版本和规范化的查询生成，不需要先生成响应
+        query = '&'.join(f"{name}={params[name]}" for name in sorted(params))
+        key = (snapshot.version, path, query)
+        etag = f'W/"{snapshot.version}-{zlib.crc32(f"{path}?{query}".encode("utf-8")):08x}"'
+        if_none_match = headers.get('if-none-match', '')
+        if if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(',')):
+            return 304, {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}, b''
         
-        # 生成邮件主题（使用东八区时间）
-        beijing_tz = timezone(timedelta(hours=8))
-        date_str = datetime.now(beijing_tz).strftime("%Y-%m-%d")
-        subject_template = config.get('email', {}).get('subject', '📊 ETF/LOF溢价率排行榜 - {date}')
-        subject = subject_template.format(date=date_str)
+        cached = self._responses.get(key)
+        if cached is None:
+            try:
+                payload = query_snapshot(snapshot, path, params, self.settings)
+            except HTTPError as e:
+                return self._error(e.status, str(e), {})
+            cached = {'body': json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'gzip': None}
+            self._responses[key] = cached
+            if len(self._responses) > self.RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        else:
+            self._responses.move_to_end(key)
         
-        # 发送邮件
-        print("\n正在发送邮件...")
-        send_email(config, html_content, subject)
+        extra = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        body = cached['body']
+        if len(body) >= int(self.settings['gzip_min_bytes']) and _accepts_gzip(headers.get('accept-encoding', '')):
+            if cached['gzip'] is None:
+                # 较大的响应在线程池中压缩，不阻塞其他请求
+                compress = functools.partial(gzip.compress, body, compresslevel=6, mtime=0)
+                cached['gzip'] = compress() if len(body) < 256 * 1024 else await asyncio.get_running_loop().run_in_executor(None, compress)
+            body = cached['gzip']
+            extra['Content-Encoding'] = 'gzip'
+        return 200, dict(extra, **{'Content-Type': 'application/json; charset=utf-8'}), body
+    
+    @staticmethod
+    def _json(status, payload, extra):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return status, dict(extra, **{'Content-Type': 'application/json; charset=utf-8'}), body
+    
+    def _error(self, status, message, extra):
+        return self._json(status, {'error': message}, extra)
+    
+    async def handle(self, reader, writer):
+        """处理一个连接（HTTP/1.1 长连接，依次处理多个请求）"""
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), timeout=float(self.settings['keepalive_seconds']))
+                except asyncio.TimeoutError:
+                    break
+                if not line.strip():
+                    break
+                method, target, version = line.decode('latin-1').strip().split(' ', 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                status, extra, body = await self.respond(method, target, headers)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                head = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+                head.extend(f"{name}: {value}" for name, value in extra.items())
+                head.append(f"Content-Length: {len(body)}")
+                head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + (body if method != 'HEAD' else b''))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+    
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"🌐 HTTP服务已启动: http://{host}:{port}（/top、/bottom、/funds、/funds/{{代码}}、/health）")
+        refresher = asyncio.ensure_future(self.refresh_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+
+def run_server(config, host=None, port=None):
+    """HTTP服务模式：后台定时刷新数据，通过HTTP查询最新的溢价率排行"""
+    settings = dict(DEFAULT_SERVER_SETTINGS, **{k: v for k, v in (config.get('server') or {}).items() if v is not None})
+    daemon_settings = dict(DEFAULT_DAEMON_SETTINGS, **(config.get('daemon') or {}))
+    sessions = [tuple(_parse_clock(part) for part in session.split('-')) for session in daemon_settings['trading_sessions']]
+    server = PremiumServer(settings, sessions)
+    try:
+        asyncio.run(server.serve(host or settings['host'], int(port or settings['port'])))
+    except KeyboardInterrupt:
+        print("\nHTTP服务已退出")
+
+def show_history(codes, window_days=None):
+    """打印基金溢价率历史的滚动统计"""
+    window_days = int(window_days or _history_settings['window_days'])
+    store = get_history_store()
+    summary = store.summary(codes=codes, window_days=window_days)
+    if summary.empty:
+        print(f"没有找到这些基金最近 {window_days} 天的溢价率历史: {', '.join(codes)}")
+        return summary
+    print(f"最近 {window_days} 天溢价率统计（%）:")
+    print(summary.round(2).to_string())
+    for code in codes:
+        stats = store.rolling_stats(code, window_days=window_days)
+        if not stats.empty:
+            print(f"\n{code} 滚动统计（最近 10 条）:")
+            print(stats.tail(10).round(2).to_string())
+    return summary
+
+# 配置文件中各部分允许的字段（用于检查拼写错误）
+CONFIG_SECTIONS = {
+    'email': {'smtp', 'recipients', 'subject'},
+    'report': {'profiles'} | set(REPORT_PROFILE_FIELDS),
+    'cache': set(DEFAULT_CACHE_SETTINGS),
+    'fetch': {'timeouts'},
+    'rate_limit': {'default', 'hosts'},
+    'failover': set(DEFAULT_FAILOVER_SETTINGS),
+    'daemon': set(DEFAULT_DAEMON_SETTINGS),
+    'alerts': set(DEFAULT_ALERT_SETTINGS),
+    'history': set(DEFAULT_HISTORY_SETTINGS),
+    'provider': set(DEFAULT_PROVIDER_SETTINGS),
+    'metrics': set(DEFAULT_METRICS_SETTINGS),
+    'delivery': set(DEFAULT_DELIVERY_SETTINGS),
+    'export': set(DEFAULT_EXPORT_SETTINGS),
+    'server': set(DEFAULT_SERVER_SETTINGS),
+}
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validate_config(config):
+    """检查配置（不导入 pandas 等依赖），返回 (错误列表, 警告列表)"""
+    errors, warnings = [], []
+    for section, value in config.items():
+        if section not in CONFIG_SECTIONS:
+            warnings.append(f"未知的配置项: {section}")
+        elif value is not None and not isinstance(value, dict):
+            errors.append(f"{section} 应为字典")
+        else:
+            unknown = sorted(set(value or {}) - CONFIG_SECTIONS[section])
+            if unknown:
+                warnings.append(f"{section} 中有未知字段: {', '.join(map(str, unknown))}")
+    section = lambda name: config.get(name) if isinstance(config.get(name), dict) else {}
+    
+    email_config = section('email')
+    smtp_config = email_config.get('smtp') if isinstance(email_config.get('smtp'), dict) else {}
+    for key in ('host', 'port', 'username', 'password'):
+        if not smtp_config.get(key):
+            errors.append(f"缺少 email.smtp.{key}")
+    if smtp_config.get('port') and not isinstance(smtp_config['port'], int):
+        errors.append(f"email.smtp.port 应为整数: {smtp_config['port']}")
+    profiles = section('report').get('profiles') or {}
+    if not isinstance(profiles, dict):
+        errors.append("report.profiles 应为字典（方案名称: 方案配置）")
+        profiles = {}
+    if not email_config.get('recipients') and not profiles:
+        errors.append("email.recipients 为空")
+    
+    views = [('report', section('report'))]
+    for name, profile in profiles.items():
+        profile = profile if isinstance(profile, dict) else {}
+        unknown = sorted(set(profile) - set(REPORT_PROFILE_FIELDS) - {'recipients', 'subject'})
+        if unknown:
+            warnings.append(f"report.profiles.{name} 中有未知字段: {', '.join(map(str, unknown))}")
+        if not profile.get('recipients'):
+            errors.append(f"report.profiles.{name}.recipients 为空")
+        views.append((f"report.profiles.{name}", profile))
+    for prefix, view in views:
+        top_n = view.get('top_n')
+        if top_n is not None and not isinstance(top_n, int):
+            errors.append(f"{prefix}.top_n 应为整数: {top_n}")
+        for key in ('min_premium', 'max_premium'):
+            if view.get(key) is not None and not _is_number(view[key]):
+                errors.append(f"{prefix}.{key} 应为数字: {view[key]}")
+        invalid = sorted(set(_as_list(view.get('fund_types')) or []) - set(FUND_TYPES))
+        if invalid:
+            errors.append(f"{prefix}.fund_types 只支持 {'/'.join(FUND_TYPES)}: {', '.join(invalid)}")
+        # 无法解析的申购状态保留原文（例如 封闭期），因此其他取值只给出提示
+        unknown = sorted(set(_as_list(view.get('purchase_status')) or []) - set(PURCHASE_STATUS_ORDER))
+        if unknown:
+            warnings.append(f"{prefix}.purchase_status 中的 {', '.join(unknown)} 不是解析后的状态"
+                            f"（{'/'.join(PURCHASE_STATUS_ORDER)}），只匹配原文相同的基金")
+    if section('cache').get('snapshot_format', 'parquet') not in ('parquet', 'feather'):
+        errors.append(f"cache.snapshot_format 只支持 parquet 或 feather: {section('cache')['snapshot_format']}")
+    timeouts = section('fetch').get('timeouts') or {}
+    for name, timeout in (timeouts.items() if isinstance(timeouts, dict) else []):
+        if not _is_number(timeout) or timeout <= 0:
+            errors.append(f"fetch.timeouts.{name} 应为正数: {timeout}")
+    rate_config = section('rate_limit')
+    limits = [('default', rate_config.get('default'))] + [(f"hosts.{host}", limit) for host, limit in (rate_config.get('hosts') or {}).items()]
+    for name, limit in limits:
+        for key in ('rate', 'burst'):
+            value = (limit or {}).get(key)
+            if value is not None and (not _is_number(value) or value <= 0):
+                errors.append(f"rate_limit.{name}.{key} 应为正数: {value}")
+    
+    daemon_config = section('daemon')
+    try:
+        for text in daemon_config.get('report_times') or []:
+            _parse_clock(text)
+        for text in daemon_config.get('trading_sessions') or []:
+            start, end = str(text).split('-')
+            _parse_clock(start), _parse_clock(end)
+    except ValueError:
+        errors.append(f"daemon 中的时间格式应为 HH:MM 或 HH:MM-HH:MM: {text}")
+    for key in ('premium_threshold', 'discount_threshold', 'top_n'):
+        value = section('alerts').get(key)
+        if value is not None and not _is_number(value):
+            errors.append(f"alerts.{key} 应为数字: {value}")
+    for key in ('batch_size', 'max_connections'):
+        value = section('delivery').get(key)
+        if value is not None and (not isinstance(value, int) or value <= 0):
+            errors.append(f"delivery.{key} 应为正整数: {value}")
+    export_config = section('export')
+    formats = export_config.get('formats') or []
+    invalid = sorted(set(formats if isinstance(formats, list) else [formats]) - set(EXPORT_FORMATS))
+    if invalid:
+        errors.append(f"export.formats 只支持 {'/'.join(EXPORT_FORMATS)}: {', '.join(map(str, invalid))}")
+    compression = export_config.get('parquet_compression')
+    if compression is not None and str(compression).lower() not in ('', 'none', 'snappy', 'gzip', 'zstd', 'brotli', 'lz4'):
+        errors.append(f"export.parquet_compression 不支持: {compression}")
+    server_config = section('server')
+    port = server_config.get('port')
+    if port is not None and (not isinstance(port, int) or not 0 < port < 65536):
+        errors.append(f"server.port 应为 1-65535 之间的整数: {port}")
+    for key in ('refresh_minutes', 'idle_refresh_minutes', 'default_limit', 'max_limit', 'keepalive_seconds'):
+        value = server_config.get(key)
+        if value is not None and (not _is_number(value) or value <= 0):
+            errors.append(f"server.{key} 应为正数: {value}")
+    backend = section('provider').get('backend')
+    if backend is not None and backend not in ('akshare', 'record', 'replay'):
+        errors.append(f"provider.backend 只支持 akshare、record 或 replay: {backend}")
+    return errors, warnings
+
+def check_config(config):
+    """打印配置检查结果，配置有错误时返回False"""
+    errors, warnings = validate_config(config)
+    email_config = config.get('email') or {}
+    smtp_config = email_config.get('smtp') or {}
+    print(f"📧 SMTP: {smtp_config.get('host')}:{smtp_config.get('port')}（{smtp_config.get('username')}）")
+    if not errors:
+        for profile in report_profiles(config):
+            params = profile['params']
+            filters = ', '.join(f"{key}={params[key]}" for key in REPORT_PROFILE_FIELDS[2:] if params[key] is not None)
+            print(f"📊 报告方案 {profile['name']}: Top {params['top_n']}，只显示溢价: {params['only_premium']}"
+                  f"{'，筛选: ' + filters if filters else ''}，收件人 {len(profile['recipients'] or [])} 个")
+    print(f"📁 缓存目录: {get_cache_dir()}")
+    for message in warnings:
+        print(f"⚠️  {message}")
+    for message in errors:
+        print(f"❌ {message}")
+    if errors:
+        print(f"❌ 配置检查未通过：{len(errors)} 个错误")
+        return False
+    print("✅ 配置检查通过")
+    return True
+
+def fetch_and_record():
+    """获取溢价率数据并写入历史，未获取到数据时返回None"""
+    print("=" * 60)
+    print("开始获取ETF/LOF溢价率数据...")
+    print("=" * 60)
+    
+    with metric_span('get_etf_data') as span:
+        df = get_etf_data()
+        span.set(rows_out=0 if df is None else len(df))
+    
+    if df is None or df.empty:
+        print("❌ 未能获取到ETF数据，请检查网络连接或稍后重试")
+        return None
+    
+    print(f"✅ 成功获取 {len(df)} 条基金数据（包含ETF和LOF）")
+    record_history(df)
+    return df
+
+def command_run(config, args):
+    """run：获取数据并发送报告（或变动提醒）"""
+    df = fetch_and_record()
+    if df is None:
+        return False
+    export = start_export(df)
+    sent = True
+    if args.alerts:
+        push_alerts(config, df)
+    else:
+        sent = send_report(config, df)
+    wait_export(export)
+    return sent
+
+def command_fetch(config, args):
+    """fetch：获取数据并保存报告缓存，不发送邮件"""
+    df = fetch_and_record()
+    if df is None:
+        return False
+    export = start_export(df)
+    save_report_cache(config, df)
+    return wait_export(export)
+
+def command_render(config, args):
+    """render：用缓存的报告数据渲染报告，写入文件或标准输出"""
+    profiles = {profile['name']: profile for profile in report_profiles(config)}
+    name = args.profile or next(iter(profiles))
+    if name not in profiles:
+        print(f"❌ 没有名为 {name} 的报告方案（可用: {', '.join(profiles)}）")
+        return False
+    with contextlib.redirect_stdout(sys.stdout if args.output else sys.stderr):
+        cache = load_report_cache()
+        content = None if cache is None else cache.render(profiles[name]['params'], args.format)
+    if content is None:
+        return False
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(content)
+        print(f"✅ 已生成报告: {args.output}")
+    else:
+        sys.stdout.write(content)
+    return True
+
+def command_send(config, args):
+    """send：用缓存的报告数据渲染并发送各报告方案的邮件"""
+    cache = load_report_cache()
+    if cache is None:
+        return False
+    sent = send_profile_reports(config, cache)
+    if sent:
+        promote_report_snapshot()
+    return sent
+
+def find_job_configs(paths):
+    """展开批量运行的配置参数：文件直接使用，目录取其中的 *.yaml / *.yml（按文件名排序）"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(('.yaml', '.yml')))
+        else:
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+def load_job_configs(paths):
+    """读取批量运行的各作业配置（不读取环境变量），返回 [(作业名称, 配置)]
+    
+    读取失败的作业配置为None，运行时单独记为失败，不影响其他作业
+    """
+    jobs = []
+    names = set()
+    for path in find_job_configs(paths):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in names:
+            name = path
+        names.add(name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = yaml.safe_load(f) or {}
+            if not isinstance(config, dict):
+                raise ValueError('配置文件内容应为字典')
+        except Exception as e:
+            print(f"❌ 读取作业配置失败 {path}: {e}")
+            config = None
+        jobs.append((name, config))
+    return jobs
+
+def run_job(config, cache, step_summary=False):
+    """运行一个作业：检查配置，按它的报告方案渲染并发送"""
+    if config is None:
+        raise ValueError('配置文件读取失败')
+    errors, _ = validate_config(config)
+    if errors:
+        raise ValueError('; '.join(errors))
+    return send_profile_reports(config, cache, step_summary=step_summary)
+
+def run_batch(jobs, df, max_workers=4):
+    """用同一份计算结果并行运行多个作业的渲染和发送，单个作业出错不影响其他作业
+    
+    jobs: [(作业名称, 配置)]
+    返回 {作业名称: {'status': 'ok'/'failed'/'error', 'seconds': 耗时, 'error': 错误}}
+    """
+    cache = ReportRenderCache(df)
+    results = {}
+    work = queue.Queue()
+    for index, job in enumerate(jobs):
+        work.put((index, job))
+    parent_span = _metrics.current()
+    
+    def worker():
+        while True:
+            try:
+                index, (name, config) = work.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            with metric_span(f"job.{name}", parent=parent_span) as span:
+                try:
+                    # 只有第一个作业写入运行摘要
+                    sent = run_job(config, cache, step_summary=index == 0)
+                    result = {'status': 'ok' if sent else 'failed', 'error': None if sent else '有邮件发送失败'}
+                except Exception as e:
+                    result = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+                span.set(status=result['status'])
+            result['seconds'] = time.perf_counter() - start
+            results[name] = result
+    
+    threads = [threading.Thread(target=worker, name=f'job-{i}', daemon=True) for i in range(min(max(1, int(max_workers)), len(jobs)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"报告渲染: {cache.builds} 个视图，复用 {cache.hits} 次")
+    return {name: results[name] for name, _ in jobs}
+
+def command_batch(config, args):
+    """batch：只获取和计算一次数据，并行运行多个作业（配置文件）的渲染和发送"""
+    df = fetch_and_record()
+    if df is None:
+        return False
+    export = start_export(df)
+    print(f"\n开始运行 {len(args.jobs)} 个作业（最多同时 {args.workers} 个）...")
+    results = run_batch(args.jobs, df, max_workers=args.workers)
+    wait_export(export)
+    
+    # 所有作业共用同一份数据，以它作为之后变动提醒的对比基准
+    save_premium_snapshot(build_premium_snapshot(df))
+    
+    print("\n作业结果:")
+    icons = {'ok': '✅', 'failed': '⚠️ ', 'error': '❌'}
+    for name, result in results.items():
+        print(f"  {icons[result['status']]} {name}: {result['seconds']:.2f}s" + (f"（{result['error']}）" if result['error'] else ''))
+    failed = [name for name, result in results.items() if result['status'] != 'ok']
+    if failed:
+        print(f"❌ {len(failed)}/{len(results)} 个作业未完成: {', '.join(failed)}")
+    return not failed
+
+def build_parser():
+    """命令行参数：run（默认）、fetch、render、send、check-config、daemon、history"""
+    # 访问数据源的子命令共用的录制/回放参数
+    provider_parser = argparse.ArgumentParser(add_help=False)
+    provider = provider_parser.add_mutually_exclusive_group()
+    provider.add_argument('--record', metavar='会话', nargs='?', const='',
+                          help='调用真实接口并把每次返回的数据录制到会话目录（默认以当前时间命名）')
+    provider.add_argument('--replay', metavar='会话', nargs='?', const='',
+                          help='回放录制的会话（默认最新的会话），不访问网络')
+    
+    parser = argparse.ArgumentParser(description='ETF/LOF溢价率报告')
+    commands = parser.add_subparsers(dest='command', metavar='子命令')
+    run = commands.add_parser('run', parents=[provider_parser], help='获取数据并发送报告（默认）')
+    run.add_argument('--alerts', action='store_true',
+                     help='只推送与上一次快照相比的变动提醒，不发送完整报告')
+    commands.add_parser('fetch', parents=[provider_parser], help='获取数据并保存报告缓存，不发送邮件')
+    render = commands.add_parser('render', help='用缓存的报告数据渲染报告（不获取数据）')
+    render.add_argument('--format', choices=sorted(REPORT_TEMPLATES), default='html', help='输出格式')
+    render.add_argument('-o', '--output', help='输出文件，默认写到标准输出')
+    render.add_argument('--profile', help='报告方案名称，默认为第一个方案')
+    commands.add_parser('send', help='发送缓存的报告（不获取数据）')
+    commands.add_parser('check-config', help='检查配置文件')
+    batch = commands.add_parser('batch', parents=[provider_parser],
+                                help='批量运行多个配置文件：只获取一次数据，并行渲染和发送')
+    batch.add_argument('configs', metavar='配置', nargs='+', help='作业配置文件，或包含 *.yaml 配置文件的目录')
+    batch.add_argument('--workers', type=int, default=4, help='同时运行的作业数')
+    commands.add_parser('daemon', parents=[provider_parser],
+                        help='常驻运行：交易时段内定时刷新行情，按计划发送报告')
+    serve = commands.add_parser('serve', parents=[provider_parser],
+                                help='HTTP服务：在内存中保存最新数据并定时刷新，供看板和机器人查询')
+    serve.add_argument('--host', help='监听地址，默认使用配置中的 server.host')
+    serve.add_argument('--port', type=int, help='监听端口，默认使用配置中的 server.port')
+    history = commands.add_parser('history', help='查看基金溢价率历史的滚动统计')
+    history.add_argument('codes', metavar='代码', nargs='+')
+    history.add_argument('--window', type=int, default=None,
+                         help='滚动统计窗口（天），默认使用配置中的 history.window_days')
+    return parser
+
+# 各子命令的处理函数
+COMMANDS = {
+    'run': command_run,
+    'fetch': command_fetch,
+    'render': command_render,
+    'send': command_send,
+    'batch': command_batch,
+}
+
+# 旧版的参数形式：参数 -> 对应的子命令（例如 --history 510300 等同于 history 510300）
+LEGACY_COMMAND_FLAGS = {
+    '--daemon': 'daemon',
+    '--history': 'history',
+}
+
+def main(argv=None):
+    """主函数"""
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # 不指定子命令时等同于 run（兼容 python src/etf_premium_rate.py [--alerts] 的用法），
+    # --daemon、--history 改写为对应的子命令
+    if not argv or argv[0].startswith('-') and argv[0] not in ('-h', '--help'):
+        command = next((command for flag, command in LEGACY_COMMAND_FLAGS.items() if flag in argv), 'run')
+        argv = [command] + [arg for arg in argv if arg not in LEGACY_COMMAND_FLAGS]
+    args = build_parser().parse_args(argv)
+    
+    success = False
+    # 访问数据源或发送邮件的子命令导出指标，常驻模式每个周期单独导出
+    export = args.command in ('run', 'fetch', 'send', 'batch')
+    try:
+        # 加载配置（渲染到标准输出时，配置信息改为输出到标准错误）
+        quiet = args.command == 'render' and not args.output
+        with metric_span('config'), contextlib.redirect_stdout(sys.stderr if quiet else sys.stdout):
+            if args.command == 'batch':
+                # 批量运行：数据获取、缓存、限速等共享设置使用第一个可读取的作业配置
+                args.jobs = load_job_configs(args.configs)
+                config = next((job_config for _, job_config in args.jobs if job_config is not None), None)
+                if config is None:
+                    print("❌ 没有可用的作业配置")
+                    return 1
+            else:
+                config = load_config()
+            if config is None:
+                return 1
+            record, replay = getattr(args, 'record', None), getattr(args, 'replay', None)
+            if record is not None:
+                configure_runtime(config, provider='record', session=record)
+            elif replay is not None:
+                configure_runtime(config, provider='replay', session=replay)
+            else:
+                configure_runtime(config)
         
-        print("\n" + "=" * 60)
-        print("✅ 任务完成！")
-        print("=" * 60)
+        if args.command == 'check-config':
+            success = check_config(config)
+        elif args.command == 'daemon':
+            run_daemon(config)
+            success = True
+        elif args.command == 'serve':
+            run_server(config, host=args.host, port=args.port)
+            success = True
+        elif args.command == 'history':
+            show_history(args.codes, window_days=args.window)
+            success = True
+        else:
+            success = COMMANDS[args.command](config, args)
+            if success and args.command != 'render':
+                print("\n" + "=" * 60)
+                print("✅ 任务完成！")
+                print("=" * 60)
         
     except Exception as e:
         print(f"❌ 程序执行出错: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        close_smtp_pool()
+        if export:
+            export_metrics(success=success)
+    return 0 if success else 1
 
 if __name__ == '__main__':
-    main()
-
+    sys.exit(main())
@@ -0,0 +1,458 @@
+# -*- coding: UTF-8 -*-
+"""
+报告模板
+
+HTML邮件、纯文本和Markdown三种输出格式的模板。
+静态骨架（样式、页脚等）和行模板在导入时编译一次，渲染时只用预先格式化好的列数据填充，
+因此增加输出格式不会增加额外的数据处理。
+"""
+
+import html
+import string
+
+# 表格行的字段（顺序即编译后模板的位置参数顺序）
+ROW_FIELDS = (
+    'rank', 'name', 'code', 'fund_type', 'spot', 'nav', 'css_class',
+    'premium', 'volume', 'purchase_status', 'redeem_status', 'fee',
+)
+# 统计概览的字段
+SUMMARY_FIELDS = (
+    'timestamp', 'total_count', 'etf_count', 'lof_count', 'avg_premium',
+    'max_premium', 'min_premium', 'premium_count', 'discount_count',
+)
+# 需要按输出格式转义的文本字段
+ESCAPED_FIELDS = ('name', 'purchase_status', 'redeem_status', 'fee')
+# 变动提醒的行字段
+ALERT_FIELDS = ('event', 'name', 'code', 'before', 'after', 'premium', 'css_class')
+ALERT_ESCAPED_FIELDS = ('name', 'before', 'after')
+
+def compile_template(template, fields):
+    """将命名占位符编译为按位置填充的模板，返回绑定好的 format 方法"""
+    compiled = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        compiled.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field is not None:
+            placeholder = str(fields.index(field))
+            if conversion:
+                placeholder += f'!{conversion}'
+            if spec:
+                placeholder += f':{spec}'
+            compiled.append('{' + placeholder + '}')
+    return ''.join(compiled).format
+
+def zip_columns(columns, fields):
+    """按字段顺序逐行取出各列的值；各列长度不一致时报错，而不是静默丢弃多出的行
+    
+    相当于 zip(..., strict=True)，定时任务运行在 Python 3.9 上，因此先检查长度
+    """
+    values = [columns[field] for field in fields]
+    if len({len(column) for column in values}) > 1:
+        lengths = ', '.join(f"{field}={len(columns[field])}" for field in fields)
+        raise ValueError(f"报告数据各列长度不一致: {lengths}")
+    return zip(*values)  # 长度已在上面检查
+
+class ReportTemplate:
+    """一种输出格式的已编译模板"""
+    
+    def __init__(self, head, summary, section_open, row, section_close, footer, empty, escape=None):
+        self.head = head
+        self.summary = compile_template(summary, SUMMARY_FIELDS)
+        self.section_open = compile_template(section_open, ('title',))
+        self.row = compile_template(row, ROW_FIELDS)
+        self.section_close = section_close
+        self.footer = footer
+        self.empty = empty
+        self.escape = escape
+    
+    def render(self, report):
+        """用预先格式化好的报告数据填充模板
+        
+        report: {'summary': {字段: 文本}, 'sections': [{'title': 标题, 'columns': {字段: 列表}}]}
+        """
+        if report is None:
+            return self.empty
+        parts = [self.head, self.summary(*(report['summary'][field] for field in SUMMARY_FIELDS))]
+        for section in report['sections']:
+            columns = section['columns']
+            if self.escape is not None:
+                columns = dict(columns, **{field: [self.escape(value) for value in columns[field]] for field in ESCAPED_FIELDS})
+            parts.append(self.section_open(section['title']))
+            row = self.row
+            parts.extend(row(*values) for values in zip_columns(columns, ROW_FIELDS))
+            parts.append(self.section_close)
+        parts.append(self.footer)
+        return ''.join(parts)
+
+class AlertTemplate:
+    """变动提醒的已编译模板：只渲染发生变化的基金，不包含完整排行榜"""
+    
+    def __init__(self, head, summary, row, footer, escape=None):
+        self.head = head
+        self.summary = compile_template(summary, ('timestamp', 'count'))
+        self.row = compile_template(row, ALERT_FIELDS)
+        self.footer = footer
+        self.escape = escape
+    
+    def render(self, alerts):
+        """alerts: {'timestamp': 时间, 'count': 条数, 'columns': {字段: 列表}}"""
+        columns = alerts['columns']
+        if self.escape is not None:
+            columns = dict(columns, **{field: [self.escape(value) for value in columns[field]] for field in ALERT_ESCAPED_FIELDS})
+        parts = [self.head, self.summary(alerts['timestamp'], alerts['count'])]
+        row = self.row
+        parts.extend(row(*values) for values in zip_columns(columns, ALERT_FIELDS))
+        parts.append(self.footer)
+        return ''.join(parts)
+
+HTML_STYLE = """    <style>
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
+            line-height: 1.6;
+            color: #333;
+            max-width: 1200px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #f5f5f5;
+        }
+        .container {
+            background-color: #ffffff;
+            border-radius: 8px;
+            padding: 30px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        h1 {
+            color: #2c3e50;
+            text-align: center;
+            border-bottom: 3px solid #3498db;
+            padding-bottom: 10px;
+            margin-bottom: 30px;
+        }
+        .stats {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 20px;
+            border-radius: 8px;
+            margin: 20px 0;
+        }
+        .stats-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+            gap: 15px;
+            margin-top: 15px;
+        }
+        .stat-item {
+            background: rgba(255,255,255,0.2);
+            padding: 10px;
+            border-radius: 5px;
+            text-align: center;
+        }
+        .stat-label {
+            font-size: 12px;
+            opacity: 0.9;
+        }
+        .stat-value {
+            font-size: 24px;
+            font-weight: bold;
+            margin-top: 5px;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+            margin: 20px 0;
+            font-size: 14px;
+        }
+        th {
+            background-color: #3498db;
+            color: white;
+            padding: 12px;
+            text-align: left;
+            font-weight: 600;
+        }
+        td {
+            padding: 10px;
+            border-bottom: 1px solid #ddd;
+        }
+        tr:nth-child(even) {
+            background-color: #f9f9f9;
+        }
+        tr:hover {
+            background-color: #f0f7ff;
+        }
+        .premium-positive {
+            color: #e74c3c;
+            font-weight: bold;
+        }
+        .premium-negative {
+            color: #27ae60;
+            font-weight: bold;
+        }
+        .footer {
+            text-align: center;
+            margin-top: 30px;
+            padding-top: 20px;
+            border-top: 1px solid #ddd;
+            color: #7f8c8d;
+            font-size: 12px;
+        }
+        .section-title {
+            background-color: #34495e;
+            color: white;
+            padding: 10px 15px;
+            border-radius: 5px;
+            margin: 30px 0 15px 0;
+            font-size: 18px;
+        }
+    </style>
+"""
+
+HTML_TEMPLATE = ReportTemplate(
+    head="""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+""" + HTML_STYLE + """</head>
+<body>
+    <div class="container">
+""",
+    summary="""        <h1>📊 ETF/LOF溢价率排行榜</h1>
+        
+        <div style="text-align: center; color: #7f8c8d; margin-bottom: 20px;">
+            <p>📅 更新时间: <strong>{timestamp}</strong></p>
+            <p>📊 数据来源: akshare</p>
+        </div>
+        
+        <div class="stats">
+            <h2 style="margin-top: 0; text-align: center;">📈 统计概览</h2>
+            <div class="stats-grid">
+                <div class="stat-item">
+                    <div class="stat-label">总基金数量</div>
+                    <div class="stat-value">{total_count}</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">ETF数量</div>
+                    <div class="stat-value">{etf_count}</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">LOF数量</div>
+                    <div class="stat-value">{lof_count}</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">平均溢价率</div>
+                    <div class="stat-value">{avg_premium}%</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">最高溢价率</div>
+                    <div class="stat-value">{max_premium}%</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">最低溢价率</div>
+                    <div class="stat-value">{min_premium}%</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">溢价基金数量</div>
+                    <div class="stat-value">{premium_count}</div>
+                </div>
+                <div class="stat-item">
+                    <div class="stat-label">折价基金数量</div>
+                    <div class="stat-value">{discount_count}</div>
+                </div>
+            </div>
+        </div>
+""",
+    section_open="""        
+        <div class="section-title">{title}</div>
+        <table>
+            <thead>
+                <tr>
+                    <th>排名</th>
+                    <th>基金名称</th>
+                    <th>代码</th>
+                    <th>类型</th>
+                    <th>场内价</th>
+                    <th>场外价</th>
+                    <th>溢价率</th>
+                    <th>交易量</th>
+                    <th>申购状态</th>
+                    <th>赎回状态</th>
+                    <th>手续费</th>
+                </tr>
+            </thead>
+            <tbody>
+""",
+    row="""                <tr>
+                    <td>{rank}</td>
+                    <td>{name}</td>
+                    <td>{code}</td>
+                    <td>{fund_type}</td>
+                    <td>{spot}</td>
+                    <td>{nav}</td>
+                    <td class="{css_class}">{premium}</td>
+                    <td>{volume}</td>
+                    <td>{purchase_status}</td>
+                    <td>{redeem_status}</td>
+                    <td>{fee}</td>
+                </tr>
+""",
+    section_close="""            </tbody>
+        </table>
+""",
+    footer="""        
+        <div class="footer">
+            <p><strong>📝 说明</strong></p>
+            <p>• 溢价率 = (场内价格 - 场外价格) / 场外价格 × 100%</p>
+            <p>• 溢价率为正表示溢价，为负表示折价</p>
+            <p>• 🔺 表示溢价，🔻 表示折价</p>
+            <p>• 数据仅供参考，投资有风险，入市需谨慎</p>
+        </div>
+    </div>
+</body>
+</html>""",
+    empty="<html><body><p>未能获取到数据</p></body></html>",
+    escape=lambda value: html.escape(str(value), quote=False),
+)
+
+TEXT_TEMPLATE = ReportTemplate(
+    head="",
+    summary="""📊 ETF/LOF溢价率排行榜
+📅 更新时间: {timestamp}
+📊 数据来源: akshare
+
+📈 统计概览
+  总基金数量: {total_count}    ETF数量: {etf_count}    LOF数量: {lof_count}
+  平均溢价率: {avg_premium}%    最高溢价率: {max_premium}%    最低溢价率: {min_premium}%
+  溢价基金数量: {premium_count}    折价基金数量: {discount_count}
+""",
+    section_open="""
+{title}
+""",
+    row="""{rank:>4}. {name}（{code}，{fund_type}） 场内价 {spot} / 场外价 {nav}  溢价率 {premium}  交易量 {volume}  申购 {purchase_status} / 赎回 {redeem_status} / 手续费 {fee}
+""",
+    section_close="",
+    footer="""
+📝 说明
+• 溢价率 = (场内价格 - 场外价格) / 场外价格 × 100%
+• 溢价率为正表示溢价，为负表示折价
+• 数据仅供参考，投资有风险，入市需谨慎
+""",
+    empty="未能获取到数据\n",
+)
+
+MARKDOWN_TEMPLATE = ReportTemplate(
+    head="",
+    summary="""# 📊 ETF/LOF溢价率排行榜
+
+📅 更新时间: **{timestamp}** ｜ 📊 数据来源: akshare
+
+## 📈 统计概览
+
+| 总基金数量 | ETF数量 | LOF数量 | 平均溢价率 | 最高溢价率 | 最低溢价率 | 溢价基金数量 | 折价基金数量 |
+|---:|---:|---:|---:|---:|---:|---:|---:|
+| {total_count} | {etf_count} | {lof_count} | {avg_premium}% | {max_premium}% | {min_premium}% | {premium_count} | {discount_count} |
+""",
+    section_open="""
+## {title}
+
+| 排名 | 基金名称 | 代码 | 类型 | 场内价 | 场外价 | 溢价率 | 交易量 | 申购状态 | 赎回状态 | 手续费 |
+|---:|---|---|---|---:|---:|---:|---:|---|---|---|
+""",
+    row="""| {rank} | {name} | {code} | {fund_type} | {spot} | {nav} | {premium} | {volume} | {purchase_status} | {redeem_status} | {fee} |
+""",
+    section_close="",
+    footer="""
+> 溢价率 = (场内价格 - 场外价格) / 场外价格 × 100%，🔺 表示溢价，🔻 表示折价。数据仅供参考，投资有风险，入市需谨慎。
+""",
+    empty="未能获取到数据\n",
+    escape=lambda value: str(value).replace('|', '\\|'),
+)
+
+# 输出格式 -> 已编译模板
+REPORT_TEMPLATES = {
+    'html': HTML_TEMPLATE,
+    'text': TEXT_TEMPLATE,
+    'markdown': MARKDOWN_TEMPLATE,
+}
+
+ALERT_HTML_TEMPLATE = AlertTemplate(
+    head="""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+""" + HTML_STYLE + """</head>
+<body>
+    <div class="container">
+""",
+    summary="""        <h1>🔔 ETF/LOF溢价率变动提醒</h1>
+        
+        <div style="text-align: center; color: #7f8c8d; margin-bottom: 20px;">
+            <p>📅 更新时间: <strong>{timestamp}</strong> ｜ 共 <strong>{count}</strong> 条变动</p>
+        </div>
+        
+        <table>
+            <thead>
+                <tr>
+                    <th>变动</th>
+                    <th>基金名称</th>
+                    <th>代码</th>
+                    <th>变动前</th>
+                    <th>变动后</th>
+                    <th>溢价率</th>
+                </tr>
+            </thead>
+            <tbody>
+""",
+    row="""                <tr>
+                    <td>{event}</td>
+                    <td>{name}</td>
+                    <td>{code}</td>
+                    <td>{before}</td>
+                    <td>{after}</td>
+                    <td class="{css_class}">{premium}</td>
+                </tr>
+""",
+    footer="""            </tbody>
+        </table>
+        
+        <div class="footer">
+            <p>• 只列出与上一次快照相比发生变化的基金，完整排行榜见定时报告</p>
+            <p>• 数据仅供参考，投资有风险，入市需谨慎</p>
+        </div>
+    </div>
+</body>
+</html>""",
+    escape=lambda value: html.escape(str(value), quote=False),
+)
+
+ALERT_TEXT_TEMPLATE = AlertTemplate(
+    head="",
+    summary="""🔔 ETF/LOF溢价率变动提醒
+📅 更新时间: {timestamp}  共 {count} 条变动
+
+""",
+    row="""[{event}] {name}（{code}） {before} → {after}  溢价率 {premium}
+""",
+    footer="""
+• 只列出与上一次快照相比发生变化的基金，完整排行榜见定时报告
+""",
+)
+
+ALERT_MARKDOWN_TEMPLATE = AlertTemplate(
+    head="",
+    summary="""# 🔔 ETF/LOF溢价率变动提醒
+
+📅 更新时间: **{timestamp}** ｜ 共 **{count}** 条变动
+
+| 变动 | 基金名称 | 代码 | 变动前 | 变动后 | 溢价率 |
+|---|---|---|---|---|---:|
+""",
+    row="""| {event} | {name} | {code} | {before} | {after} | {premium} |
+""",
+    footer="",
+    escape=lambda value: str(value).replace('|', '\\|'),
+)
+
+# 输出格式 -> 变动提醒模板
+ALERT_TEMPLATES = {
+    'html': ALERT_HTML_TEMPLATE,
+    'text': ALERT_TEXT_TEMPLATE,
+    'markdown': ALERT_MARKDOWN_TEMPLATE,
+}